@@ -22,6 +22,18 @@ WSGI_WORKERS=${WSGI_WORKERS:=4}
 WSGI_WORKER_TIMEOUT=${WSGI_WORKER_TIMEOUT:=6000}
 WSGI_WORKER_CLASS=${WSGI_WORKER_CLASS:=gevent}
 
+# collection registry: "config" (default) registers new collections in
+# ${PYGEOAPI_CONFIG} and reloads the workers on changes, "database" serves them
+# from the collection_registry table without rewriting the config
+COLLECTION_REGISTRY=${COLLECTION_REGISTRY:=config}
+if [[ "${COLLECTION_REGISTRY}" == "database" ]]; then
+	WSGI_APP=atrai_processes.wsgi:APP
+	RELOAD_ARGS=()
+else
+	WSGI_APP=pygeoapi.flask_app:APP
+	RELOAD_ARGS=(--reload --reload-extra-file "${PYGEOAPI_CONFIG}")
+fi
+
 # Add the pygeoapi directory to the Python path
 export PYTHONPATH="${PYGEOAPI_HOME}/src:${PYTHONPATH}"
 
@@ -94,9 +106,8 @@ case ${entry_cmd} in
 				--timeout "${WSGI_WORKER_TIMEOUT}" \
 				--name="${CONTAINER_NAME}" \
 				--bind "${CONTAINER_HOST}:${CONTAINER_PORT}" \
-				--reload \
-				--reload-extra-file "${PYGEOAPI_CONFIG}" \
-				pygeoapi.flask_app:APP
+				"${RELOAD_ARGS[@]}" \
+				"${WSGI_APP}"
 		else
 			echo "Running in development mode"
 			exec gunicorn --workers "${WSGI_WORKERS}" \
@@ -104,9 +115,8 @@ case ${entry_cmd} in
 				--timeout "${WSGI_WORKER_TIMEOUT}" \
 				--name="${CONTAINER_NAME}" \
 				--bind "${CONTAINER_HOST}:${CONTAINER_PORT}" \
-				--reload \
-				--reload-extra-file "${PYGEOAPI_CONFIG}" \
-				pygeoapi.flask_app:APP
+				"${RELOAD_ARGS[@]}" \
+				"${WSGI_APP}"
 		fi
 	  ;;
 	*)
@@ -0,0 +1,76 @@
+"""
+Measures the import cost of the atrai_processes plugin with `python -X importtime`:
+importing the package, resolving single processors and resolving all
+processors (what pygeoapi does for /processes), compared with the former
+eager package import which pulled in every heavy dependency up front.
+
+usage: PYTHONPATH=src python maintenance/benchmark_import_time.py [Processor ...]
+"""
+import os
+import sys
+import json
+import subprocess
+
+# modules the package used to import at startup
+HEAVY_MODULES = [
+    "osmnx", "networkx", "movingpandas", "folium", "seaborn",
+    "matplotlib.pyplot", "sklearn.neighbors", "sklearn.cluster", "opensensemaptoolbox",
+]
+
+REPORT = f"""
+import sys, json
+print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))
+"""
+
+
+def measure(code):
+    """
+    Runs code in a fresh interpreter, returns the summed import time in
+    seconds, the number of imported modules and the loaded heavy modules.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code + REPORT],
+        capture_output=True, text=True, env=os.environ.copy(),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+
+    total_us = 0
+    n_modules = 0
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        total_us += int(line.split(":", 1)[1].split("|")[0])
+        n_modules += 1
+    heavy = json.loads(proc.stdout.strip().splitlines()[-1])
+    return total_us / 1e6, n_modules, heavy
+
+
+def main():
+    import atrai_processes
+
+    processors = sys.argv[1:] or atrai_processes.__all__
+    resolve_all = "; ".join(f"atrai_processes.{name}" for name in atrai_processes.__all__)
+    eager = "\n".join(
+        f"try:\n    import {module}\nexcept ImportError:\n    pass" for module in HEAVY_MODULES
+    )
+
+    scenarios = {"import atrai_processes": "import atrai_processes"}
+    for name in processors:
+        scenarios[name] = f"import atrai_processes; atrai_processes.{name}"
+    scenarios["all processors"] = f"import atrai_processes; {resolve_all}"
+    scenarios["former eager import"] = f"{eager}\nimport atrai_processes; {resolve_all}"
+
+    print(f"{'scenario':<26}{'time[s]':>9}{'modules':>9}  heavy modules")
+    for label, code in scenarios.items():
+        try:
+            elapsed, n_modules, heavy = measure(code)
+        except RuntimeError as err:
+            print(f"{label:<26}  failed: {err}")
+            continue
+        print(f"{label:<26}{elapsed:>9.2f}{n_modules:>9}  {', '.join(heavy) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Compares the point thinning methods of statistic_utils.process_tours on
+synthetic tours: runtime and deviation of the tour statistics from the
+DBSCAN reference.
+
+usage: PYTHONPATH=src python maintenance/benchmark_tour_thinning.py [n_boxes] [tours_per_box]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from atrai_processes.statistic_utils import process_tours
+
+
+def synthetic_rides(n_boxes=20, tours_per_box=20, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = []
+    for b in range(n_boxes):
+        n_points = rng.integers(50, 2000, size=tours_per_box)
+        # 1-8 s between measurements, 5-60 min break between tours
+        steps = [rng.integers(1, 8, size=n) for n in n_points]
+        durations = np.array([s.sum() for s in steps])
+        breaks = rng.integers(5 * 60, 60 * 60, size=tours_per_box)
+        offsets = np.concatenate([[0], np.cumsum(durations + breaks)[:-1]])
+        seconds = np.concatenate([s.cumsum() + offset for s, offset in zip(steps, offsets)])
+        dt = np.concatenate([np.diff(s.cumsum(), prepend=0) for s in steps])
+        # ~4 m/s with a slowly changing heading, standing at traffic lights
+        # and ~2 m of GPS noise
+        heading = rng.uniform(0, 2 * np.pi) + rng.normal(0, 0.1, size=len(seconds)).cumsum()
+        speed = np.where(rng.random(len(seconds)) < 0.2, 0, 4.0)
+        step = np.column_stack([np.cos(heading), np.sin(heading)]) * (speed * dt)[:, None] / 111139
+        noise = rng.normal(0, 2 / 111139, size=(len(seconds), 2))
+        coords = np.array([7.6, 51.9]) + rng.uniform(0, 0.05, 2) + step.cumsum(axis=0) + noise
+        frames.append(pd.DataFrame({
+            "boxId": f"box{b}",
+            "createdAt": pd.Timestamp("2024-05-01") + pd.to_timedelta(seconds, unit="s"),
+            "lng": coords[:, 0],
+            "lat": coords[:, 1],
+        }))
+    df = pd.concat(frames, ignore_index=True)
+    return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df["lng"], df["lat"]), crs="EPSG:4326")
+
+
+def main():
+    n_boxes = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    tours_per_box = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    data = synthetic_rides(n_boxes, tours_per_box)
+    print(f"{len(data)} points, {n_boxes} boxes")
+
+    results = {}
+    for method in ["dbscan", "sequential", "grid"]:
+        start = time.perf_counter()
+        tours = process_tours(data, interval=12, thinning=method)
+        results[method] = (time.perf_counter() - start, tours)
+
+    ref_time, ref = results["dbscan"]
+    print(f"{'method':<12}{'time[s]':>10}{'speedup':>10}{'tours':>8}{'distance[km]':>15}{'dev[%]':>9}{'duration[h]':>14}{'dev[%]':>9}")
+    for method, (elapsed, tours) in results.items():
+        distance = tours["distance"].sum()
+        duration = tours["duration"].sum()
+        print(
+            f"{method:<12}{elapsed:>10.2f}{ref_time / elapsed:>10.1f}{len(tours):>8}"
+            f"{distance / 1000:>15.1f}{(distance / ref['distance'].sum() - 1) * 100:>9.2f}"
+            f"{duration / 3600:>14.1f}{(duration / ref['duration'].sum() - 1) * 100:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
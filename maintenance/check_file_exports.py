@@ -0,0 +1,43 @@
+"""
+Exports the same collection twice with file_exports.export_files, as a
+rerun of a processor does, and checks that plain files are written and
+replaced without leftovers.
+
+usage: PYTHONPATH=src python maintenance/check_file_exports.py
+"""
+import os
+import sys
+import tempfile
+
+import geopandas as gpd
+from shapely.geometry import Point
+
+from atrai_processes.file_exports import export_files
+
+
+def main():
+    name = "bumpy_roads_check"
+    with tempfile.TemporaryDirectory() as out_dir:
+        for n_rows in (3, 5):
+            gdf = gpd.GeoDataFrame(
+                {"id": range(n_rows)}, geometry=[Point(7 + i / 100, 51) for i in range(n_rows)], crs="EPSG:4326"
+            )
+            paths = export_files(gdf, name, out_dir)
+
+        problems = [f"{path} is not a file" for path in paths.values() if not os.path.isfile(path)]
+        leftovers = sorted(set(os.listdir(out_dir)) - {os.path.basename(path) for path in paths.values()})
+        if leftovers:
+            problems.append(f"leftover files {leftovers}")
+        if not problems:
+            for key, path in paths.items():
+                n_read = len(gpd.read_parquet(path) if key == "parquet" else gpd.read_file(path))
+                if n_read != 5:
+                    problems.append(f"{path} holds {n_read} rows instead of 5")
+
+    for problem in problems or ["exported twice, files replaced"]:
+        print(problem)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Checks statistic_utils.calculate_periodic_stats against the implementation
+it replaced on synthetic tours: daily and weekly periods, with tz-naive and
+tz-aware (timestamptz as read from the tours table) start times.
+
+usage: PYTHONPATH=src python maintenance/check_periodic_stats.py
+"""
+import sys
+
+import numpy as np
+import pandas as pd
+
+from atrai_processes.statistic_utils import calculate_periodic_stats
+
+
+def previous_periodic_stats(tours_gdf):
+    # the former implementation, unchanged apart from working on a copy
+    tours_gdf = tours_gdf.copy()
+    weeks = tours_gdf["start_time"].dt.to_period("W").unique()
+    if len(weeks) < 2:
+        tours_gdf["period"] = tours_gdf["start_time"].dt.date
+    else:
+        tours_gdf["period"] = tours_gdf["start_time"].dt.to_period(
+            "W").apply(lambda r: r.start_time)
+
+    periodic_stats = tours_gdf.groupby("period").agg(
+        trip_count=("duration", "count"),
+        total_duration_s=("duration", "sum"),
+        average_duration_s=("duration", "mean"),
+        max_duration_s=("duration", "max"),
+        min_duration_s=("duration", "min"),
+        total_distance_m=("distance", "sum"),
+        average_distance_m=("distance", "mean"),
+        max_distance_m=("distance", "max"),
+        min_distance_m=("distance", "min"),
+        average_speed_kmh=("distance", lambda x: (
+            x / tours_gdf.loc[x.index, "duration"]).mean() * 3.6),
+        total_kcal=("kcal", "sum"),
+    ).reset_index().rename(columns={"period": "period_start"})
+
+    periodic_stats["period_start"] = periodic_stats["period_start"].astype(str)
+    periodic_stats["week"] = periodic_stats["period_start"]
+    return periodic_stats
+
+
+def synthetic_tours(days, n=200, tz=None, seed=0):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2024-05-01 06:00")
+    start_time = start + pd.to_timedelta(rng.uniform(0, days * 86400, size=n), unit="s")
+    tours = pd.DataFrame({
+        "start_time": start_time,
+        "duration": rng.uniform(120, 7200, size=n),
+        "distance": rng.uniform(500, 30000, size=n),
+        "kcal": rng.uniform(10, 800, size=n),
+    })
+    if tz is not None:
+        tours["start_time"] = tours["start_time"].dt.tz_localize(tz)
+    return tours
+
+
+def main():
+    failed = False
+    for days, periods in [(3, "daily"), (40, "weekly")]:
+        for tz in [None, "UTC", "Europe/Berlin"]:
+            tours = synthetic_tours(days, tz=tz)
+            expected = previous_periodic_stats(tours)
+            actual = calculate_periodic_stats(tours)
+            try:
+                pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+                status = "ok"
+            except AssertionError as err:
+                failed = True
+                status = f"MISMATCH\n{err}"
+            print(f"{periods:<7} tz={tz!s:<14} {len(expected):>3} periods, first '{expected['period_start'].iloc[0]}': {status}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Compares the per road segment aggregation in Python (map_points_to_road_segments)
+with the PostGIS one (aggregate_points_to_road_segments_in_db) of BumpyRoads
+and Distances for a campaign: same segment ids and values within tolerance.
+Runs against the database configured by the DATABASE_* variables.
+
+usage: PYTHONPATH=src python maintenance/compare_road_aggregation.py <campaign> [rtol]
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from atrai_processes.bumpy_roads import ROUGHNESS_SCORES, BumpyRoads
+from atrai_processes.distances_flowmap import Distances
+
+
+def compare(python_gdf, db_gdf, rtol):
+    """
+    Returns a list of differences between the two results, matched by id.
+    """
+    python_gdf = python_gdf.set_index("id")
+    db_gdf = db_gdf.set_index("id")
+    problems = []
+
+    only_python = python_gdf.index.difference(db_gdf.index)
+    only_db = db_gdf.index.difference(python_gdf.index)
+    if len(only_python) or len(only_db):
+        problems.append(f"segments only in python: {len(only_python)}, only in the database: {len(only_db)}")
+
+    common = python_gdf.index.intersection(db_gdf.index)
+    numeric = [
+        col for col in python_gdf.columns
+        if col in db_gdf.columns and pd.api.types.is_numeric_dtype(python_gdf[col]) and col != "index_right"
+    ]
+    for col in numeric:
+        left = python_gdf.loc[common, col].to_numpy(dtype=float)
+        right = db_gdf.loc[common, col].to_numpy(dtype=float)
+        close = np.isclose(left, right, rtol=rtol, equal_nan=True)
+        if not close.all():
+            problems.append(f"'{col}' differs for {(~close).sum()} of {len(common)} segments")
+
+    if "Overtaking Distance Counts" in python_gdf.columns:
+        same = python_gdf.loc[common, "Overtaking Distance Counts"] == db_gdf.loc[common, "Overtaking Distance Counts"]
+        if not same.all():
+            problems.append(f"'Overtaking Distance Counts' differs for {(~same).sum()} of {len(common)} segments")
+
+    return problems
+
+
+def main(campaign, rtol=1e-6):
+    request = {"campaign": campaign, "token": os.environ.get("INT_API_TOKEN", "token")}
+    cases = [
+        ("bumpy_roads", BumpyRoads({"name": "bumpy_roads"}), (ROUGHNESS_SCORES,)),
+        ("distances", Distances({"name": "distances"}), ()),
+    ]
+
+    failed = False
+    for name, processor, args in cases:
+        processor.check_request_params(request)
+        python_gdf = processor.aggregate(*args)
+        db_gdf = processor.aggregate_in_db(*args)
+        problems = compare(python_gdf, db_gdf, rtol)
+        failed = failed or bool(problems)
+        print(f"{name}: {len(python_gdf)} segments in python, {len(db_gdf)} in the database")
+        for problem in problems or ["identical within tolerance"]:
+            print(f"    {problem}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    sys.exit(main(sys.argv[1], *[float(arg) for arg in sys.argv[2:3]]))
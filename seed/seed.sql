@@ -2,6 +2,7 @@ CREATE EXTENSION IF NOT EXISTS postgis;
 CREATE EXTENSION IF NOT EXISTS postgis_topology;
 --CREATE TABLE IF NOT EXISTS road_roughness (id SERIAL PRIMARY KEY, geom GEOMETRY(Point, 4326), roughness FLOAT);
 CREATE TABLE IF NOT EXISTS osem_bike_data (index SERIAL PRIMARY KEY, geometry GEOMETRY(Point, 4326));
+CREATE TABLE IF NOT EXISTS collection_registry (name TEXT PRIMARY KEY, resource JSONB NOT NULL, updated_at TIMESTAMPTZ NOT NULL DEFAULT now());
 --CREATE TABLE IF NOT EXISTS distances_flowmap (
 --    id SERIAL PRIMARY KEY,
 --    "Average Overtaking Distance" FLOAT,
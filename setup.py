@@ -42,7 +42,9 @@ setuptools.setup(
         "numpy==1.24.0",
         "osmnx",
         "psycopg2-binary",
+        "pyarrow",
         "pygeoapi",
+        "pyrosm",
         "python-dotenv",
         "rasterio",
         "rioxarray",
@@ -1,15 +1,41 @@
-from .bumpy_roads import BumpyRoads
-from .temperature import Temperature
-from .distances_flowmap import Distances
-from .speed_traffic_flow import SpeedTrafficFlow
-from .pm_analysis import PMAnalysis
-from .dangerous_places import DangerousPlaces
-from .statistics import Statistics
-from .road_network import RoadNetwork
-from .osem_data_ingestion import OsemDataIngestion
-#from .Atrai_processor import AtraiProcessor
-from .simple_process import SimpleProcess
-from .collection_delete import CollectionDelete
-from .collection_healthcheck import CollectionHealthcheck
-from .data_ingestion import DataIngestion
-from .annotate_roads import AnnotateRoads
+"""
+The processors are resolved lazily (PEP 562): importing the package does not
+import the processor modules, `atrai_processes.BumpyRoads` imports
+bumpy_roads on first access. pygeoapi only pays for the processors it loads.
+"""
+import importlib
+
+# processor class -> module
+_PROCESSORS = {
+    "BumpyRoads": "bumpy_roads",
+    "Temperature": "temperature",
+    "Distances": "distances_flowmap",
+    "SpeedTrafficFlow": "speed_traffic_flow",
+    "PMAnalysis": "pm_analysis",
+    "DangerousPlaces": "dangerous_places",
+    "Statistics": "statistics",
+    "RoadNetwork": "road_network",
+    "OsemDataIngestion": "osem_data_ingestion",
+    "SimpleProcess": "simple_process",
+    "CollectionDelete": "collection_delete",
+    "CollectionHealthcheck": "collection_healthcheck",
+    "DataIngestion": "data_ingestion",
+    "AnnotateRoads": "annotate_roads",
+    "TrafficStops": "traffic_stops",
+}
+
+__all__ = list(_PROCESSORS)
+
+
+def __getattr__(name):
+    module = _PROCESSORS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    processor = getattr(importlib.import_module(f".{module}", __name__), name)
+    # cache it, later lookups do not pass through __getattr__
+    globals()[name] = processor
+    return processor
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_PROCESSORS))
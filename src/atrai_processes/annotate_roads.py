@@ -1,22 +1,26 @@
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
-from functools import partial
 import logging
 import multiprocessing
 import os
+import tempfile
 
 import geopandas as gpd
 from ast import literal_eval
-import movingpandas as mpd
 import numpy as np
 import pandas as pd
 from pygeoapi.process.base import BaseProcessor, ProcessorExecuteError
 from shapely.geometry import LineString
 
 from .atrai_processor import AtraiProcessor
-from .snapping import snap_to_roads
+from .snapshots import SNAPSHOT_DIR, open_snapshot, write_snapshot
+from .useful_functs import binned_counts, format_binned_counts
 
 LOGGER = logging.getLogger(__name__)
 
+# processes snapping the tours, 1 snaps them in the request process
+SNAPPING_WORKERS = int(os.environ.get("SNAPPING_WORKERS", "1"))
+
 METADATA = {
     "version": "0.2.0",
     "id": "annotate_roads",
@@ -101,12 +105,7 @@ def calculate_danger_zones(df):
 
     return df
 
-def histo(data):
-    clean_data = data.dropna()
-    bins = [0, 0.5, 1, 1.5, 2, np.inf]
-    counts, bin_edges = np.histogram(clean_data, bins=bins)
-    string = ", ".join(str(x) for x in counts)
-    return string
+OVERTAKING_HISTOGRAM_BINS = [0, 0.5, 1, 1.5, 2, np.inf]
 
 def filter_undirected_duplicates(gdf):
     def normalize_geom(geom):
@@ -120,13 +119,60 @@ def filter_undirected_duplicates(gdf):
     return out_gdf.drop(columns=['__uid'])
 
 
+# snapshots opened by a snapping worker process
+_SNAPPING = {}
+
+
+def _init_snapping_worker(roads_path, tours_path):
+    _SNAPPING["roads"] = open_snapshot(roads_path).frame()
+    _SNAPPING["tours"] = open_snapshot(tours_path)
+
+
+def _snap_tour(i):
+    from .snapping import snap_to_roads
+
+    tours = _SNAPPING["tours"]
+    bounds = tours.arrays["tour_offsets"]
+    tour = tours.frame(int(bounds[i]), int(bounds[i + 1]))
+    return snap_to_roads(road_df=_SNAPPING["roads"], traject_df=tour)
+
+
+def snap_tours_parallel(tours, road_segments, workers):
+    """
+    Snaps the tours in a pool of spawned processes. Roads and tours are
+    handed over as memory mapped snapshots, the workers share them instead
+    of unpickling a copy of the road network per task.
+    Returns:
+        list: The snapped tours in the order of `tours`.
+    """
+    with tempfile.TemporaryDirectory(prefix="snapping.", dir=SNAPSHOT_DIR) as tmp:
+        roads_path = write_snapshot(road_segments, os.path.join(tmp, "roads"))
+        bounds = np.cumsum([0] + [len(tour) for tour in tours])
+        tours_path = write_snapshot(pd.concat(tours), os.path.join(tmp, "tours"), arrays={"tour_offsets": bounds})
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_snapping_worker,
+            initargs=(roads_path, tours_path),
+        ) as pool:
+            return list(pool.map(_snap_tour, range(len(tours))))
+
+
 class AnnotateRoads(AtraiProcessor):
     def __init__(self, processor_def):
         super().__init__(processor_def, METADATA)
 
     def execute(self, data):
+        # movingpandas and the snapping dependencies are only imported when the process runs
+        import movingpandas as mpd
+        from .snapping import snap_to_roads
+
         # check params
         self.check_request_params(data)
+        cached = self.memoized_result(data)
+        if cached is not None:
+            return cached
         # load data
         atrai_bike_data = self.load_bike_data().to_crs("EPSG:3857").dropna(subset=['geometry'])
         road_segments = filter_undirected_duplicates(self.load_road_data().to_crs("EPSG:3857").dropna(subset=['geometry']))
@@ -138,18 +184,18 @@ class AnnotateRoads(AtraiProcessor):
         # tc.add_direction()
         split = mpd.ObservationGapSplitter(tc).split(gap=timedelta(minutes=15))
 
-        #snap each tour to roads using multiprocessing
+        #snap each tour to roads, in parallel if SNAPPING_WORKERS is set
         LOGGER.info("snapping")
+        tours = [traj.df for traj in split.trajectories]
 
-        # func = partial(worker, road_network=road_segments)
-        # ctx = multiprocessing.get_context('spawn')
-        # with ctx.Pool(processes=os.cpu_count()) as pool:
-        #     results = pool.map(func, split.trajectories)
-
-        results = []
-        for i, traj in enumerate(split.trajectories):
-            LOGGER.info(f"processing {i} / {len(split.trajectories)} tours")
-            results.append(snap_to_roads(road_df=road_segments, traject_df=traj.df))
+        if SNAPPING_WORKERS > 1 and len(tours) > 1:
+            LOGGER.info(f"snapping {len(tours)} tours with {SNAPPING_WORKERS} processes")
+            results = snap_tours_parallel(tours, road_segments, SNAPPING_WORKERS)
+        else:
+            results = []
+            for i, tour in enumerate(tours):
+                LOGGER.info(f"processing {i} / {len(tours)} tours")
+                results.append(snap_to_roads(road_df=road_segments, traject_df=tour))
 
         LOGGER.info("snapping done")
 
@@ -175,8 +221,15 @@ class AnnotateRoads(AtraiProcessor):
         danger_zones.name = 'danger_zone_traffic'
 
         mask_overtake = all_snapped['Overtaking Manoeuvre'] >= 0.5
-        overtaking_histo = all_snapped[mask_overtake].groupby('way_id')['Overtaking Distance'].apply(histo)
+        overtaking = all_snapped[mask_overtake]
+        overtaking_counts = binned_counts(
+            overtaking['Overtaking Distance'],
+            overtaking['way_id'],
+            OVERTAKING_HISTOGRAM_BINS
+        )
+        overtaking_histo = format_binned_counts(overtaking_counts)
         overtaking_histo.name = 'overtaking_histogram'
+        overtaking_counts.columns = [f"overtaking_histogram_{col}" for col in overtaking_counts.columns]
 
         road_df_with_metrics = road_segments.join([avg_speeds,
                                              avg_dist,
@@ -184,7 +237,8 @@ class AnnotateRoads(AtraiProcessor):
                                              avg_traffic_flow,
                                              road_roughness,
                                              danger_zones,
-                                             overtaking_histo
+                                             overtaking_histo,
+                                             overtaking_counts
                                              ], how='left')
 
         road_df_with_metrics = road_df_with_metrics.to_crs("EPSG:4326")
@@ -210,7 +264,7 @@ class AnnotateRoads(AtraiProcessor):
             "id": "annotat_roads",
             "status": f"Processed {len(road_df_with_metrics)} road segments with bike data"
         }
-        return self.mimetype, outputs
+        return self.memoize_result(self.mimetype, outputs)
 
     def __repr__(self):
         return f"<AnnotateRoads> {self.name}"
\ No newline at end of file
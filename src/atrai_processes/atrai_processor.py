@@ -2,12 +2,17 @@ import os
 import logging
 from pygeoapi.process.base import BaseProcessor, ProcessorExecuteError
 
-from sqlalchemy import create_engine, text
-import pandas as pd
+from sqlalchemy import text
 import geopandas as gpd
 import datetime
-import yaml
-from filelock import FileLock
+
+from config.db_config import get_shared_engine
+
+from .vector_tiles import TILE_MAX_ZOOM, TILE_MIN_ZOOM, render_tiles
+from .file_exports import export_files, export_links, export_providers
+from .map_points_to_road_network import ensure_segment_ids
+from . import memoization, resource_registry, run_cache
+from .metatable import get_metatable
 
 LOGGER = logging.getLogger(__name__)
 
@@ -19,6 +24,11 @@ class AtraiProcessor(BaseProcessor):
         self.secret_token = os.environ.get('INT_API_TOKEN', 'token')
         self.data_base_dir = os.environ.get('BASE_DATA_DIR')
         self.html_out = os.environ.get('HTML_OUT_DIR')
+        # vector tiles of the collections are only rendered if set
+        self.tile_out = os.environ.get('TILE_OUT_DIR')
+        # GeoParquet / FlatGeobuf exports of the collections are only written if set
+        self.export_out = os.environ.get('EXPORT_OUT_DIR')
+        self.export_base_url = os.environ.get('EXPORT_BASE_URL')
         self.config_file = os.environ.get('PYGEOAPI_CONFIG')
         self.metatable_path = os.environ.get('META_TABLE_PATH')
         self.db_host = os.environ.get("DATABASE_HOST", "localhost")
@@ -26,7 +36,8 @@ class AtraiProcessor(BaseProcessor):
         self.db_name = os.environ.get("DATABASE_NAME", "geoapi_db")
         self.db_user = os.environ.get("DATABASE_USER", "postgres")
         self.db_password = os.environ.get("DATABASE_PASSWORD", "postgres")
-        self.db_engine = create_engine(
+        # shared by all processor instances of the worker process
+        self.db_engine = get_shared_engine(
             f"postgresql://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
         )
 
@@ -36,11 +47,21 @@ class AtraiProcessor(BaseProcessor):
         self.boxId = None
         self.col_create = None
         self.token = None
-        self.metatable = pd.read_csv(self.metatable_path)
+        self.run_id = None
+        self.data_cache = None
 
         self.id_field = 'id'
         self.mimetype = "application/json"
         self.data = None
+        # tables written by the current request and its memoization key/data version
+        self.result_tables = []
+        self.memo_key = None
+        self.memo_version = None
+
+    @property
+    def metatable(self):
+        # shared by all processor instances, reloaded when the csv changes
+        return get_metatable(self.metatable_path)
 
     def check_request_params(self, data):
         # example data
@@ -63,6 +84,10 @@ class AtraiProcessor(BaseProcessor):
         self.t_end = data.get('t_end')
         self.col_create = data.get('col_create')
         self.token = data.get('token')
+        # collections of a pipeline run are registered together at its end
+        self.run_id = data.get('run_id')
+        # opt-in: bike and road data are fetched once per pipeline run and shared on local disk
+        self.data_cache = data.get('data_cache')
 
         self.title = None
 
@@ -84,13 +109,25 @@ class AtraiProcessor(BaseProcessor):
             LOGGER.error(msg)
             raise ProcessorExecuteError(msg)
 
-        if self.campaign and self.campaign not in self.metatable['location'].values:
-            msg = f""" '{self.campaign}' is not in metatable. Valid values are '{", ".join([c for c in self.metatable['location'].unique()])}' """
+        metatable = self.metatable
+
+        if self.campaign and not metatable.has_campaign(self.campaign):
+            msg = f""" '{self.campaign}' is not in metatable. Valid values are '{", ".join(metatable.campaigns)}' """
             LOGGER.error(msg)
             raise ProcessorExecuteError(msg)
 
-        if self.boxId and not all(i in self.metatable['id'].values for i in self.boxId):
-            msg = f""" ""'{self.boxId}' is not in metatable. Valid values are {", ".join([c for c in self.metatable['id'].unique()])} """
+        if self.boxId and not all(metatable.has_box(i) for i in self.boxId):
+            msg = f""" ""'{self.boxId}' is not in metatable. Valid values are {", ".join(metatable.box_ids)} """
+            LOGGER.error(msg)
+            raise ProcessorExecuteError(msg)
+
+        if self.run_id is not None and not resource_registry.valid_run_id(self.run_id):
+            msg = f"run_id '{self.run_id}' may only contain letters, digits, '-' and '_'"
+            LOGGER.error(msg)
+            raise ProcessorExecuteError(msg)
+
+        if self.data_cache is not None and not resource_registry.valid_run_id(self.data_cache):
+            msg = f"data_cache '{self.data_cache}' may only contain letters, digits, '-' and '_'"
             LOGGER.error(msg)
             raise ProcessorExecuteError(msg)
 
@@ -105,14 +142,21 @@ class AtraiProcessor(BaseProcessor):
             self.col_create = False
 
 
-    def load_bike_data(self):
-        sql_base = "SELECT * FROM osem_bike_data"
+    def bike_data_filters(self, since=None):
+        """
+        SQL conditions and bind parameters selecting the requested measurements
+        from osem_bike_data, shared by `load_bike_data` and queries that
+        aggregate in the database.
+        Args:
+            since: Only measurements from this time on, either one timestamp
+                or a dict with the time per box id where None selects all
+                measurements of the box.
+        """
         filters = []
         params = {}
 
         if self.campaign:
-            ids = self.metatable['id'][self.metatable['location'] == self.campaign]
-            self.boxId = [id for id in ids]
+            self.boxId = self.metatable.boxes_of(self.campaign)
 
         if self.boxId:
             filters.append(""" "boxId" = ANY(:box_ids)""")
@@ -123,6 +167,33 @@ class AtraiProcessor(BaseProcessor):
             params["t_start"] = self.t_start
             params["t_end"] = self.t_end
 
+        # only measurements newer than a watermark of a previous run
+        if isinstance(since, dict):
+            # boxes without a usable watermark are loaded completely, continued boxes from their own time on
+            conditions = [""" "boxId" = ANY(:recompute_ids)"""]
+            params["recompute_ids"] = [box_id for box_id, ts in since.items() if ts is None]
+            continued = [(box_id, ts) for box_id, ts in since.items() if ts is not None]
+            for i, (box_id, ts) in enumerate(continued):
+                conditions.append(f"""("boxId" = :since_box_{i} AND "createdAt" >= :since_{i})""")
+                params[f"since_box_{i}"] = box_id
+                params[f"since_{i}"] = ts
+            filters.append(f"""({" OR ".join(conditions)})""")
+        elif since is not None:
+            filters.append(""" "createdAt" >= :since""")
+            params["since"] = since
+
+        return filters, params
+
+    def load_bike_data(self, since=None):
+        if self.data_cache:
+            _, params = self.bike_data_filters(since)
+            return run_cache.cached_frame(self.data_cache, "bike", params, lambda: self.query_bike_data(since))
+        return self.query_bike_data(since)
+
+    def query_bike_data(self, since=None):
+        sql_base = "SELECT * FROM osem_bike_data"
+        filters, params = self.bike_data_filters(since)
+
         # combine filters
         if filters:
             sql_base += " WHERE " + " AND ".join(filters)
@@ -132,10 +203,65 @@ class AtraiProcessor(BaseProcessor):
         return gdf
 
 
+    def memoized_result(self, data):
+        """
+        Returns the outputs of an earlier identical request if the involved
+        measurements and road network did not change since, otherwise None.
+        Call after `check_request_params`. The input `force` recomputes and
+        replaces the stored result.
+        """
+        self.result_tables = []
+        self.memo_key = None
+        if not memoization.MEMOIZATION:
+            return None
+
+        filters, params = self.bike_data_filters()
+        request = dict(data, campaign=self.campaign, boxId=sorted(self.boxId or []), col_create=self.col_create)
+        try:
+            with self.db_engine.begin() as conn:
+                version = memoization.data_version(
+                    conn, filters, params, self.road_data_table() if self.campaign else None
+                )
+                key = memoization.request_key(type(self).__name__, request)
+                result = None if data.get("force") else memoization.lookup_result(conn, key, version)
+        except Exception as err:
+            LOGGER.warning(f"result memoization unavailable: {err}")
+            return None
+
+        self.memo_key, self.memo_version = key, version
+        if result is not None:
+            LOGGER.info(f"{type(self).__name__}: input data unchanged, returning the stored result")
+        return result
+
+    def memoize_result(self, mimetype, outputs):
+        """
+        Stores the outputs of the request for `memoized_result` and returns them.
+        """
+        if self.memo_key is not None and self.result_tables:
+            try:
+                with self.db_engine.begin() as conn:
+                    memoization.store_result(
+                        conn, self.memo_key, type(self).__name__, self.memo_version,
+                        mimetype, outputs, self.result_tables
+                    )
+            except Exception as err:
+                LOGGER.warning(f"could not store the result for memoization: {err}")
+        return mimetype, outputs
+
+    def road_data_table(self):
+        return f"bike_road_network_{self.campaign}"
+
     def load_road_data(self):
-        road_network_query = f"SELECT * FROM bike_road_network_{self.campaign}"
+        road_network_query = f"SELECT * FROM {self.road_data_table()}"
 
-        gdf = gpd.read_postgis(road_network_query, self.db_engine, geom_col="geometry")
+        def query():
+            ensure_segment_ids(self.db_engine, self.road_data_table())
+            return gpd.read_postgis(road_network_query, self.db_engine, geom_col="geometry")
+
+        if self.data_cache:
+            gdf = run_cache.cached_frame(self.data_cache, "road", {"table": self.road_data_table()}, query)
+        else:
+            gdf = query()
         if len(gdf) == 0:
             raise ProcessorExecuteError("No road network data found")
         return gdf
@@ -151,55 +277,102 @@ class AtraiProcessor(BaseProcessor):
             self.title = f"""{collection_prefix}_{self.campaign}_{self.t_start.split('T')[0].replace('-', '') }_{self.t_end.split('T')[0].replace('-', '') }"""
         else:
             self.title = f"""{collection_prefix}_NOINFO"""
+        self.result_tables.append(self.title)
+        self.forget_memoized(self.title)
+
+    def forget_memoized(self, table):
+        # stored results of other requests must not point to the table once it is rewritten
+        if not memoization.MEMOIZATION:
+            return
+        try:
+            with self.db_engine.begin() as conn:
+                memoization.forget_tables(conn, [table])
+        except Exception as err:
+            LOGGER.warning(f"could not invalidate stored results of '{table}': {err}")
 
     def read_config(self):
-        with open(self.config_file, "r") as file:
-            LOGGER.debug("read config")
-            return yaml.safe_load(file)
+        return resource_registry.read_config(self.config_file)
 
     def write_config(self, new_config):
-        with open(self.config_file, "w") as outfile:
-            yaml.dump(new_config, outfile, default_flow_style=False)
-        LOGGER.debug("updated config")
+        resource_registry.write_config(self.config_file, new_config)
 
     def update_config(self):
-        lock = FileLock(f"{self.config_file}.lock")
-
         if self.data is not None and isinstance(self.data, gpd.GeoDataFrame):
             min_x, min_y, max_x, max_y = [float(val) for val in self.data.total_bounds]
         else:
             min_x, min_y, max_x, max_y = [-90, -180, 90, 180]
 
-        with lock:
-            config = self.read_config()
-            config["resources"][f"{self.title}"] = {
-                "type": "collection",
-                "title": f"{self.title}",
-                "description": f"{self.title}",
-                "keywords": ["country"],
-                "extents": {
-                    "spatial": {
-                        "bbox": [min_x, min_y, max_x, max_y],
-                        "crs": "http://www.opengis.net/def/crs/EPSG/0/4326",
+        # render the tiles before taking the lock, it can take a while.
+        # tiles and file exports are optional, the collection is registered without them if they fail
+        tile_dir = None
+        if self.tile_out and isinstance(self.data, gpd.GeoDataFrame) and not self.data.empty:
+            try:
+                tile_dir, n_tiles = render_tiles(self.db_engine, self.title, self.data, self.tile_out)
+                LOGGER.info(f"rendered {n_tiles} vector tiles for '{self.title}'")
+            except Exception as err:
+                LOGGER.error(f"rendering vector tiles of '{self.title}' failed: {err}")
+
+        export_paths = None
+        if self.export_out and isinstance(self.data, gpd.GeoDataFrame) and not self.data.empty:
+            try:
+                export_paths = export_files(self.data, self.title, self.export_out)
+            except Exception as err:
+                LOGGER.error(f"exporting '{self.title}' to files failed: {err}")
+
+        resource = {
+            "type": "collection",
+            "title": f"{self.title}",
+            "description": f"{self.title}",
+            "keywords": ["country"],
+            "extents": {
+                "spatial": {
+                    "bbox": [min_x, min_y, max_x, max_y],
+                    "crs": "http://www.opengis.net/def/crs/EPSG/0/4326",
+                },
+            },
+            "providers": [
+                {
+                    "type": "feature",
+                    "name": "PostgreSQL",
+                    "data": {
+                        "host": self.db_host,
+                        "port": self.db_port,
+                        "dbname": self.db_name,
+                        "user": self.db_user,
+                        "password": self.db_password,
+                        "search_path": ["public"],
                     },
+                    "id_field": f"{self.id_field}",
+                    "table": f"{self.title}",
+                    "geom_field": "geometry",
+                }
+            ],
+        }
+        if export_paths:
+            # the database stays the provider answering the feature requests
+            resource["providers"][0]["default"] = True
+            resource["providers"].extend(export_providers(export_paths, self.title, self.id_field))
+            if self.export_base_url:
+                resource["links"] = export_links(export_paths, self.title, self.export_base_url)
+        if tile_dir:
+            resource["providers"].append({
+                "type": "tile",
+                "name": "MVT-tippecanoe",
+                "data": tile_dir,
+                "options": {
+                    "zoom": {"min": TILE_MIN_ZOOM, "max": TILE_MAX_ZOOM},
+                    "schemes": ["WebMercatorQuad"],
+                },
+                "format": {
+                    "name": "pbf",
+                    "mimetype": "application/vnd.mapbox-vector-tile",
                 },
-                "providers": [
-                    {
-                        "type": "feature",
-                        "name": "PostgreSQL",
-                        "data": {
-                            "host": self.db_host,
-                            "port": self.db_port,
-                            "dbname": self.db_name,
-                            "user": self.db_user,
-                            "password": self.db_password,
-                            "search_path": ["public"],
-                        },
-                        "id_field": f"{self.id_field}",
-                        "table": f"{self.title}",
-                        "geom_field": "geometry",
-                    }
-                ],
-            }
-
-            self.write_config(config)
\ No newline at end of file
+            })
+
+        if resource_registry.REGISTRY == "database":
+            # picked up by the workers at request time, no config write needed
+            resource_registry.store_resources(self.db_engine, {self.title: resource})
+        elif self.run_id:
+            resource_registry.stage_resources(self.config_file, self.run_id, {self.title: resource})
+        else:
+            resource_registry.register_resources(self.config_file, {self.title: resource})
\ No newline at end of file
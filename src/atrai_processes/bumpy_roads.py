@@ -1,6 +1,14 @@
 import os
+import json
+import hashlib
 import logging
-from .map_points_to_road_network import map_points_to_road_segments
+import numbers
+import numpy as np
+import pandas as pd
+from .map_points_to_road_network import (
+    aggregate_points_to_road_segments_in_db,
+    map_points_to_road_segments,
+)
 from pygeoapi.process.base import BaseProcessor, ProcessorExecuteError
 from .atrai_processor import AtraiProcessor
 
@@ -38,6 +46,16 @@ METADATA = {
             "description": "identify yourself",
             "schema": {"type": "string"},
         },
+        "roughness_scores": {
+            "title": "roughness scores",
+            "description": "optional numeric weights per surface type, defaults {'Asphalt': 1, 'Paving': 2, 'Compacted': 3, 'Sett': 4}. Surface types left out keep their default weight, at least one weight must be positive. Custom weights are stored in a separate bumpy_roads_custom_<hash> collection",
+            "schema": {"type": "object"},
+        },
+        "aggregate_in_db": {
+            "title": "aggregate in database",
+            "description": "snap and aggregate the points per road segment in PostGIS instead of loading them",
+            "schema": {"type": "boolean"},
+        },
     },
     "outputs": {
         "id": {
@@ -69,16 +87,54 @@ def get_color(roughness):
         return "red"
 
 
-# Function to calculate roughness score
-def calculate_roughness(
-    row, roughness_scores=dict(Asphalt=1, Paving=2, Compacted=3, Sett=4)
-):
-    score = 0
-    score += roughness_scores["Asphalt"] * (row["Surface Asphalt"])
-    score += roughness_scores["Paving"] * (row["Surface Paving"])
-    score += roughness_scores["Compacted"] * (row["Surface Compacted"])
-    score += roughness_scores["Sett"] * (row["Surface Sett"])
-    return score
+ROUGHNESS_SCORES = dict(Asphalt=1, Paving=2, Compacted=3, Sett=4)
+
+
+def validate_roughness_scores(roughness_scores):
+    """
+    Raises a ProcessorExecuteError unless roughness_scores maps known
+    surface types to numeric weights. Surface types left out keep their
+    default weight.
+    Returns:
+        dict: The weights of all surface types.
+    """
+    if not isinstance(roughness_scores, dict):
+        raise ProcessorExecuteError(f"roughness_scores must be an object, e.g. {ROUGHNESS_SCORES}")
+    unknown = set(roughness_scores) - set(ROUGHNESS_SCORES)
+    if unknown:
+        raise ProcessorExecuteError(
+            f"unknown surface types {sorted(unknown)}, valid values are {list(ROUGHNESS_SCORES)}"
+        )
+    invalid = [
+        surface for surface, weight in roughness_scores.items()
+        if isinstance(weight, bool) or not isinstance(weight, numbers.Real) or not np.isfinite(weight)
+    ]
+    if invalid:
+        raise ProcessorExecuteError(f"weights of {sorted(invalid)} must be numbers")
+
+    roughness_scores = {**ROUGHNESS_SCORES, **roughness_scores}
+    # the roughness is normalized by its maximum
+    if max(roughness_scores.values()) <= 0:
+        raise ProcessorExecuteError(f"at least one weight must be positive, got {roughness_scores}")
+    return roughness_scores
+
+
+def roughness_collection_prefix(roughness_scores):
+    """
+    Collection prefix of a result, custom weights get their own collection
+    instead of overwriting the one of the default weights.
+    """
+    if roughness_scores == ROUGHNESS_SCORES:
+        return "bumpy_roads"
+    digest = hashlib.sha1(json.dumps(roughness_scores, sort_keys=True).encode()).hexdigest()[:8]
+    return f"bumpy_roads_custom_{digest}"
+
+
+# Function to calculate roughness score as weighted sum of the surface columns
+def calculate_roughness(df, roughness_scores=ROUGHNESS_SCORES):
+    surface_columns = [f"Surface {surface}" for surface in roughness_scores]
+    weights = np.array(list(roughness_scores.values()), dtype=float)
+    return pd.Series(df[surface_columns].to_numpy(dtype=float) @ weights, index=df.index)
 
 
 class BumpyRoads(AtraiProcessor):
@@ -89,53 +145,24 @@ class BumpyRoads(AtraiProcessor):
     def execute(self, data):
         # check params
         self.check_request_params(data)
-        # load data
-        atrai_bike_data = self.load_bike_data()
-        road_segments = self.load_road_data()
-
-        # process data
-        road_roughness = atrai_bike_data.dropna(
-            subset=[
-                "Surface Asphalt",
-                "Surface Sett",
-                "Surface Compacted",
-                "Surface Paving",
-            ]
-        ).copy()
-
-        road_roughness["Roughness"] = road_roughness.apply(calculate_roughness, axis=1)
-        road_roughness["Roughness_Normalized"] = (
-            road_roughness["Roughness"] / road_roughness["Roughness"].max()
-        ) * 100
-        road_roughness_clean = road_roughness.dropna(subset=["Roughness_Normalized"]).copy()
-
-        road_roughness_clean["id"] = road_roughness_clean.index
-        road_roughness_clean = road_roughness_clean.drop(
-            columns=[
-                "Temperature",
-                "Rel. Humidity",
-                "Finedust PM1",
-                "Finedust PM2.5",
-                "Finedust PM4",
-                "Finedust PM10",
-                "Overtaking Manoeuvre",
-                "Overtaking Distance",
-                "Surface Anomaly",
-                "Speed",
-            ],
-            errors="ignore"
-        )
-
-        roughness_flowmap = map_points_to_road_segments(
-            point_gdf=road_roughness_clean,
-            road_segments=road_segments,
-            numeric_columns=["Roughness", "Roughness_Normalized"],
-            id_column="id"
-        )
+        try:
+            roughness_scores = validate_roughness_scores(data.get("roughness_scores") or {})
+        except ProcessorExecuteError as err:
+            LOGGER.error(err)
+            raise
+        # partial and complete weights of the same result share it
+        cached = self.memoized_result(dict(data, roughness_scores=roughness_scores))
+        if cached is not None:
+            return cached
+
+        if data.get("aggregate_in_db"):
+            roughness_flowmap = self.aggregate_in_db(roughness_scores)
+        else:
+            roughness_flowmap = self.aggregate(roughness_scores)
 
         # assign result to self.data
         self.data = roughness_flowmap
-        self.create_collection_entries('bumpy_roads')
+        self.create_collection_entries(roughness_collection_prefix(roughness_scores))
 
         # write result
         roughness_flowmap.to_postgis(
@@ -154,7 +181,55 @@ class BumpyRoads(AtraiProcessor):
             "status": f"Processed {len(roughness_flowmap)} road segments with roughness data"
         }
 
-        return self.mimetype, outputs
+        return self.memoize_result(self.mimetype, outputs)
+
+    def aggregate(self, roughness_scores):
+        # load data
+        atrai_bike_data = self.load_bike_data()
+        road_segments = self.load_road_data()
+
+        # process data
+        surface_columns = [f"Surface {surface}" for surface in roughness_scores]
+        valid = atrai_bike_data[surface_columns].notna().all(axis=1)
+
+        road_roughness = atrai_bike_data.loc[valid, ["boxId", "geometry"]].copy()
+        road_roughness["Roughness"] = calculate_roughness(
+            atrai_bike_data.loc[valid, surface_columns], roughness_scores
+        )
+        road_roughness["Roughness_Normalized"] = (
+            road_roughness["Roughness"] / road_roughness["Roughness"].max()
+        ) * 100
+        road_roughness_clean = road_roughness.dropna(subset=["Roughness_Normalized"]).copy()
+        road_roughness_clean["id"] = road_roughness_clean.index
+
+        roughness_flowmap = map_points_to_road_segments(
+            point_gdf=road_roughness_clean,
+            road_segments=road_segments,
+            numeric_columns=["Roughness", "Roughness_Normalized"],
+            id_column="id"
+        )
+
+        return roughness_flowmap
+
+    def aggregate_in_db(self, roughness_scores):
+        # same weighted sum as calculate_roughness, surface names are validated
+        roughness = " + ".join(
+            f'{float(weight)} * "Surface {surface}"' for surface, weight in roughness_scores.items()
+        )
+        filters, params = self.bike_data_filters()
+        filters += [f'"Surface {surface}" IS NOT NULL' for surface in roughness_scores]
+
+        return aggregate_points_to_road_segments_in_db(
+            self.db_engine,
+            self.road_data_table(),
+            point_columns={
+                "Roughness": f"({roughness})",
+                "Roughness_Normalized": f"({roughness}) / NULLIF(MAX({roughness}) OVER (), 0) * 100",
+            },
+            point_filters=filters,
+            params=params,
+            id_column="id"
+        )
 
     def __repr__(self):
         return f"<BumpyRoads> {self.name}"
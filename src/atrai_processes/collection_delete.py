@@ -1,11 +1,14 @@
 import logging
 import os
-from sqlalchemy import create_engine, MetaData, Table
+import shutil
+from sqlalchemy import MetaData, Table
 
 import requests
 import yaml
 from pygeoapi.process.base import BaseProcessor, ProcessorExecuteError
 from .atrai_processor import AtraiProcessor
+from . import resource_registry
+from config.db_config import DatabaseConfig, get_shared_engine
 
 
 LOGGER = logging.getLogger(__name__)
@@ -67,6 +70,9 @@ class CollectionDelete(BaseProcessor):
             data = yaml.safe_load(f)
 
         resources = data["resources"]
+        if resource_registry.REGISTRY == "database":
+            registry_engine = DatabaseConfig().get_engine()
+            resources.update(resource_registry.load_resources(registry_engine))
 
 
         for col in self.col_name:
@@ -82,7 +88,7 @@ class CollectionDelete(BaseProcessor):
                             f"{db_config['dbname']}"
                         )
                         try:
-                            engine = create_engine(connection_string)
+                            engine = get_shared_engine(connection_string)
                             meta = MetaData()
                             table_to_drop = Table(table_name, meta)
                             meta.drop_all(engine, tables=[table_to_drop], checkfirst=True)
@@ -90,9 +96,17 @@ class CollectionDelete(BaseProcessor):
                             print(f"Table '{table_name}' has been successfully dropped.")
                         except Exception as e:
                             print(f"Error dropping table: {e}")
+                    for provider in del_col['providers']:
+                        if provider['name'] == "MVT-tippecanoe" and os.path.isdir(provider['data']):
+                            shutil.rmtree(provider['data'], ignore_errors=True)
+                        if provider['name'] in ("Parquet", "OGR") and os.path.isfile(provider['data']['source']):
+                            os.remove(provider['data']['source'])
 
 
 
+        if resource_registry.REGISTRY == "database":
+            resource_registry.delete_resources(registry_engine, self.col_name)
+
         outputs = {"id": "del col", "value": f"{self.col_name} deleted"}
         LOGGER.debug("return")
         return mimetype, outputs
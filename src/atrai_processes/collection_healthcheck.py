@@ -5,6 +5,9 @@ import requests
 import yaml
 from pygeoapi.process.base import BaseProcessor
 
+from . import resource_registry
+from config.db_config import DatabaseConfig
+
 LOGGER = logging.getLogger(__name__)
 
 PROCESS_METADATA = {
@@ -53,9 +56,14 @@ class CollectionHealthcheck(BaseProcessor):
         with open(self.serv_config, "r") as f:
             data = yaml.safe_load(f)
 
+        resources = list(data["resources"])
+        if resource_registry.REGISTRY == "database":
+            registered = resource_registry.load_resources(DatabaseConfig().get_engine())
+            resources += [ds for ds in registered if ds not in data["resources"]]
+
         faulty = []
 
-        for ds in data["resources"]:
+        for ds in resources:
             url = os.path.join(self.col_base_url, ds)
             res = requests.get(url)
             print(ds, res.status_code)
@@ -2,6 +2,7 @@ import logging
 from .atrai_processor import AtraiProcessor
 
 from .useful_functs import  replace_outliers_with_nan_by_device
+from .spatial_binning import bin_points
 
 LOGGER = logging.getLogger(__name__)
 
@@ -69,6 +70,9 @@ class DangerousPlaces(AtraiProcessor):
 
     def execute(self, data):
         self.check_request_params(data)
+        cached = self.memoized_result(data)
+        if cached is not None:
+            return cached
         atrai_bike_data = self.load_bike_data()
         atrai_bike_data['lng'] = atrai_bike_data['geometry'].x
         atrai_bike_data['lat'] = atrai_bike_data['geometry'].y
@@ -112,6 +116,20 @@ class DangerousPlaces(AtraiProcessor):
         if self.col_create:
             self.update_config()
 
+        # risk per grid cell at several zoom levels
+        danger_zones_grid = bin_points(heatmap_data_dz, ['Risk Index Overtaking'])
+        self.data = danger_zones_grid
+        self.create_collection_entries('danger_zones_grid')
+
+        danger_zones_grid.to_postgis(
+            self.title,
+            self.db_engine,
+            if_exists="replace",
+            index=False
+        )
+        if self.col_create:
+            self.update_config()
+
         
         #
         # PM DANGER WF
@@ -168,12 +186,26 @@ class DangerousPlaces(AtraiProcessor):
         if self.col_create:
             self.update_config()
 
+        # risk per grid cell at several zoom levels
+        danger_zones_PM_grid = bin_points(heatmap_data_danger_zones_PM, ['Risk Index'])
+        self.data = danger_zones_PM_grid
+        self.create_collection_entries('danger_zones_PM_grid')
+
+        danger_zones_PM_grid.to_postgis(
+            self.title,
+            self.db_engine,
+            if_exists="replace",
+            index=False
+        )
+        if self.col_create:
+            self.update_config()
+
         outputs = {
             'id': 'dangerous_places',
             'status': f"""done"""
         }
 
-        return self.mimetype, outputs
+        return self.memoize_result(self.mimetype, outputs)
 
     def __repr__(self):
         return f'<DangerousPlaces> {self.name}'
\ No newline at end of file
@@ -1,9 +1,13 @@
 import os
+import uuid
 import requests
 import logging
 
 from pygeoapi.process.base import BaseProcessor, ProcessorExecuteError
 
+from .resource_registry import commit_staged_resources
+from .run_cache import clear_run_cache
+
 
 LOGGER = logging.getLogger(__name__)
 
@@ -26,7 +30,19 @@ PROCESS_METADATA = {
             "hreflang": "en-US",
         }
     ],
-    "inputs": {"input": {"title": "result", "description": "The URL of the result", "schema": {"type": "string"}}},
+    "inputs": {
+        "input": {"title": "result", "description": "The URL of the result", "schema": {"type": "string"}},
+        "batch_registration": {
+            "title": "batch registration",
+            "description": "register all created collections in one config write at the end of the run (default true)",
+            "schema": {"type": "boolean"},
+        },
+        "data_cache": {
+            "title": "data cache",
+            "description": "fetch the bike and road data of a campaign once and share it between the processes of the run (default false)",
+            "schema": {"type": "boolean"},
+        },
+    },
     "outputs": {
         "id": {"title": "ID", "description": "The ID of the process execution", "schema": {"type": "string"}},
         "value": {
@@ -44,6 +60,7 @@ class DataIngestion(BaseProcessor):
         super().__init__(processor_def, PROCESS_METADATA)
         self.secret_token = os.environ.get("INT_API_TOKEN")
         self.api_url_base = os.environ.get("API_URL", 'http://localhost:80')
+        self.config_file = os.environ.get('PYGEOAPI_CONFIG')
 
         self.ingestion_dict = {
             "road_network": {
@@ -115,6 +132,12 @@ class DataIngestion(BaseProcessor):
             else:
                 raise ProcessorExecuteError(f"campaigns is not a list or 'all'")
 
+        # processes stage their collections under the run id, the config is
+        # written once after the run, so the workers reload only once
+        run_id = uuid.uuid4().hex if data.get("batch_registration", True) else None
+        # processes share the loaded data of the run through a local cache
+        cache_id = (run_id or uuid.uuid4().hex) if data.get("data_cache", False) else None
+
         LOGGER.debug(f"starting with osem_data_ingestion")
         endpoint = os.path.join(self.api_url_base, f"processes/osem_data_ingestion/execution?f=json")
         payload = {
@@ -129,32 +152,43 @@ class DataIngestion(BaseProcessor):
             LOGGER.debug(f"Error: {e}")
 
 
-        for campaign in campaigns:
-            for process in processes:
-                endpoint = os.path.join(self.api_url_base, f"processes/{process}/execution?f=json")
-                if process == "road_network":
-                    payload = {
-                        "inputs": {
-                            "campaign": campaign,
-                            "token": self.token,
-                            "location": self.ingestion_dict["road_network"][campaign]
+        try:
+            for campaign in campaigns:
+                for process in processes:
+                    endpoint = os.path.join(self.api_url_base, f"processes/{process}/execution?f=json")
+                    if process == "road_network":
+                        payload = {
+                            "inputs": {
+                                "campaign": campaign,
+                                "token": self.token,
+                                "location": self.ingestion_dict["road_network"][campaign],
+                                "run_id": run_id,
+                                "data_cache": cache_id
+                            }
                         }
-                    }
 
-                else:
-                    payload = {
-                        "inputs": {
-                            "campaign": campaign,
-                            "token": self.token,
-                            "col_create": True
+                    else:
+                        payload = {
+                            "inputs": {
+                                "campaign": campaign,
+                                "token": self.token,
+                                "col_create": True,
+                                "run_id": run_id,
+                                "data_cache": cache_id
+                            }
                         }
-                    }
-                LOGGER.debug(f"campaign: '{campaign}', process: '{process}'")
-                try:
-                    requests.post(endpoint, json=payload).raise_for_status()
-                    LOGGER.debug(f"ingestions on '{endpoint}' for '{campaign}' successful")
-                except requests.exceptions.RequestException as e:
-                    LOGGER.debug(f"Error: {e}")
+                    LOGGER.debug(f"campaign: '{campaign}', process: '{process}'")
+                    try:
+                        requests.post(endpoint, json=payload).raise_for_status()
+                        LOGGER.debug(f"ingestions on '{endpoint}' for '{campaign}' successful")
+                    except requests.exceptions.RequestException as e:
+                        LOGGER.debug(f"Error: {e}")
+        finally:
+            if cache_id:
+                clear_run_cache(cache_id)
+            if run_id:
+                registered = commit_staged_resources(self.config_file, run_id)
+                LOGGER.debug(f"registered {len(registered)} collections of run '{run_id}'")
 
         outputs = {
             "id": "ingestion process",
@@ -1,6 +1,9 @@
 import os
 import logging
-from .map_points_to_road_network import map_points_to_road_segments
+from .map_points_to_road_network import (
+    aggregate_points_to_road_segments_in_db,
+    map_points_to_road_segments,
+)
 from pygeoapi.process.base import BaseProcessor, ProcessorExecuteError
 from .atrai_processor import AtraiProcessor
 
@@ -41,6 +44,11 @@ METADATA = {
             "description": "identify yourself",
             "schema": {"type": "string"},
         },
+        "aggregate_in_db": {
+            "title": "aggregate in database",
+            "description": "snap and aggregate the points per road segment in PostGIS instead of loading them",
+            "schema": {"type": "boolean"},
+        },
     },
     "outputs": {
         "id": {
@@ -66,76 +74,104 @@ class Distances(AtraiProcessor):
     def execute(self, data):
         # check params
         self.check_request_params(data)
+        cached = self.memoized_result(data)
+        if cached is not None:
+            return cached
+
+        if data.get("aggregate_in_db"):
+            overtaking_flowmap = self.aggregate_in_db()
+        else:
+            overtaking_flowmap = self.aggregate()
+
+        # assign result to self.data
+        self.data = overtaking_flowmap
+        self.create_collection_entries('overtaking_distance')
+
+        # Save to PostGIS
+        overtaking_flowmap.to_postgis(
+            self.title,
+            self.db_engine,
+            if_exists="replace",
+            index=False
+        )
+
+        # update_config
+        if self.col_create:
+            self.update_config()
+
+        outputs = {
+            "id": "distances_flowmap",
+            "status": f"Processed {len(overtaking_flowmap)} road segments with overtaking data"
+        }
+
+        return self.memoize_result(self.mimetype, outputs)
+
+    def aggregate(self):
         # load data
         atrai_bike_data = self.load_bike_data()
         road_segments = self.load_road_data()
 
-
-        try:
-            if road_segments.crs is None:
-                road_segments.set_crs(epsg=4326, inplace=True)  # Replace 4326 with the correct CRS if needed
-
-            if road_segments.empty:
-                raise ProcessorExecuteError("No road network data found")
-
-            if atrai_bike_data.crs is None:
-                atrai_bike_data.set_crs(epsg=4326, inplace=True)  # Replace 4326 with the correct CRS if needed
-
-            # Reproject atrai_bike_data to match road_segments CRS
-            if atrai_bike_data.crs != road_segments.crs:
-                atrai_bike_data = atrai_bike_data.to_crs(road_segments.crs)
-
-            # Filtering & preprocessing
-            filtered_data = atrai_bike_data.copy()
-            filtered_data["createdAt"] = pd.to_datetime(filtered_data["createdAt"])
-            filtered_data = filtered_data.dropna(subset=["Overtaking Distance"])
-            filtered_data = filtered_data[
-                (filtered_data["Overtaking Manoeuvre"] > 0.5) &
-                (filtered_data["Overtaking Distance"] > 25)
-            ]
-            # filtered_data["Normalized Overtaking Distance"] = (
-            #     filtered_data["Overtaking Distance"] / 200
-            # ).clip(upper=1)
-
-            # Add id for grouping
-            filtered_data["id"] = filtered_data.index
-
-            # Map points to roads and aggregate
-            overtaking_flowmap = map_points_to_road_segments(
-                point_gdf=filtered_data,
-                road_segments=road_segments,
-                numeric_columns=[
-                    "Overtaking Distance",
-                    "Overtaking Manoeuvre",
-                    # "Normalized Overtaking Distance"
-                ],
-                id_column="id"
-            )
-
-            # assign result to self.data
-            self.data = overtaking_flowmap
-            self.create_collection_entries('overtaking_distance')
-
-            # Save to PostGIS
-            overtaking_flowmap.to_postgis(
-                self.title,
-                self.db_engine,
-                if_exists="replace",
-                index=False
-            )
-
-            # update_config
-            if self.col_create:
-                self.update_config()
-
-            outputs = {
-                "id": "distances_flowmap",
-                "status": f"Processed {len(overtaking_flowmap)} road segments with overtaking data"
-            }
-
-            return self.mimetype, outputs
-        finally:
-            self.db_engine.dispose()  # Ensure all connections are closed
+        if road_segments.crs is None:
+            road_segments.set_crs(epsg=4326, inplace=True)  # Replace 4326 with the correct CRS if needed
+
+        if road_segments.empty:
+            raise ProcessorExecuteError("No road network data found")
+
+        if atrai_bike_data.crs is None:
+            atrai_bike_data.set_crs(epsg=4326, inplace=True)  # Replace 4326 with the correct CRS if needed
+
+        # Reproject atrai_bike_data to match road_segments CRS
+        if atrai_bike_data.crs != road_segments.crs:
+            atrai_bike_data = atrai_bike_data.to_crs(road_segments.crs)
+
+        # Filtering & preprocessing
+        filtered_data = atrai_bike_data.copy()
+        filtered_data["createdAt"] = pd.to_datetime(filtered_data["createdAt"])
+        filtered_data = filtered_data.dropna(subset=["Overtaking Distance"])
+        filtered_data = filtered_data[
+            (filtered_data["Overtaking Manoeuvre"] > 0.5) &
+            (filtered_data["Overtaking Distance"] > 25)
+        ]
+        # filtered_data["Normalized Overtaking Distance"] = (
+        #     filtered_data["Overtaking Distance"] / 200
+        # ).clip(upper=1)
+
+        # Add id for grouping
+        filtered_data["id"] = filtered_data.index
+
+        # Map points to roads and aggregate
+        overtaking_flowmap = map_points_to_road_segments(
+            point_gdf=filtered_data,
+            road_segments=road_segments,
+            numeric_columns=[
+                "Overtaking Distance",
+                "Overtaking Manoeuvre",
+                # "Normalized Overtaking Distance"
+            ],
+            id_column="id"
+        )
+
+        return overtaking_flowmap
+
+    def aggregate_in_db(self):
+        filters, params = self.bike_data_filters()
+        filters += [
+            '"Overtaking Distance" IS NOT NULL',
+            '"Overtaking Manoeuvre" > 0.5',
+            '"Overtaking Distance" > 25',
+        ]
+
+        return aggregate_points_to_road_segments_in_db(
+            self.db_engine,
+            self.road_data_table(),
+            point_columns={
+                "Overtaking Distance": '"Overtaking Distance"',
+                "Overtaking Manoeuvre": '"Overtaking Manoeuvre"',
+            },
+            point_filters=filters,
+            params=params,
+            id_column="id"
+        )
 
     def __repr__(self):
         return f"<Distances> {self.name}"
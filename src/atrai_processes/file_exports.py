@@ -0,0 +1,103 @@
+import os
+import shutil
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+# bounding box columns written to the GeoParquet files, the pygeoapi
+# Parquet provider filters bbox queries on them
+BBOX_COLUMNS = ["minx", "miny", "maxx", "maxy"]
+
+
+def export_files(gdf, name, out_dir):
+    """
+    Writes a processor result as GeoParquet and FlatGeobuf file. The files
+    are written next to the target and renamed afterwards, so readers never
+    see a partially written file.
+    Args:
+        gdf (gpd.GeoDataFrame): The result, in EPSG:4326.
+        name (str): File name without extension, usually the collection name.
+        out_dir (str): Directory of the exported files.
+    Returns:
+        dict: Paths of the written files keyed by 'parquet' and 'flatgeobuf'.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {
+        "parquet": os.path.join(out_dir, f"{name}.parquet"),
+        "flatgeobuf": os.path.join(out_dir, f"{name}.fgb"),
+    }
+
+    # the temporary files keep their extension, GDAL's FlatGeobuf driver
+    # writes a directory for any other name
+    tmp_paths = {key: os.path.join(out_dir, f"{name}.tmp{os.path.splitext(path)[1]}") for key, path in paths.items()}
+    try:
+        parquet_data = gdf.drop(columns=BBOX_COLUMNS, errors="ignore")
+        parquet_data = parquet_data.join(gdf.geometry.bounds[BBOX_COLUMNS])
+        parquet_data.to_parquet(tmp_paths["parquet"], index=False, compression="zstd")
+
+        # the FlatGeobuf driver writes a packed Hilbert R-tree by default
+        gdf.to_file(tmp_paths["flatgeobuf"], driver="FlatGeobuf", layer=name)
+
+        for key, path in paths.items():
+            if os.path.isdir(path):
+                # left behind by exports through a temporary name without extension
+                shutil.rmtree(path)
+            os.replace(tmp_paths[key], path)
+    finally:
+        for tmp_path in tmp_paths.values():
+            if os.path.isdir(tmp_path):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    LOGGER.debug(f"exported '{name}' to {', '.join(paths.values())}")
+    return paths
+
+
+def export_providers(paths, name, id_field):
+    """
+    pygeoapi provider definitions of the exported files, registered next to
+    the default PostgreSQL provider of a collection.
+    """
+    return [
+        {
+            "type": "feature",
+            "name": "Parquet",
+            "data": {"source": paths["parquet"]},
+            "id_field": id_field,
+            "x_field": ["minx", "maxx"],
+            "y_field": ["miny", "maxy"],
+        },
+        {
+            "type": "feature",
+            "name": "OGR",
+            "data": {
+                "source_type": "FlatGeobuf",
+                "source": paths["flatgeobuf"],
+                "source_srs": "EPSG:4326",
+                "target_srs": "EPSG:4326",
+                "source_capabilities": {"paging": True},
+            },
+            "id_field": id_field,
+            "layer": name,
+        },
+    ]
+
+
+def export_links(paths, name, base_url):
+    """
+    Download links of the exported files for the collection metadata.
+    """
+    media_types = {
+        "parquet": ("application/vnd.apache.parquet", "GeoParquet"),
+        "flatgeobuf": ("application/flatgeobuf", "FlatGeobuf"),
+    }
+    return [
+        {
+            "type": media_types[key][0],
+            "rel": "enclosure",
+            "title": f"{name} ({media_types[key][1]})",
+            "href": f"{base_url.rstrip('/')}/{os.path.basename(path)}",
+        }
+        for key, path in paths.items()
+    ]
@@ -1,4 +1,3 @@
-import matplotlib.colors as mcolors
 import numpy as np
 
 legend_html_bumpy_roads = '''
@@ -39,6 +38,8 @@ legend_html_bumpy_roads = '''
 '''
 
 def create_speed_legend_html(segment_data, cmap):
+    import matplotlib.colors as mcolors
+
     colors = [mcolors.to_hex(cmap(v)) for v in np.linspace(0, 1, 256)]
     min_speed = segment_data['avg_speed_unnorm_kmh'].min()
     max_speed = segment_data['avg_speed_unnorm_kmh'].max()
@@ -80,6 +81,8 @@ def create_speed_legend_html(segment_data, cmap):
     return speed_legend_html
 
 def create_traffic_flow_legend_html(segment_data, cmap):
+    import matplotlib.colors as mcolors
+
     colors = [mcolors.to_hex(cmap(v)) for v in np.linspace(0, 1, 256)]
     min_traffic_flow = segment_data['avg_traffic_flow'].min()
     max_traffic_flow = segment_data['avg_traffic_flow'].max()
@@ -122,6 +125,8 @@ def create_traffic_flow_legend_html(segment_data, cmap):
     return traffic_flow_legend_html
 
 def create_distances_legend_html(segment_data, cmap):
+    import matplotlib.colors as mcolors
+
     colors = [mcolors.to_hex(cmap(v)) for v in np.linspace(0, 1, 256)]
     min_distance = 0
     max_distance = segment_data['avg_distance_unnorm'].max()
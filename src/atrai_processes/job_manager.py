@@ -0,0 +1,521 @@
+"""
+PostgreSQL backed pygeoapi process manager, configured in the server section:
+
+    manager:
+      name: atrai_processes.job_manager.JobManager
+      output_dir: /pygeoapi/data/jobs
+      retention_days: 7
+      execution:
+        max_workers: 2
+        limits: {annotate_roads: 1}
+        lanes: {data_ingestion: high, annotate_roads: low}
+
+Jobs live in an indexed table of the PostGIS database (DATABASE_* env vars
+or a `connection` url). Intermediate status updates are buffered per worker
+and written in batches, final states are written immediately. Finished jobs
+and their result files are pruned after `retention_days`.
+
+With an `execution` section async jobs run in a local process pool
+(atrai_processes.job_pool) instead of a thread of the web worker, see
+JobPool for the options. Every web worker runs its own pool, the `limits`
+hold across all of them: a pooled job takes one of the limited slots of
+its process (PostgreSQL advisory locks) and waits while all are taken.
+"""
+import os
+import json
+import time
+import zlib
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import timezone
+from pathlib import Path
+from typing import Any, Tuple
+
+from sqlalchemy import text
+
+from pygeoapi.api import FORMAT_TYPES, F_JSON, F_JSONLD
+from pygeoapi.process.base import (
+    JobNotFoundError,
+    JobResultNotFoundError,
+    ProcessorGenericError
+)
+from pygeoapi.plugin import load_plugin
+from pygeoapi.process.manager.base import BaseManager
+from pygeoapi.util import DATETIME_FORMAT, JobStatus, RequestedResponse, get_current_datetime
+
+from config.db_config import DatabaseConfig, get_shared_engine
+
+from .job_pool import JobPool
+
+LOGGER = logging.getLogger(__name__)
+
+JOBS_TABLE = "process_jobs"
+JOB_COLUMNS = [
+    "identifier", "type", "process_id", "status", "message", "progress",
+    "created", "started", "updated", "finished", "location", "mimetype", "parameters",
+]
+TIME_COLUMNS = {"created", "started", "updated", "finished"}
+FINAL_STATES = {JobStatus.successful.value, JobStatus.failed.value, JobStatus.dismissed.value}
+
+# manager of a pool process, created by its first job
+_POOL_MANAGER = None
+# seconds between attempts to take a slot of a limited process
+SLOT_POLL_INTERVAL = 5
+
+
+@contextmanager
+def process_slot(engine, process_id, limit):
+    """
+    Holds one of the `limit` slots of a process for all web workers and
+    their pools, waits until one is free. The slots are session advisory
+    locks, released with the connection also if the pool process dies.
+    """
+    if limit is None:
+        yield
+        return
+
+    key = zlib.crc32(f"atrai_processes.job:{process_id}".encode()) - 2 ** 31
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        slot = None
+        while slot is None:
+            for candidate in range(int(limit)):
+                if conn.execute(text("SELECT pg_try_advisory_lock(:key, :slot)"), {"key": key, "slot": candidate}).scalar():
+                    slot = candidate
+                    break
+            else:
+                LOGGER.debug(f"all {limit} slots of '{process_id}' are taken, waiting")
+                time.sleep(SLOT_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key, :slot)"), {"key": key, "slot": slot})
+
+
+def run_pooled_job(manager_def, process_id, job_id, data_dict, requested_outputs, subscriber, requested_response):
+    """
+    Executes a job inside a pool process. The processor is created in the
+    pool process, the job status is written by the manager of the process.
+    """
+    global _POOL_MANAGER
+
+    if _POOL_MANAGER is None:
+        _POOL_MANAGER = load_plugin("process_manager", dict(manager_def, execution=None))
+
+    processor = _POOL_MANAGER.get_processor(process_id)
+    processor.set_job_id(job_id)
+    limit = ((manager_def.get("execution") or {}).get("limits") or {}).get(process_id)
+    try:
+        with process_slot(_POOL_MANAGER._engine, process_id, limit):
+            _POOL_MANAGER._execute_handler_sync(
+                processor, job_id, data_dict, requested_outputs, subscriber, requested_response
+            )
+    finally:
+        _POOL_MANAGER.flush()
+
+
+class JobManager(BaseManager):
+    """PostgreSQL job manager with batched status updates"""
+
+    def __init__(self, manager_def: dict):
+        super().__init__(manager_def)
+        self.is_async = True
+        self.supports_subscribing = True
+
+        self.table = manager_def.get("table", JOBS_TABLE)
+        self.flush_interval = float(manager_def.get("flush_interval", 2))
+        self.retention_days = float(manager_def.get("retention_days", os.environ.get("JOB_RETENTION_DAYS", 7)))
+        self.prune_interval = float(manager_def.get("prune_interval", 3600))
+
+        if isinstance(self.connection, str):
+            self._engine = get_shared_engine(self.connection)
+        else:
+            self._engine = DatabaseConfig().get_engine()
+
+        if self.output_dir is not None:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        # job id -> pending column updates, written by the flusher thread
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        # keeps buffered and final writes of a job in order
+        self._write_lock = threading.Lock()
+        self._flusher = None
+        self._flusher_pid = None
+        self._table_ready = False
+        self._pruned_at = 0.0
+
+        self.manager_def = manager_def
+        self.pool = None
+        execution = manager_def.get("execution")
+        if execution:
+            self.pool = JobPool(
+                run_pooled_job, on_error=self._pooled_job_failed, is_done=self._pooled_job_done, **execution
+            )
+        # job id -> process id of jobs waiting for the pool
+        self._job_processes = {}
+
+    def _ensure_table(self):
+        # created lazily, the manager is also instantiated for the openapi
+        # document where the database may not be reachable
+        if self._table_ready:
+            return
+        with self._engine.begin() as conn:
+            conn.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    identifier TEXT PRIMARY KEY,
+                    type TEXT NOT NULL DEFAULT 'process',
+                    process_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    message TEXT,
+                    progress INTEGER,
+                    created TIMESTAMPTZ,
+                    started TIMESTAMPTZ,
+                    updated TIMESTAMPTZ,
+                    finished TIMESTAMPTZ,
+                    location TEXT,
+                    mimetype TEXT,
+                    parameters JSONB
+                )
+            """))
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {self.table}_started_idx ON {self.table} (started DESC)"))
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {self.table}_status_idx ON {self.table} (status, started DESC)"))
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {self.table}_process_idx ON {self.table} (process_id)"))
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_finished_idx ON {self.table} (finished) "
+                f"WHERE finished IS NOT NULL"
+            ))
+        self._table_ready = True
+
+    @staticmethod
+    def _to_row(values):
+        row = {key: val for key, val in values.items() if key in JOB_COLUMNS}
+        if "parameters" in row and row["parameters"] is not None:
+            row["parameters"] = json.dumps(row["parameters"])
+        return row
+
+    @staticmethod
+    def _from_row(row):
+        job = dict(row._mapping)
+        for col in TIME_COLUMNS:
+            if job.get(col) is not None:
+                job[col] = job[col].astimezone(timezone.utc).strftime(DATETIME_FORMAT)
+        return job
+
+    def _assignments(self, row):
+        return ", ".join(
+            f"{col} = CAST(:{col} AS JSONB)" if col == "parameters" else f"{col} = :{col}"
+            for col in row if col != "identifier"
+        )
+
+    def _write_updates(self, updates):
+        """
+        Writes pending updates, one executemany per set of updated columns.
+        """
+        groups = {}
+        for job_id, values in updates.items():
+            row = self._to_row(values)
+            row["identifier"] = job_id
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+
+        self._ensure_table()
+        with self._engine.begin() as conn:
+            for cols, rows in groups.items():
+                conn.execute(
+                    text(f"UPDATE {self.table} SET {self._assignments(rows[0])} WHERE identifier = :identifier"),
+                    rows
+                )
+
+    def _take_pending(self, job_id=None):
+        with self._pending_lock:
+            if job_id is None:
+                pending, self._pending = self._pending, {}
+                return pending
+            values = self._pending.pop(job_id, None)
+            return {job_id: values} if values else {}
+
+    def flush(self):
+        """
+        Writes all buffered status updates.
+        """
+        with self._write_lock:
+            pending = self._take_pending()
+            if pending:
+                self._write_updates(pending)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+                if time.monotonic() - self._pruned_at > self.prune_interval:
+                    self.prune_jobs()
+            except Exception as err:
+                LOGGER.error(f"job manager flush failed: {err}")
+
+    def _start_flusher(self):
+        # one flusher thread per worker process, threads do not survive a fork
+        if self._flusher is not None and self._flusher_pid == os.getpid() and self._flusher.is_alive():
+            return
+        self._flusher_pid = os.getpid()
+        self._flusher = threading.Thread(target=self._flush_loop, name="job-manager-flush", daemon=True)
+        self._flusher.start()
+
+    def prune_jobs(self) -> int:
+        """
+        Deletes finished jobs older than the retention period and their
+        result files.
+
+        :returns: number of deleted jobs
+        """
+        self._pruned_at = time.monotonic()
+        if self.retention_days <= 0:
+            return 0
+
+        self._ensure_table()
+        with self._engine.begin() as conn:
+            rows = conn.execute(
+                text(f"""
+                    DELETE FROM {self.table}
+                    WHERE finished IS NOT NULL AND finished < now() - make_interval(secs => :seconds)
+                    RETURNING location
+                """),
+                {"seconds": self.retention_days * 86400}
+            ).fetchall()
+
+        for (location,) in rows:
+            if location and self.output_dir is not None:
+                Path(location).unlink(missing_ok=True)
+        if rows:
+            LOGGER.info(f"pruned {len(rows)} jobs older than {self.retention_days} days")
+        return len(rows)
+
+    def get_jobs(self, status: JobStatus = None, limit=None, offset=None) -> dict:
+        """
+        Get jobs, newest first
+
+        :param status: job status (accepted, running, successful,
+                        failed, results) (default is all)
+        :param limit: number of jobs to return
+        :param offset: pagination offset
+
+        :returns: dict of list of jobs (identifier, status, process identifier)
+                  and numberMatched
+        """
+        self.flush()
+        self._ensure_table()
+
+        where = "WHERE status = :status" if status is not None else ""
+        params = {"status": status.value} if status is not None else {}
+        params.update({"limit": limit, "offset": offset or 0})
+
+        with self._engine.connect() as conn:
+            number_matched = conn.execute(text(f"SELECT count(*) FROM {self.table} {where}"), params).scalar()
+            rows = conn.execute(
+                text(f"""
+                    SELECT * FROM {self.table} {where}
+                    ORDER BY started DESC
+                    LIMIT :limit OFFSET :offset
+                """),
+                params
+            )
+            jobs = [self._from_row(row) for row in rows]
+
+        return {"jobs": jobs, "numberMatched": number_matched}
+
+    def add_job(self, job_metadata: dict) -> str:
+        """
+        Add a job
+
+        :param job_metadata: `dict` of job metadata
+
+        :returns: identifier of added job
+        """
+        row = self._to_row(job_metadata)
+        try:
+            self._ensure_table()
+            with self._engine.begin() as conn:
+                conn.execute(
+                    text(f"""
+                        INSERT INTO {self.table} ({", ".join(row)})
+                        VALUES ({", ".join(f"CAST(:{col} AS JSONB)" if col == "parameters" else f":{col}" for col in row)})
+                    """),
+                    row
+                )
+        except Exception as err:
+            msg = "Insert failed"
+            LOGGER.error(f"{msg}: {err}")
+            raise ProcessorGenericError(msg)
+
+        if self.pool is not None:
+            self._job_processes[job_metadata["identifier"]] = job_metadata["process_id"]
+        return job_metadata["identifier"]
+
+    def update_job(self, job_id: str, update_dict: dict) -> bool:
+        """
+        Updates a job. Intermediate states are buffered and written by the
+        flusher thread, final states are written at once together with the
+        buffered updates of the job.
+
+        :param job_id: job identifier
+        :param update_dict: `dict` of property updates
+
+        :returns: `bool` of status result
+        """
+        final = update_dict.get("status") in FINAL_STATES
+        with self._pending_lock:
+            self._pending.setdefault(job_id, {}).update(update_dict)
+            if not final:
+                self._start_flusher()
+
+        if not final:
+            return True
+
+        try:
+            with self._write_lock:
+                self._write_updates(self._take_pending(job_id))
+        except Exception as err:
+            msg = "Update failed"
+            LOGGER.error(f"{msg}: {err}")
+            raise ProcessorGenericError(msg)
+        return True
+
+    def get_job(self, job_id: str) -> dict:
+        """
+        Get a single job
+
+        :param job_id: job identifier
+
+        :raises JobNotFoundError: if the job_id does not correspond to a
+                                  known job
+        :returns: `dict`  # `pygeoapi.process.manager.Job`
+        """
+        self._ensure_table()
+        with self._engine.connect() as conn:
+            row = conn.execute(
+                text(f"SELECT * FROM {self.table} WHERE identifier = :identifier"),
+                {"identifier": job_id}
+            ).first()
+
+        if row is None:
+            raise JobNotFoundError()
+
+        job = self._from_row(row)
+        # updates of this worker not written yet
+        with self._pending_lock:
+            job.update(self._pending.get(job_id, {}))
+        return job
+
+    def delete_job(self, job_id: str) -> bool:
+        """
+        Deletes a job and its result file
+
+        :param job_id: job identifier
+
+        :raises JobNotFoundError: if the job_id does not correspond to a
+                                  known job
+        :return `bool` of status result
+        """
+        self._take_pending(job_id)
+        self._ensure_table()
+        with self._engine.begin() as conn:
+            row = conn.execute(
+                text(f"DELETE FROM {self.table} WHERE identifier = :identifier RETURNING location"),
+                {"identifier": job_id}
+            ).first()
+
+        if row is None:
+            raise JobNotFoundError()
+
+        if row.location and self.output_dir is not None:
+            Path(row.location).unlink(missing_ok=True)
+        return True
+
+    def get_job_result(self, job_id: str) -> Tuple[str, Any]:
+        """
+        Get a job's status, and actual output of executing the process
+
+        :param job_id: job identifier
+
+        :raises JobNotFoundError: if the job_id does not correspond to a
+                                  known job
+        :raises JobResultNotFoundError: if the job-related result cannot
+                                        be returned
+        :returns: `tuple` of mimetype and raw output
+        """
+        job = self.get_job(job_id)
+        location = job.get("location")
+        mimetype = job.get("mimetype")
+
+        if JobStatus[job["status"]] != JobStatus.successful:
+            # Job is incomplete
+            return (None,)
+        if not location:
+            LOGGER.warning(f"job {job_id!r} - unknown result location")
+            raise JobResultNotFoundError()
+
+        try:
+            location = Path(location)
+            if mimetype in (None, FORMAT_TYPES[F_JSON], FORMAT_TYPES[F_JSONLD]):
+                with location.open("r", encoding="utf-8") as fh:
+                    result = json.load(fh)
+            else:
+                with location.open("rb") as fh:
+                    result = fh.read()
+        except (TypeError, FileNotFoundError, json.JSONDecodeError):
+            raise JobResultNotFoundError()
+        return mimetype, result
+
+    def _execute_handler_sync(self, p, job_id, data_dict, requested_outputs=None,
+                              subscriber=None, requested_response=RequestedResponse.raw.value):
+        # add_job records every job for the pool, sync jobs do not need it
+        self._job_processes.pop(job_id, None)
+        # the base handler only reports 'running' once the process finished
+        self.update_job(job_id, {
+            "updated": get_current_datetime(),
+            "status": JobStatus.running.value,
+            "message": "Job running",
+            "progress": 10,
+        })
+        return super()._execute_handler_sync(
+            p, job_id, data_dict, requested_outputs, subscriber, requested_response
+        )
+
+    def _execute_handler_async(self, p, job_id, data_dict, requested_outputs=None,
+                               subscriber=None, requested_response=RequestedResponse.raw.value):
+        if self.pool is None:
+            return super()._execute_handler_async(
+                p, job_id, data_dict, requested_outputs, subscriber, requested_response
+            )
+
+        process_id = self._job_processes.pop(job_id)
+        self.pool.submit(
+            process_id,
+            self.manager_def, process_id, job_id, data_dict, requested_outputs, subscriber, requested_response
+        )
+        return "application/json", None, JobStatus.accepted
+
+    def _pooled_job_done(self, args):
+        # final states are written at once by the pool process
+        try:
+            return self.get_job(args[2])["status"] in FINAL_STATES
+        except Exception:
+            return False
+
+    def _pooled_job_failed(self, args, err):
+        # the job could not report its state itself, e.g. its process crashed
+        job_id = args[2]
+        try:
+            self.update_job(job_id, {
+                "finished": get_current_datetime(),
+                "updated": get_current_datetime(),
+                "status": JobStatus.failed.value,
+                "location": None,
+                "mimetype": "application/octet-stream",
+                "message": f"InvalidParameterValue: Error executing process: {err}",
+            })
+        except ProcessorGenericError:
+            pass
+
+    def __repr__(self):
+        return f"<JobManager> {self.name}"
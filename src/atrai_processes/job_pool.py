@@ -0,0 +1,156 @@
+import heapq
+import logging
+import itertools
+import threading
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+LOGGER = logging.getLogger(__name__)
+
+# lower runs first, jobs of one lane run in submission order
+LANES = {"high": 0, "normal": 1, "low": 2}
+
+
+class JobPool:
+    """
+    Runs jobs in a local process pool, outside the request serving worker.
+    Jobs wait in a priority queue with one lane per priority and are started
+    as long as fewer than `max_workers` jobs run and the process of the job
+    is below its concurrency limit.
+    Every web worker has its own pool, `limits` only apply to the jobs of
+    one pool. JobManager enforces them across workers as well.
+    A pool process dying breaks every job running in the pool. Jobs that
+    are not done yet are queued once more, a job failing again is reported
+    to `on_error`.
+    Args:
+        run (callable): Module level function executing a job in the pool.
+        on_error (callable): Called with the job arguments and the exception
+            if a job could not be run, e.g. because its process crashed.
+        is_done (callable): Called with the job arguments, tells whether a
+            job broken by a crashed pool process had finished nevertheless.
+        max_workers (int): Number of pool processes.
+        limits (dict): Maximum concurrent jobs per process id and pool.
+        lanes (dict): Lane ('high', 'normal', 'low') per process id.
+        max_tasks_per_child (int): Jobs after which a pool process is
+            replaced, releases the memory of heavy processors.
+    """
+
+    def __init__(self, run, on_error=None, is_done=None, max_workers=2, limits=None, lanes=None,
+                 max_tasks_per_child=None):
+        unknown = set((lanes or {}).values()) - set(LANES)
+        if unknown:
+            raise ValueError(f"unknown lanes {', '.join(unknown)}, valid lanes are {', '.join(LANES)}")
+
+        self.run = run
+        self.on_error = on_error
+        self.is_done = is_done
+        self.max_workers = int(max_workers)
+        self.limits = {key: int(val) for key, val in (limits or {}).items()}
+        self.lanes = lanes or {}
+        self.max_tasks_per_child = max_tasks_per_child
+
+        self._queue = []
+        self._seq = itertools.count()
+        self._running = Counter()
+        self._cond = threading.Condition(threading.RLock())
+        self._executor = None
+        self._dispatcher = None
+
+    def _get_executor(self):
+        with self._cond:
+            if self._executor is None:
+                # spawned, forking a (gevent) web worker with running threads is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    max_tasks_per_child=self.max_tasks_per_child,
+                )
+            return self._executor
+
+    def submit(self, process_id, *args):
+        """
+        Queues a job, it is started once a pool process and its lane are free.
+        """
+        lane = LANES[self.lanes.get(process_id, "normal")]
+        with self._cond:
+            heapq.heappush(self._queue, (lane, next(self._seq), process_id, args, 0))
+            if self._dispatcher is None or not self._dispatcher.is_alive():
+                self._dispatcher = threading.Thread(target=self._dispatch_loop, name="job-pool-dispatch", daemon=True)
+                self._dispatcher.start()
+            self._cond.notify()
+        LOGGER.debug(f"queued job of '{process_id}', {len(self._queue)} waiting")
+
+    def _next_job(self):
+        # first queued job whose process is below its limit, called with the lock held
+        if sum(self._running.values()) >= self.max_workers:
+            return None
+        blocked = []
+        job = None
+        while self._queue:
+            item = heapq.heappop(self._queue)
+            limit = self.limits.get(item[2])
+            if limit is not None and self._running[item[2]] >= limit:
+                blocked.append(item)
+                continue
+            job = item
+            break
+        for item in blocked:
+            heapq.heappush(self._queue, item)
+        return job
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+                self._running[job[2]] += 1
+
+            executor = self._get_executor()
+            try:
+                future = executor.submit(self.run, *job[3])
+            except Exception as err:
+                self._finished(executor, job, err)
+                continue
+            future.add_done_callback(
+                lambda f, executor=executor, job=job: self._finished(executor, job, f.exception())
+            )
+
+    def _finished(self, executor, job, err):
+        lane, seq, process_id, args, attempt = job
+        broken = isinstance(err, BrokenProcessPool)
+        with self._cond:
+            self._running[process_id] -= 1
+            if broken and self._executor is executor:
+                # a pool process died, the executor is unusable afterwards
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            self._cond.notify()
+
+        if err is None:
+            return
+        if self.is_done is not None and self.is_done(args):
+            # finished before its result reached the pool
+            LOGGER.debug(f"job of '{process_id}' is done despite '{err}'")
+            return
+        if broken and attempt == 0:
+            # any job of the pool may have killed it, the others are run again
+            LOGGER.warning(f"pool process died during a job of '{process_id}', queueing it again")
+            with self._cond:
+                heapq.heappush(self._queue, (lane, seq, process_id, args, attempt + 1))
+                self._cond.notify()
+            return
+
+        LOGGER.error(f"job of '{process_id}' failed in the pool: {err}")
+        if self.on_error is not None:
+            self.on_error(args, err)
+
+    def status(self):
+        """
+        Number of running jobs per process id and of waiting jobs.
+        """
+        with self._cond:
+            return {"running": dict(+self._running), "queued": len(self._queue)}
@@ -1,25 +1,68 @@
 import geopandas as gpd
 import logging
 import numpy as np
+from shapely.geometry import box
+from sqlalchemy import text
+
+from .useful_functs import bin_labels, binned_counts, format_binned_counts
 
 
 LOGGER = logging.getLogger(__name__)
 
-def histo(data):
-    clean_data = data.dropna()
-    bins = [0, 50, 100, 150, 200, np.inf]
+OVERTAKING_DISTANCE_BINS = [0, 50, 100, 150, 200, np.inf]
+
+# stable id of a road segment in the road network tables, the "id" of the results
+SEGMENT_ID = "segment_id"
+
+
+def ensure_segment_ids(engine, road_table):
+    """
+    Adds the segment id column to road tables imported before RoadNetwork
+    wrote it. The ids are assigned once and stored, unlike row positions
+    they do not depend on the order a scan returns the rows in.
+    """
+    with engine.begin() as conn:
+        has_id, n_columns = conn.execute(
+            text("""
+                SELECT count(*) FILTER (WHERE column_name = :column), count(*)
+                FROM information_schema.columns WHERE table_name = :table
+            """),
+            {"table": road_table, "column": SEGMENT_ID},
+        ).one()
+        # missing tables are reported by the caller reading them
+        if n_columns and not has_id:
+            LOGGER.info(f"adding {SEGMENT_ID} to {road_table}")
+            conn.execute(text(f'ALTER TABLE "{road_table}" ADD COLUMN IF NOT EXISTS {SEGMENT_ID} BIGSERIAL'))
 
-    counts, bin_edges = np.histogram(clean_data, bins=bins)
-    string = ", ".join(str(x) for x in counts)
 
-    return string
+def segment_column_names(numeric_columns, id_column, distance_col, o_dist):
+    """
+    Names of the aggregated per-segment columns, keyed by the point column.
+    Overtaking results use 'Average ...' names with units, the other results
+    keep the names the road roughness maps are built on.
+    """
+    if o_dist:
+        names = {col: f"Average {col}" for col in numeric_columns}
+        names[distance_col] = "Average Distance to Road[m]"
+        names[id_column] = "Number of Points"
+        names['boxId'] = "Number of Boxes"
+        names['Overtaking Distance'] = 'Average Overtaking Distance[cm]'
+        names['Overtaking Manoeuvre'] = 'Average Overtaking Manoeuvre[%]'
+    else:
+        names = {col: col for col in numeric_columns}
+        names['Roughness_Normalized'] = "Normalized Roughness"
+        names[distance_col] = "Distance to Road"
+        names[id_column] = "streetid"
+        names['boxId'] = "Number of Boxes"
+    return names
 
 def map_points_to_road_segments(
     point_gdf: gpd.GeoDataFrame,
     road_segments: gpd.GeoDataFrame,
     numeric_columns: list,
     id_column: str = "id",
-    distance_col: str = "distance_to_road"
+    distance_col: str = "distance_to_road",
+    histogram_as_string: bool = True
 ) -> gpd.GeoDataFrame:
     """
     Maps point-based data (e.g., roughness, overtaking) to road segments
@@ -31,6 +74,8 @@ def map_points_to_road_segments(
         numeric_columns (list): List of numeric column names to aggregate.
         id_column (str): Column to count (default is 'id').
         distance_col (str): Name of the distance column to compute.
+        histogram_as_string (bool): Additionally join the overtaking distance
+            bin counts into the 'Overtaking Distance Counts' string column.
 
     Returns:
         GeoDataFrame: Aggregated data per road segment.
@@ -41,82 +86,172 @@ def map_points_to_road_segments(
     point_gdf = point_gdf.set_crs(4326, allow_override=True).to_crs(projected_crs)
 
 
-    point_extent = point_gdf.total_bounds
-    LOGGER.debug(point_extent)
-    road_segments_clipped = gpd.clip(road_segments, point_extent)
-    road_segments_clipped = road_segments_clipped[~road_segments_clipped.is_empty]
+    max_distance_threshold = 20
 
-    # road_segments = road_segments.reset_index(drop=True)
+    # Select candidate segments via the spatial index using the point extent
+    # grown by the snapping threshold. Unlike gpd.clip this only compares
+    # bounding boxes and keeps the full segment geometries.
+    min_x, min_y, max_x, max_y = point_gdf.total_bounds
+    LOGGER.debug([min_x, min_y, max_x, max_y])
+    search_area = box(
+        min_x - max_distance_threshold,
+        min_y - max_distance_threshold,
+        max_x + max_distance_threshold,
+        max_y + max_distance_threshold,
+    )
+    candidate_idx = np.sort(road_segments.sindex.query(search_area))
+    road_candidates = road_segments.iloc[candidate_idx]
+    road_candidates = road_candidates[~road_candidates.is_empty]
 
     # Spatial join to find nearest segment
     joined = gpd.sjoin_nearest(
         point_gdf,
-        road_segments_clipped,
+        road_candidates,
         how="left",
+        max_distance=max_distance_threshold,
         distance_col=distance_col,
     )
 
-    max_distance_threshold = 20
     joined = joined[joined[distance_col] < max_distance_threshold]
     LOGGER.debug(joined.columns)
 
     # Columns to aggregate
-    o_dist = False
+    o_dist = 'Overtaking Distance' in joined.columns
     agg_dict = {col: "mean" for col in numeric_columns}
     agg_dict[distance_col] = "mean"
     agg_dict[id_column] = "count"
     agg_dict['boxId'] = 'nunique'
-    if 'Overtaking Distance' in joined.columns:
-        o_dist = True
-        agg_dict['Overtaking Distance'] = ['mean', histo]
+    if o_dist:
+        agg_dict['Overtaking Distance'] = 'mean'
 
     # Group by road segment index
     aggregated = joined.groupby("index_right").agg(agg_dict)
-
-    aggregated.columns = ['_'.join(map(str, col)).strip() for col in aggregated.columns.values]
-
-
-    # # Rename columns
-    # new_columns = {
-    #     col: f"Average {col}" for col in numeric_columns
-    # }
-    # new_columns[distance_col] = "Average Distance to Road"
-    # new_columns[id_column] = f"Number of Points"
-    # new_columns['boxId'] = "Number of Boxes"
-    # if o_dist:
-    #     new_columns['Overtaking Distance'] = 'counts'
-    #
-    new_columns = {
-        f"{col}_mean": f"Average {col}" for col in numeric_columns
-    }
-    new_columns[f"{distance_col}_mean"] = "Average Distance to Road[m]"
-    new_columns[f"{id_column}_count"] = "Number of Points"
-    new_columns['boxId_nunique'] = "Number of Boxes"
+    aggregated = aggregated.rename(
+        columns=segment_column_names(numeric_columns, id_column, distance_col, o_dist)
+    )
 
     if o_dist:
-        new_columns['Overtaking Distance_mean'] = 'Average Overtaking Distance[cm]'
-        new_columns['Overtaking Distance_histo'] = 'Overtaking Distance Counts'
-        new_columns['Overtaking Manoeuvre_mean'] = 'Average Overtaking Manoeuvre[%]'
-    aggregated = aggregated.rename(columns=new_columns)
-
-    #TODO just use another func at this point?
-    if "i_d" in aggregated.columns:
-        newer_cols = {}
-        newer_cols["R_o_u_g_h_n_e_s_s"] = "Roughness"
-        newer_cols["b_o_x_I_d"] = "Number of Boxes"
-        newer_cols["i_d"] = "streetid"
-        newer_cols["d_i_s_t_a_n_c_e___t_o___r_o_a_d"] = "Distance to Road"
-        newer_cols["R_o_u_g_h_n_e_s_s___N_o_r_m_a_l_i_z_e_d"] = "Normalized Roughness"
-        aggregated = aggregated.rename(columns=newer_cols)
-
-    # aggregated.columns = ['_'.join(map(str, col)).strip() for col in aggregated.columns.values]
+        counts = binned_counts(
+            joined['Overtaking Distance'],
+            joined['index_right'],
+            OVERTAKING_DISTANCE_BINS
+        )
+        if histogram_as_string:
+            aggregated['Overtaking Distance Counts'] = format_binned_counts(counts)
+        counts.columns = [f"Overtaking Distance Count {col}[cm]" for col in counts.columns]
+        aggregated = aggregated.join(counts)
 
     # Join geometry back in
     result = aggregated.merge(
-        road_segments_clipped, left_on="index_right", right_index=True
+        road_candidates, left_on="index_right", right_index=True
     )
-    result["id"] = result.index
+    # positions depend on the row order the road table was read in
+    result["id"] = result[SEGMENT_ID] if SEGMENT_ID in result.columns else result.index
 
     gdf = gpd.GeoDataFrame(result, geometry="geometry", crs=projected_crs)
 
-    return gdf.to_crs(4326)
\ No newline at end of file
+    return gdf.to_crs(4326)
+
+def aggregate_points_to_road_segments_in_db(
+    engine,
+    road_table: str,
+    point_columns: dict,
+    point_filters: list,
+    params: dict,
+    id_column: str = "id",
+    distance_col: str = "distance_to_road",
+    histogram_as_string: bool = True
+) -> gpd.GeoDataFrame:
+    """
+    Database counterpart of `map_points_to_road_segments`. The nearest
+    segment search (KNN on a GiST index) and the aggregation run in PostGIS,
+    only the aggregated segment table is transferred.
+
+    Args:
+        engine (Engine): SQLAlchemy engine of the PostGIS database.
+        road_table (str): Table holding the road segments.
+        point_columns (dict): Output column name -> SQL expression evaluated
+            per row of osem_bike_data, the columns are averaged per segment.
+        point_filters (list): SQL conditions selecting the points.
+        params (dict): Bind parameters used in point_filters.
+        id_column (str): Name of the point count column.
+        distance_col (str): Name of the distance column.
+        histogram_as_string (bool): Additionally join the overtaking distance
+            bin counts into the 'Overtaking Distance Counts' string column.
+
+    Returns:
+        GeoDataFrame: Aggregated data per road segment.
+    """
+    max_distance_threshold = 20
+    o_dist = 'Overtaking Distance' in point_columns
+    names = segment_column_names(list(point_columns), id_column, distance_col, o_dist)
+
+    ensure_segment_ids(engine, road_table)
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"""CREATE INDEX IF NOT EXISTS "{road_table}_geometry_3857_idx" """
+            f"""ON "{road_table}" USING GIST (ST_Transform(geometry, 3857))"""
+        ))
+
+    point_select = ", ".join(f'{expr} AS "{col}"' for col, expr in point_columns.items())
+    point_where = " AND ".join(["geometry IS NOT NULL"] + point_filters)
+
+    aggregates = [f'AVG(snapped."{col}") AS "{names[col]}"' for col in point_columns]
+    aggregates.append(f'AVG(snapped.distance) AS "{names[distance_col]}"')
+    aggregates.append(f'COUNT(*) AS "{names[id_column]}"')
+    aggregates.append(f'COUNT(DISTINCT snapped."boxId") AS "{names["boxId"]}"')
+
+    labels = bin_labels(OVERTAKING_DISTANCE_BINS)
+    count_columns = [f"Overtaking Distance Count {label}[cm]" for label in labels]
+    if o_dist:
+        for lower, upper, col in zip(OVERTAKING_DISTANCE_BINS[:-1], OVERTAKING_DISTANCE_BINS[1:], count_columns):
+            condition = f'snapped."Overtaking Distance" >= {lower}'
+            if np.isfinite(upper):
+                condition += f' AND snapped."Overtaking Distance" < {upper}'
+            aggregates.append(f'COUNT(*) FILTER (WHERE {condition}) AS "{col}"')
+
+    sql = f"""
+        WITH points AS (
+            SELECT "boxId", {point_select}, ST_Transform(geometry, 3857) AS geom
+            FROM osem_bike_data
+            WHERE {point_where}
+        ),
+        snapped AS (
+            SELECT points.*, nearest.road_id, nearest.distance
+            FROM points
+            CROSS JOIN LATERAL (
+                SELECT r.{SEGMENT_ID} AS road_id, ST_Distance(ST_Transform(r.geometry, 3857), points.geom) AS distance
+                FROM "{road_table}" r
+                ORDER BY ST_Transform(r.geometry, 3857) <-> points.geom
+                LIMIT 1
+            ) nearest
+            WHERE nearest.distance < {max_distance_threshold}
+        ),
+        aggregated AS (
+            SELECT snapped.road_id, {", ".join(aggregates)}
+            FROM snapped
+            GROUP BY snapped.road_id
+        )
+        SELECT aggregated.*, r.*
+        FROM aggregated
+        JOIN "{road_table}" r ON r.{SEGMENT_ID} = aggregated.road_id
+        ORDER BY r.{SEGMENT_ID}
+    """
+
+    gdf = gpd.read_postgis(text(sql), engine, geom_col="geometry", params=params)
+    gdf = gdf.loc[:, ~gdf.columns.duplicated()]
+
+    if o_dist and histogram_as_string:
+        counts = gdf[count_columns]
+        counts.columns = labels
+        gdf.insert(
+            gdf.columns.get_loc(count_columns[0]),
+            'Overtaking Distance Counts',
+            format_binned_counts(counts)
+        )
+
+    gdf = gdf.set_index("road_id", drop=True)
+    gdf.index.name = "index_right"
+    gdf["id"] = gdf[SEGMENT_ID]
+
+    return gdf.set_crs(4326, allow_override=True)
@@ -0,0 +1,113 @@
+import os
+import json
+import hashlib
+import logging
+from sqlalchemy import text
+
+LOGGER = logging.getLogger(__name__)
+
+# results of processor requests are reused while their input data is unchanged
+MEMOIZATION = os.environ.get("RESULT_MEMOIZATION", "true").lower() in ("1", "true", "yes")
+MEMO_TABLE = "processor_results"
+
+# request inputs that do not change the result
+IGNORED_INPUTS = {"token", "run_id", "force", "data_cache"}
+
+
+def request_key(processor, params):
+    """
+    Stable hash of a processor and its request parameters.
+    """
+    params = {key: val for key, val in params.items() if key not in IGNORED_INPUTS}
+    payload = json.dumps([processor, params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def data_version(conn, point_filters, params, road_table=None):
+    """
+    Version of the input data of a request: number and newest ingest time of
+    the selected measurements and the oid of the road network table. The road
+    tables are replaced on every import, which gives them a new oid.
+    """
+    sql = 'SELECT count(*), max("createdAt") FROM osem_bike_data'
+    if point_filters:
+        sql += " WHERE " + " AND ".join(point_filters)
+    n_points, max_created = conn.execute(text(sql), params).one()
+
+    road_oid = None
+    if road_table is not None:
+        road_oid = conn.execute(
+            text("SELECT CAST(to_regclass(:table) AS oid)"), {"table": f'"{road_table}"'}
+        ).scalar()
+
+    return f"{n_points}|{max_created.isoformat() if max_created else None}|{road_oid}"
+
+
+def ensure_memo_table(conn):
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {MEMO_TABLE} (
+            key TEXT PRIMARY KEY,
+            processor TEXT NOT NULL,
+            data_version TEXT NOT NULL,
+            mimetype TEXT,
+            outputs JSONB,
+            tables JSONB NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """))
+
+
+def lookup_result(conn, key, version):
+    """
+    The stored result of a request if it was computed from the same data
+    version and all of its tables still exist.
+    Returns:
+        tuple: (mimetype, outputs) or None.
+    """
+    if conn.execute(text("SELECT to_regclass(:table)"), {"table": MEMO_TABLE}).scalar() is None:
+        return None
+
+    row = conn.execute(
+        text(f"SELECT mimetype, outputs, tables FROM {MEMO_TABLE} WHERE key = :key AND data_version = :version"),
+        {"key": key, "version": version}
+    ).first()
+    if row is None:
+        return None
+
+    for table in row.tables:
+        if conn.execute(text("SELECT to_regclass(:table)"), {"table": f'"{table}"'}).scalar() is None:
+            return None
+    return row.mimetype, row.outputs
+
+
+def forget_tables(conn, tables, keep_key=None):
+    """
+    Removes the stored results that refer to any of the tables, they are
+    about to be rewritten. Table names only reflect some of the inputs, so
+    requests with other inputs write to the same tables.
+    """
+    if conn.execute(text("SELECT to_regclass(:table)"), {"table": MEMO_TABLE}).scalar() is None:
+        return
+    conn.execute(
+        text(f"DELETE FROM {MEMO_TABLE} WHERE tables ?| CAST(:tables AS TEXT[]) AND key IS DISTINCT FROM :key"),
+        {"tables": list(tables), "key": keep_key}
+    )
+
+
+def store_result(conn, key, processor, version, mimetype, outputs, tables):
+    ensure_memo_table(conn)
+    forget_tables(conn, tables, keep_key=key)
+    conn.execute(
+        text(f"""
+            INSERT INTO {MEMO_TABLE} (key, processor, data_version, mimetype, outputs, tables, created_at)
+            VALUES (:key, :processor, :version, :mimetype, CAST(:outputs AS JSONB), CAST(:tables AS JSONB), now())
+            ON CONFLICT (key) DO UPDATE
+            SET data_version = EXCLUDED.data_version, mimetype = EXCLUDED.mimetype,
+                outputs = EXCLUDED.outputs, tables = EXCLUDED.tables, created_at = EXCLUDED.created_at
+        """),
+        {
+            "key": key, "processor": processor, "version": version, "mimetype": mimetype,
+            "outputs": json.dumps(outputs, default=str), "tables": json.dumps(tables),
+        }
+    )
+
@@ -0,0 +1,78 @@
+import os
+import logging
+import threading
+import pandas as pd
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_METATABLE_PATH = "/pygeoapi/src/boxes/metatable.csv"
+
+
+class Metatable:
+    """
+    The boxes of the metatable with dict indexes for constant time lookups.
+    Attributes:
+        frame (pd.DataFrame): The metatable as read from the csv.
+        campaign_boxes (dict): boxIds of each campaign (location).
+        box_campaign (dict): Campaign of each boxId.
+        mtime (float): Modification time of the csv the table was read from.
+    """
+
+    def __init__(self, frame, mtime):
+        frame = frame.copy()
+        frame["id"] = frame["id"].astype(str).str.strip()
+        frame["location"] = frame["location"].astype(str).str.strip()
+
+        self.frame = frame
+        self.mtime = mtime
+        self.box_campaign = dict(zip(frame["id"], frame["location"]))
+        self.campaign_boxes = {}
+        for box_id, campaign in zip(frame["id"], frame["location"]):
+            self.campaign_boxes.setdefault(campaign, []).append(box_id)
+
+    @property
+    def campaigns(self):
+        return list(self.campaign_boxes)
+
+    @property
+    def box_ids(self):
+        return list(self.box_campaign)
+
+    def has_campaign(self, campaign):
+        return campaign in self.campaign_boxes
+
+    def has_box(self, box_id):
+        return box_id in self.box_campaign
+
+    def boxes_of(self, campaign):
+        return list(self.campaign_boxes.get(campaign, []))
+
+
+# one parsed table per path and process, replaced when the csv changes
+_TABLES = {}
+_TABLES_LOCK = threading.Lock()
+
+
+def get_metatable(path=None):
+    """
+    Returns the process wide metatable of the given csv. The file is only
+    parsed again if its modification time changed since the last read.
+    Args:
+        path (str): Path of the csv, defaults to META_TABLE_PATH.
+    Returns:
+        Metatable: The indexed metatable.
+    """
+    path = path or os.environ.get("META_TABLE_PATH", DEFAULT_METATABLE_PATH)
+    mtime = os.stat(path).st_mtime
+
+    table = _TABLES.get(path)
+    if table is not None and table.mtime == mtime:
+        return table
+
+    with _TABLES_LOCK:
+        table = _TABLES.get(path)
+        if table is None or table.mtime != mtime:
+            table = Metatable(pd.read_csv(path, dtype=str), mtime)
+            _TABLES[path] = table
+            LOGGER.debug(f"loaded metatable {path} with {len(table.box_campaign)} boxes")
+        return table
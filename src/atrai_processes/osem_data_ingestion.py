@@ -1,7 +1,5 @@
 import os
 import logging
-import opensensemaptoolbox as osmtb
-import pandas as pd
 from pygeoapi.process.base import BaseProcessor, ProcessorExecuteError
 import yaml
 from filelock import Timeout, FileLock
@@ -11,6 +9,7 @@ from filelock import Timeout, FileLock
 from sqlalchemy import text, inspect
 
 from config.db_config import DatabaseConfig
+from .metatable import get_metatable
 
 import datetime as dt
 
@@ -73,7 +72,7 @@ class OsemDataIngestion(BaseProcessor):
         self.db_cfg = self.db_config.get_db_config()
         self.config_file = os.environ.get('PYGEOAPI_SERV_CONFIG', '/pygeoapi/local.config.yml')
         self.tag = None
-        self.boxes_metadata = pd.read_csv('/pygeoapi/src/boxes/metatable.csv')
+        self.metatable_path = os.environ.get('META_TABLE_PATH')
 
     def read_config(self):
         with open(self.config_file, 'r') as file:
@@ -137,29 +136,28 @@ class OsemDataIngestion(BaseProcessor):
             LOGGER.error("WRONG INTERNAL API TOKEN")
             raise ProcessorExecuteError("ACCESS DENIED wrong token")
 
+        import opensensemaptoolbox as osmtb
+
         engine = self.db_config.get_engine()
-        try:
-            inspector = inspect(engine)
-            existing_tables = inspector.get_table_names(schme="public") # TODO make an env var
+        inspector = inspect(engine)
+        existing_tables = inspector.get_table_names(schme="public") # TODO make an env var
 
-            OSM = osmtb.OpenSenseMap()
-            boxIds = [i for i in self.boxes_metadata['id']]
-            OSM.add_box(boxIds)
-            OSM.update_OSM(mode='postgis', engine=engine)
+        OSM = osmtb.OpenSenseMap()
+        boxIds = get_metatable(self.metatable_path).box_ids
+        OSM.add_box(boxIds)
+        OSM.update_OSM(mode='postgis', engine=engine)
 
-            OSM.fetch_box_data()
+        OSM.fetch_box_data()
 
-            OSM.merge_OSM()
-            OSM.save_OSM(mode='postgis', engine=engine)
-            OSM.merged_gdf.to_postgis(f"""osem_bike_data""", engine, if_exists="replace", index=True)
+        OSM.merge_OSM()
+        OSM.save_OSM(mode='postgis', engine=engine)
+        OSM.merged_gdf.to_postgis(f"""osem_bike_data""", engine, if_exists="replace", index=True)
 
-            msg = {'state' : 'OK',
-                'message': f"ingested all data, Count of boxes: {len(boxIds)}"}
-            # self.update_config()
+        msg = {'state' : 'OK',
+            'message': f"ingested all data, Count of boxes: {len(boxIds)}"}
+        # self.update_config()
 
-            return mimetype, msg
-        finally:
-            engine.dispose()  # Ensure all connections are closed
+        return mimetype, msg
 
 
     def __repr__(self):
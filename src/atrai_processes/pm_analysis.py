@@ -5,14 +5,11 @@ from .atrai_processor import AtraiProcessor
 
 
 import pandas as pd
-import folium
-from folium.plugins import HeatMap
-import seaborn as sns
-import matplotlib.pyplot as plt
 import numpy as np
 
 from .useful_functs import filter_bike_data_location, replace_outliers_with_nan_by_device
 from .html_helper import create_pm25_legend_html, create_pm25_timeframe_legend_html
+from .spatial_binning import bin_points, heatmap_cells
 
 LOGGER = logging.getLogger(__name__)
 
@@ -91,7 +88,7 @@ def filter_season_and_time(filtered_data, start_time, end_time, selected_season,
     if season_filter:
         filtered_data = filtered_data[filtered_data['season'] == selected_season]
     
-    return filtered_data[['lat', 'lng', 'Finedust PM2.5']].dropna(subset=['lat', 'lng', 'Finedust PM2.5'])
+    return filtered_data[['lat', 'lng', 'Finedust PM2.5', 'geometry']].dropna(subset=['lat', 'lng', 'Finedust PM2.5'])
 
 class PMAnalysis(AtraiProcessor):
     def __init__(self, processor_def):
@@ -104,10 +101,16 @@ class PMAnalysis(AtraiProcessor):
 
 
     def execute(self, data):
+        # plotting libraries are only imported when the process runs
+        import folium
+        from folium.plugins import HeatMap
+        import seaborn as sns
+        import matplotlib.pyplot as plt
+
         mimetype =  'application/json'
 
         self.check_request_params(data)
-        atrai_bike_data = self.load_data()
+        atrai_bike_data = self.load_bike_data()
         atrai_bike_data['lng'] = atrai_bike_data['geometry'].x
         atrai_bike_data['lat'] = atrai_bike_data['geometry'].y
 
@@ -230,8 +233,25 @@ class PMAnalysis(AtraiProcessor):
 
         pm_monthly_avg.savefig(os.path.join(self.png_out, "pm_monthly_avg.png"))
 
-        pm25_data_heatmap = PM_no_outliers[['lat', 'lng', 'Finedust PM2.5']]
-        pm25_data_heatmap = pm25_data_heatmap.dropna(subset=['lat', 'lng', 'Finedust PM2.5'])
+        # PM concentrations per grid cell at several zoom levels
+        pm_grid = bin_points(PM_no_outliers, pm_columns)
+        self.data = pm_grid
+        self.create_collection_entries('pm_grid')
+
+        pm_grid.to_postgis(
+            self.title,
+            self.db_engine,
+            if_exists="replace",
+            index=False
+        )
+        if self.col_create:
+            self.update_config()
+        pm_grid_title = self.title
+
+        pm25_data_heatmap = PM_no_outliers[['lat', 'lng', 'Finedust PM2.5', 'geometry']]
+        pm25_data_heatmap = heatmap_cells(
+            pm25_data_heatmap.dropna(subset=['lat', 'lng', 'Finedust PM2.5']), 'Finedust PM2.5'
+        )
         m_PM25 = folium.Map(location=[51.9607, 7.6261], zoom_start=12)
         heat_data_25 = pm25_data_heatmap[['lat', 'lng', 'Finedust PM2.5']].values
         HeatMap(heat_data_25, radius = 10, blur = 10).add_to(m_PM25) #adjust radius and blur for change in visualization
@@ -250,7 +270,9 @@ class PMAnalysis(AtraiProcessor):
         start_time = pd.to_datetime("16:00", format="%H:%M").time() #change for different time of day
         end_time = pd.to_datetime("18:00", format="%H:%M").time() #change for different time of day
         selected_season = 'Autumn' #change for different season
-        data_timeframe = filter_season_and_time(seasonal_time_data, start_time, end_time, selected_season)
+        data_timeframe = heatmap_cells(
+            filter_season_and_time(seasonal_time_data, start_time, end_time, selected_season), 'Finedust PM2.5'
+        )
 
         m_PM25_timeframe = folium.Map(location=[51.9607, 7.6261], zoom_start=12)
         heat_data_timeframe = data_timeframe[['lat', 'lng', 'Finedust PM2.5']].values
@@ -264,7 +286,7 @@ class PMAnalysis(AtraiProcessor):
 
         outputs = {
             'id': 'pm_analysis',
-            'status': f"""created files at '{os.path.join(self.png_out, "pm_boxplots.png")}, '{os.path.join(self.html_out, "PM_25_heatmap.html")} and {os.path.join(self.html_out, "PM_25_timeframe_heatmap.html")}'"""
+            'status': f"""created collection '{pm_grid_title}' and files at '{os.path.join(self.png_out, "pm_boxplots.png")}, '{os.path.join(self.html_out, "PM_25_heatmap.html")} and {os.path.join(self.html_out, "PM_25_timeframe_heatmap.html")}'"""
         }
 
         return mimetype, outputs
@@ -0,0 +1,145 @@
+import os
+import re
+import json
+import logging
+import yaml
+from filelock import FileLock
+from sqlalchemy import text
+
+LOGGER = logging.getLogger(__name__)
+
+RUN_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# 'config' registers collections in the pygeoapi config file, 'database'
+# in the collection_registry table read by atrai_processes.wsgi at request time
+REGISTRY = os.environ.get("COLLECTION_REGISTRY", "config")
+REGISTRY_TABLE = "collection_registry"
+
+
+def valid_run_id(run_id):
+    """
+    Run ids end up in file names, only letters, digits, '-' and '_' are allowed.
+    """
+    return isinstance(run_id, str) and RUN_ID_PATTERN.match(run_id) is not None
+
+
+def read_config(config_file):
+    with open(config_file, "r") as file:
+        LOGGER.debug("read config")
+        return yaml.safe_load(file)
+
+
+def write_config(config_file, new_config):
+    with open(config_file, "w") as outfile:
+        yaml.dump(new_config, outfile, default_flow_style=False)
+    LOGGER.debug("updated config")
+
+
+def register_resources(config_file, resources):
+    """
+    Adds or replaces resources in the pygeoapi config with a single write.
+    Args:
+        config_file (str): Path of the pygeoapi config.
+        resources (dict): Resource definitions keyed by collection name.
+    """
+    if not resources:
+        return
+
+    with FileLock(f"{config_file}.lock"):
+        config = read_config(config_file)
+        config["resources"].update(resources)
+        write_config(config_file, config)
+    LOGGER.info(f"registered {len(resources)} resources: {', '.join(resources)}")
+
+
+def staging_file(config_file, run_id):
+    return f"{config_file}.{run_id}.pending"
+
+
+def stage_resources(config_file, run_id, resources):
+    """
+    Collects resources of a pipeline run in a spool file next to the config
+    instead of writing the config, which makes gunicorn reload the workers.
+    The spool file is shared by all workers taking part in the run.
+    """
+    spool = staging_file(config_file, run_id)
+    with FileLock(f"{spool}.lock"):
+        staged = {}
+        if os.path.exists(spool):
+            with open(spool, "r") as file:
+                staged = yaml.safe_load(file) or {}
+        staged.update(resources)
+        with open(spool, "w") as file:
+            yaml.dump(staged, file, default_flow_style=False)
+    LOGGER.debug(f"staged {', '.join(resources)} for run '{run_id}'")
+
+
+def commit_staged_resources(config_file, run_id):
+    """
+    Registers all resources staged for a run in one config write and
+    removes the spool file.
+    Returns:
+        list: Names of the registered resources.
+    """
+    spool = staging_file(config_file, run_id)
+    with FileLock(f"{spool}.lock"):
+        if not os.path.exists(spool):
+            return []
+        with open(spool, "r") as file:
+            staged = yaml.safe_load(file) or {}
+        register_resources(config_file, staged)
+        os.remove(spool)
+
+    if os.path.exists(f"{spool}.lock"):
+        os.remove(f"{spool}.lock")
+    return list(staged)
+
+
+def ensure_registry_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {REGISTRY_TABLE} (
+                name TEXT PRIMARY KEY,
+                resource JSONB NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """))
+
+
+def store_resources(engine, resources):
+    """
+    Adds or replaces resources in the collection registry table.
+    Args:
+        engine (Engine): SQLAlchemy engine of the PostGIS database.
+        resources (dict): Resource definitions keyed by collection name.
+    """
+    if not resources:
+        return
+
+    ensure_registry_table(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            text(f"""
+                INSERT INTO {REGISTRY_TABLE} (name, resource, updated_at)
+                VALUES (:name, CAST(:resource AS JSONB), now())
+                ON CONFLICT (name) DO UPDATE
+                SET resource = EXCLUDED.resource, updated_at = EXCLUDED.updated_at
+            """),
+            [{"name": name, "resource": json.dumps(resource)} for name, resource in resources.items()]
+        )
+    LOGGER.info(f"registered {len(resources)} resources: {', '.join(resources)}")
+
+
+def load_resources(engine):
+    """
+    All resources of the collection registry table keyed by collection name.
+    """
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"SELECT name, resource FROM {REGISTRY_TABLE} ORDER BY name"))
+        return {name: resource for name, resource in rows}
+
+
+def delete_resources(engine, names):
+    ensure_registry_table(engine)
+    with engine.begin() as conn:
+        conn.execute(text(f"DELETE FROM {REGISTRY_TABLE} WHERE name = ANY(:names)"), {"names": list(names)})
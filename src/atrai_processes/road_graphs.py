@@ -0,0 +1,216 @@
+"""
+Builds the bike road network graph of a list of places, either from the
+Overpass API or offline from a local OpenStreetMap extract (.osm.pbf).
+Built graphs are cached on disk as GraphML, keyed on the place list, the
+source and the network filter, so rebuilding a known network neither
+queries OSM nor parses the extract again. Graphs of extracts are reused
+until an extract changes, Overpass graphs for ROAD_GRAPH_CACHE_MAX_AGE
+hours as OSM keeps changing.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import numpy as np
+from filelock import FileLock
+import shapely
+from shapely.geometry import box
+
+LOGGER = logging.getLogger(__name__)
+
+SOURCES = ("overpass", "pbf")
+ROAD_NETWORK_SOURCE = os.environ.get("ROAD_NETWORK_SOURCE", "overpass")
+# local OSM extracts, e.g. from https://download.geofabrik.de
+OSM_PBF_DIR = os.environ.get("OSM_PBF_DIR", "/pygeoapi/data/osm")
+ROAD_GRAPH_CACHE_DIR = os.environ.get("ROAD_GRAPH_CACHE_DIR", "/pygeoapi/data/road_graphs")
+# hours an Overpass graph is reused, 0 queries OSM on every build
+ROAD_GRAPH_CACHE_MAX_AGE = float(os.environ.get("ROAD_GRAPH_CACHE_MAX_AGE", 24))
+
+NETWORK_TYPE = "bike"
+# pyrosm name of the osmnx bike network
+PBF_NETWORK_TYPE = "cycling"
+WAY_TAGS = ["surface", "oneway", "junction", "cycleway"]
+
+
+def extract_path(extract):
+    """
+    Path of an extract in OSM_PBF_DIR, only plain file names are accepted.
+    """
+    if not extract or os.path.basename(extract) != extract or not extract.endswith(".osm.pbf"):
+        raise ValueError(f"extract '{extract}' must be the file name of an .osm.pbf file in {OSM_PBF_DIR}")
+    path = os.path.join(OSM_PBF_DIR, extract)
+    if not os.path.isfile(path):
+        raise ValueError(f"extract '{extract}' not found in {OSM_PBF_DIR}")
+    return path
+
+
+def extract_bounds(path):
+    """
+    Bounding box of an extract as stored in its header, None if the
+    extract has none or pyrosm cannot read it.
+    """
+    try:
+        from pyrosm.utils import get_bounding_box
+    except ImportError:
+        return None
+    return get_bounding_box(path)
+
+
+def check_coverage(places, boundaries, paths):
+    """
+    Raises a ValueError if a place boundary is not within the bounding boxes
+    of the extracts. The header bounding box is a rectangle around the
+    extract, places just across its border are not detected. Without a
+    bounding box in every header the coverage is not checked.
+    """
+    bounds = [extract_bounds(path) for path in paths]
+    if any(bound is None for bound in bounds):
+        LOGGER.warning("an extract has no bounding box, the coverage of the places is not checked")
+        return
+    covered = shapely.union_all(bounds)
+    missing = [place for place, boundary in zip(places, boundaries) if not covered.contains(boundary)]
+    if missing:
+        raise ValueError(f"the extracts do not cover {', '.join(str(place) for place in missing)}")
+
+
+def _digest(key_parts):
+    return hashlib.sha1(json.dumps(key_parts, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def place_boundaries(places):
+    """
+    Boundaries of the places in EPSG:4326, in the order of the places. The
+    boundaries are geocoded once and kept in the cache directory, later
+    builds of the same places run without network access.
+    """
+    import geopandas as gpd
+    import osmnx as ox
+
+    path = os.path.join(ROAD_GRAPH_CACHE_DIR, f"boundary_{_digest(places)}.geojson")
+    os.makedirs(ROAD_GRAPH_CACHE_DIR, exist_ok=True)
+    with FileLock(f"{path}.lock"):
+        if not os.path.exists(path):
+            boundaries = ox.geocode_to_gdf(list(places))
+            boundaries[["geometry"]].to_file(path, driver="GeoJSON")
+        boundaries = gpd.read_file(path)
+    return list(boundaries.to_crs("EPSG:4326").geometry)
+
+
+def _graph_from_overpass(places):
+    import osmnx as ox
+    import networkx as nx
+
+    road_network = nx.MultiDiGraph()
+    for place in places:
+        G_place = ox.graph_from_place(place, network_type=NETWORK_TYPE)
+        road_network = nx.compose(road_network, G_place)
+    return road_network
+
+
+def _normalize_pbf_graph(G):
+    # same attribute types as an osmnx graph, missing tags are left out
+    for _, data in G.nodes(data=True):
+        for key in [key for key, val in data.items() if _is_missing(val)]:
+            del data[key]
+    for _, _, data in G.edges(data=True):
+        for key in [key for key, val in data.items() if _is_missing(val)]:
+            del data[key]
+        data["oneway"] = str(data.get("oneway")).lower() in ("yes", "true", "1", "-1")
+    return G
+
+
+def _is_missing(val):
+    return val is None or (isinstance(val, float) and np.isnan(val))
+
+
+def _graph_from_pbf(paths, area):
+    import osmnx as ox
+    import networkx as nx
+    from pyrosm import OSM
+
+    # roads crossing the border of neighbouring extracts share their OSM node ids
+    G = nx.MultiDiGraph()
+    for path in paths:
+        osm = OSM(path, bounding_box=area)
+        nodes, edges = osm.get_network(network_type=PBF_NETWORK_TYPE, nodes=True, extra_attributes=WAY_TAGS)
+        if edges is None or edges.empty:
+            LOGGER.warning(f"{os.path.basename(path)} holds no bike roads in the requested area")
+            continue
+        G = nx.compose(G, _normalize_pbf_graph(osm.to_graph(nodes, edges, graph_type="networkx")))
+    if G.number_of_edges() == 0:
+        raise ValueError("the extracts hold no bike roads in the requested area")
+    # graph_from_place returns simplified graphs as well
+    return ox.simplify_graph(G)
+
+
+def _cache_expired(cache_file, source):
+    # extract graphs are keyed on the extract files and do not expire
+    if source != "overpass":
+        return False
+    return time.time() - os.path.getmtime(cache_file) >= ROAD_GRAPH_CACHE_MAX_AGE * 3600
+
+
+def build_road_graph(places, source=None, extract=None, bbox=None, force=False):
+    """
+    Returns the bike road network of the places as osmnx MultiDiGraph.
+    Args:
+        places (list): Places as accepted by osmnx' geocoder.
+        source (str): 'overpass' or 'pbf', defaults to ROAD_NETWORK_SOURCE.
+        extract (str | list): File name of the extract in OSM_PBF_DIR or a
+            list of neighbouring extracts covering the places ('pbf').
+        bbox (list): [minx, miny, maxx, maxy] in EPSG:4326 clipping the
+            extract instead of the place boundaries ('pbf').
+        force (bool): Rebuild the graph even if it is cached. Overpass
+            graphs are rebuilt after ROAD_GRAPH_CACHE_MAX_AGE hours anyway.
+    Returns:
+        nx.MultiDiGraph: The road network.
+    """
+    import osmnx as ox
+
+    source = source or ROAD_NETWORK_SOURCE
+    if source not in SOURCES:
+        raise ValueError(f"unknown source '{source}', valid sources are {', '.join(SOURCES)}")
+
+    ox.settings.useful_tags_way = list(dict.fromkeys(ox.settings.useful_tags_way + WAY_TAGS))
+    key_parts = {"source": source, "places": places, "network_type": NETWORK_TYPE, "tags": WAY_TAGS}
+
+    paths = []
+    if source == "pbf":
+        extracts = extract if isinstance(extract, list) else [extract]
+        paths = [extract_path(name) for name in extracts]
+        if bbox is not None and len(bbox) != 4:
+            raise ValueError("bbox must be [minx, miny, maxx, maxy]")
+        # a replaced extract gets a new cache entry
+        key_parts.update({
+            "extracts": [
+                {"extract": name, "size": os.stat(path).st_size, "mtime": os.stat(path).st_mtime}
+                for name, path in zip(extracts, paths)
+            ],
+            "bbox": bbox,
+        })
+
+    cache_file = os.path.join(ROAD_GRAPH_CACHE_DIR, f"graph_{_digest(key_parts)}.graphml")
+    os.makedirs(ROAD_GRAPH_CACHE_DIR, exist_ok=True)
+
+    with FileLock(f"{cache_file}.lock"):
+        if os.path.exists(cache_file) and not force and not _cache_expired(cache_file, source):
+            LOGGER.debug(f"loading road graph from {cache_file}")
+            return ox.load_graphml(cache_file)
+
+        if source == "pbf":
+            if bbox is not None:
+                area = box(*bbox)
+                check_coverage(["bbox"], [area], paths)
+            else:
+                boundaries = place_boundaries(places)
+                check_coverage(places, boundaries, paths)
+                area = shapely.union_all(boundaries)
+            LOGGER.debug(f"building road graph from {', '.join(paths)}")
+            G = _graph_from_pbf(paths, area)
+        else:
+            G = _graph_from_overpass(places)
+
+        ox.save_graphml(G, f"{cache_file}.tmp")
+        os.replace(f"{cache_file}.tmp", cache_file)
+    return G
@@ -2,9 +2,9 @@ import os
 import logging
 from pygeoapi.process.base import BaseProcessor, ProcessorExecuteError
 from .atrai_processor import AtraiProcessor
+from . import run_cache, road_graphs
+from .map_points_to_road_network import SEGMENT_ID
 
-import osmnx as ox
-import networkx as nx
 from sqlalchemy import text
 
 
@@ -18,7 +18,10 @@ METADATA = {
     "title": {
         "en": "road_network",
     },
-    "description": {"en": "processes to calculate road network"},
+    "description": {
+        "en": "processes to calculate road network. Built networks are cached, Overpass networks "
+              "are reused for ROAD_GRAPH_CACHE_MAX_AGE hours (default 24), extract networks until the extract changes"
+    },
     "jobControlOptions": ["sync-execute", "async-execute"],
     "keywords": ["process"],
     "links": [
@@ -41,6 +44,27 @@ METADATA = {
             "description": "location to get the data from",
             "schema": {"type": "string"},
         },
+        "source": {
+            "title": "source",
+            "description": "'overpass' queries OSM, 'pbf' reads local extracts without network access",
+            "schema": {"type": "string", "enum": ["overpass", "pbf"]},
+        },
+        "extract": {
+            "title": "extract",
+            "description": "file name of the .osm.pbf extract in OSM_PBF_DIR or a list of extracts "
+                           "together covering the locations, source 'pbf' only",
+            "schema": {"oneOf": [{"type": "string"}, {"type": "array", "items": {"type": "string"}}]},
+        },
+        "bbox": {
+            "title": "bbox",
+            "description": "[minx, miny, maxx, maxy] in EPSG:4326 clipping the extract instead of the place boundaries",
+            "schema": {"type": "array", "items": {"type": "number"}, "minItems": 4, "maxItems": 4},
+        },
+        "force": {
+            "title": "force",
+            "description": "rebuild the road network even if it is cached and not expired",
+            "schema": {"type": "boolean"},
+        },
     },
     "outputs": {
         "id": {
@@ -57,6 +81,15 @@ METADATA = {
     "example": {"inputs": {"token": "ABC123XYZ666", "location": "Münster, Germany"}},
 }
 
+# {
+# 	"inputs": {
+# 		"location": ["Wiesbaden, Germany", "Mainz, Germany"],
+# 		"source": "pbf",
+# 		"extract": ["hessen-latest.osm.pbf", "rheinland-pfalz-latest.osm.pbf"],
+# 		"token": "token"
+# 	}
+# }
+
 # {
 # 	"inputs": {
 # 					"location": [
@@ -77,35 +110,24 @@ class RoadNetwork(AtraiProcessor):
         self.db_config = DatabaseConfig()
 
     def execute(self, data):
+        # osmnx is only imported when a road network is built
+        import osmnx as ox
+
         self.check_request_params(data)
         self.location = data.get("location")
-
-        ox.settings.useful_tags_way += ['surface', 'oneway', 'junction', "cycleway"]
-
-        filters = [
-            '["highway"~"cycleway"]',
-            '["highway"~"path|footway"]["bicycle"~"designated|yes"]',
-            '["highway"~"tertiary|unclassified"]["bicycle"!~"use_sidepath"]["cycleway:both"!~"separate"]',
-            '["highway"~"secondary|service"]["bicycle"~"yes"]',
-            '["highway"~"secondary|service"]["cycleway"~"no|lane|track|opposite_lane|opposite_track|shared_lane|shared_track|share_busway"]',
-            '["highway"~"secondary|service"]["cycleway:both"~"no|lane"]',
-            '["bicycle_road"~"yes"]',
-            '["highway"~"primary|secondary|service"]["cycleway:right"~"lane|share_busway"]',
-            '["highway"~"residential|tertiary"]',
-            '["oneway:bicycle"~"no"]',
-        ]
-
-        road_network = nx.MultiDiGraph()
-
-        for place in self.location:
-            G_place = ox.graph_from_place(
-                place,
-                #custom_filter=filters,
-                network_type="bike",
-                # simplify=True,
+        if isinstance(self.location, str):
+            self.location = [self.location]
+
+        try:
+            road_network = road_graphs.build_road_graph(
+                self.location,
+                source=data.get("source"),
+                extract=data.get("extract"),
+                bbox=data.get("bbox"),
+                force=bool(data.get("force")),
             )
-            road_network = nx.compose(road_network, G_place)
-
+        except ValueError as err:
+            raise ProcessorExecuteError(str(err))
 
         _, edges = ox.graph_to_gdfs(road_network)
 
@@ -127,7 +149,12 @@ class RoadNetwork(AtraiProcessor):
 
         #keep simple bike road table for other processes
         bike_road = edges.drop(columns = ['index','surface'])
+        # stable segment ids, the results of the processes refer to them
+        bike_road[SEGMENT_ID] = range(len(bike_road))
         bike_road.to_postgis(f"bike_road_network_{self.campaign}", engine, if_exists="replace", index=False)
+        if self.data_cache:
+            # processors of the run read the new network
+            run_cache.invalidate(self.data_cache, "road", {"table": self.road_data_table()})
 
 
 
@@ -0,0 +1,64 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import geopandas as gpd
+from filelock import FileLock
+
+LOGGER = logging.getLogger(__name__)
+
+# local directory of the per run caches, one sub directory per cache id
+RUN_CACHE_DIR = os.environ.get("RUN_CACHE_DIR", "/tmp/atrai_run_cache")
+
+
+def cache_path(cache_id, kind, key_parts):
+    """
+    Path of a cached frame, named by its kind ('bike', 'road') and a hash
+    of the parameters selecting it.
+    """
+    digest = hashlib.sha1(json.dumps(key_parts, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return os.path.join(RUN_CACHE_DIR, cache_id, f"{kind}_{digest}.arrow")
+
+
+def cached_frame(cache_id, kind, key_parts, load):
+    """
+    Returns the frame cached for a pipeline run, loading and caching it on
+    first use. Frames are stored as uncompressed Feather (Arrow IPC) files
+    and read memory mapped. Processors of the same run running in parallel
+    wait for the first one instead of querying the database as well.
+    Args:
+        cache_id (str): Id of the pipeline run, validated by the caller.
+        kind (str): 'bike' or 'road'.
+        key_parts (dict): Parameters selecting the data.
+        load (callable): Loads the GeoDataFrame from the database.
+    Returns:
+        gpd.GeoDataFrame: The cached data, a new frame on every call.
+    """
+    path = cache_path(cache_id, kind, key_parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with FileLock(f"{path}.lock"):
+        if not os.path.exists(path):
+            gdf = load()
+            gdf.to_feather(f"{path}.tmp", compression="uncompressed")
+            os.replace(f"{path}.tmp", path)
+            LOGGER.debug(f"cached {len(gdf)} rows of '{kind}' in {path}")
+            return gdf
+
+    LOGGER.debug(f"reading '{kind}' from the run cache {path}")
+    return gpd.read_feather(path, memory_map=True)
+
+
+def invalidate(cache_id, kind, key_parts):
+    path = cache_path(cache_id, kind, key_parts)
+    with FileLock(f"{path}.lock"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def clear_run_cache(cache_id):
+    """
+    Removes the cache of a finished pipeline run.
+    """
+    shutil.rmtree(os.path.join(RUN_CACHE_DIR, cache_id), ignore_errors=True)
@@ -0,0 +1,142 @@
+"""
+Snapshot files hand GeoDataFrames to worker processes without pickling.
+A snapshot is a directory holding
+
+    coords.npy        vertex coordinates of all geometries (n, 2)
+    offsets_<i>.npy   ragged array offsets of line and polygon geometries
+    columns.arrow     the attribute columns and the index as Arrow IPC file
+    <name>.npy        additional arrays, e.g. group boundaries
+    meta.json         geometry type, crs and row count
+
+All files are opened memory mapped, workers reading the same snapshot
+share the pages of the page cache instead of holding copies.
+"""
+import os
+import json
+import shutil
+import logging
+import tempfile
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import shapely
+
+LOGGER = logging.getLogger(__name__)
+
+# /dev/shm keeps the snapshots in memory, defaults to the temp directory
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR") or None
+
+
+def write_snapshot(gdf, path, arrays=None):
+    """
+    Writes a GeoDataFrame as snapshot directory.
+    Args:
+        gdf (gpd.GeoDataFrame): Data without missing geometries.
+        path (str): Directory of the snapshot, replaced if it exists.
+        arrays (dict): Additional numpy arrays stored with the snapshot.
+    Returns:
+        str: The path of the snapshot.
+    """
+    geometry = gdf.geometry
+    if geometry.isna().any():
+        raise ValueError("snapshots cannot hold missing geometries")
+
+    geom_type, coords, offsets = shapely.to_ragged_array(geometry.values, include_z=False)
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".snapshot.", dir=parent)
+    try:
+        np.save(os.path.join(staging, "coords.npy"), np.ascontiguousarray(coords, dtype=np.float64))
+        for i, offset in enumerate(offsets):
+            np.save(os.path.join(staging, f"offsets_{i}.npy"), offset)
+        for name, values in (arrays or {}).items():
+            np.save(os.path.join(staging, f"{name}.npy"), np.asarray(values))
+
+        table = pa.Table.from_pandas(pd.DataFrame(gdf.drop(columns=geometry.name)), preserve_index=True)
+        with pa.OSFile(os.path.join(staging, "columns.arrow"), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+        with open(os.path.join(staging, "meta.json"), "w") as f:
+            json.dump({
+                "rows": len(gdf),
+                "geometry_type": int(geom_type),
+                "geometry_column": geometry.name,
+                "n_offsets": len(offsets),
+                "arrays": list(arrays or {}),
+                "crs": gdf.crs.to_wkt() if gdf.crs else None,
+            }, f)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(staging, path)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    LOGGER.debug(f"wrote snapshot of {len(gdf)} rows to {path}")
+    return path
+
+
+class Snapshot:
+    """
+    A memory mapped snapshot, see `write_snapshot`.
+    Attributes:
+        coords (np.ndarray): Read only vertex coordinates.
+        columns (pa.Table): The attribute columns, backed by the mapped file.
+        arrays (dict): The additional arrays of the snapshot.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+
+        self.geometry_type = shapely.GeometryType(self.meta["geometry_type"])
+        self.coords = np.load(os.path.join(path, "coords.npy"), mmap_mode="r")
+        self.offsets = tuple(
+            np.load(os.path.join(path, f"offsets_{i}.npy"), mmap_mode="r") for i in range(self.meta["n_offsets"])
+        )
+        self.arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in self.meta["arrays"]
+        }
+        self.columns = pa.ipc.open_file(pa.memory_map(os.path.join(path, "columns.arrow"))).read_all()
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def geometries(self, start=0, stop=None):
+        stop = len(self) if stop is None else stop
+        if self.geometry_type == shapely.GeometryType.POINT:
+            # points map one to one to the coordinates
+            return shapely.points(self.coords[start:stop])
+        geoms = shapely.from_ragged_array(self.geometry_type, self.coords, self.offsets)
+        return geoms[start:stop]
+
+    def frame(self, start=0, stop=None):
+        """
+        The rows start:stop as GeoDataFrame with the original index.
+        """
+        stop = len(self) if stop is None else stop
+        df = self.columns.slice(start, stop - start).to_pandas()
+        return gpd.GeoDataFrame(
+            df,
+            geometry=gpd.GeoSeries(self.geometries(start, stop), index=df.index, name=self.meta["geometry_column"]),
+            crs=self.meta["crs"],
+        )
+
+
+# snapshots opened by this process
+_OPENED = {}
+
+
+def open_snapshot(path):
+    """
+    Opens a snapshot once per process.
+    """
+    snapshot = _OPENED.get(path)
+    if snapshot is None:
+        snapshot = _OPENED[path] = Snapshot(path)
+    return snapshot
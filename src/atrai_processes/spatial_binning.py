@@ -0,0 +1,113 @@
+import logging
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+LOGGER = logging.getLogger(__name__)
+
+# web mercator tile zoom levels of the published grids,
+# a cell is roughly 1.5km, 380m and 95m wide in Münster
+GRID_ZOOMS = [14, 16, 18]
+# zoom level of the cells feeding the html heatmaps
+HEATMAP_ZOOM = 18
+MAX_LATITUDE = 85.0511287798
+
+
+def lnglat_to_tile(lng, lat, zoom):
+    """
+    Web mercator (slippy map) tile indices of the given coordinates.
+    Args:
+        lng (np.ndarray): Longitudes in degrees.
+        lat (np.ndarray): Latitudes in degrees.
+        zoom (int): Zoom level.
+    Returns:
+        tuple: (x, y) integer arrays of the tile indices.
+    """
+    n = 2 ** zoom
+    lat_rad = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    x = np.floor((np.asarray(lng) + 180.0) / 360.0 * n)
+    y = np.floor((1.0 - np.arcsinh(np.tan(lat_rad)) / np.pi) / 2.0 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
+
+
+def tile_to_lnglat(x, y, zoom):
+    """
+    Coordinates of the upper left corner of the given tiles, fractional
+    tile indices address points within the tile.
+    Returns:
+        tuple: (lng, lat) arrays in degrees.
+    """
+    n = 2 ** zoom
+    lng = np.asarray(x) / n * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * np.asarray(y) / n))))
+    return lng, lat
+
+
+def tile_quadkeys(x, y, zoom):
+    """
+    Bing style quadkeys of the given tiles, e.g. '120203...', one digit per
+    zoom level, so the quadkey of a cell starts with the ones of its parents.
+    """
+    shifts = np.arange(zoom - 1, -1, -1)
+    digits = ((np.asarray(x)[:, None] >> shifts) & 1) + 2 * ((np.asarray(y)[:, None] >> shifts) & 1)
+    return ["".join(row) for row in digits.astype(str)]
+
+
+def bin_points(points, value_columns, zooms=GRID_ZOOMS, group_columns=None):
+    """
+    Aggregates point measurements per web mercator tile cell at several zoom
+    levels, so maps can show the cells instead of every single measurement.
+    Args:
+        points (gpd.GeoDataFrame): Point data in EPSG:4326.
+        value_columns (list): Columns averaged per cell, the names are kept.
+        zooms (list): Zoom levels of the cells.
+        group_columns (list): Additional columns to aggregate by, e.g. 'Season'.
+    Returns:
+        gpd.GeoDataFrame: One polygon per cell and group with the columns
+            'zoom', 'quadkey', 'tile_x', 'tile_y', the group columns, the
+            averaged value columns, 'Number of Points' and 'Number of Boxes'.
+    """
+    group_columns = list(group_columns or [])
+    points = points[points.geometry.notna() & ~points.geometry.is_empty]
+    coords = shapely.get_coordinates(points.geometry.to_numpy())
+
+    aggregations = {col: (col, "mean") for col in value_columns}
+    aggregations["Number of Points"] = ("tile_x", "size")
+    if "boxId" in points.columns:
+        aggregations["Number of Boxes"] = ("boxId", "nunique")
+
+    frame = pd.DataFrame({
+        col: points[col].to_numpy()
+        for col in dict.fromkeys(group_columns + list(value_columns) + ["boxId"])
+        if col in points.columns
+    })
+
+    cells = []
+    for zoom in zooms:
+        frame["tile_x"], frame["tile_y"] = lnglat_to_tile(coords[:, 0], coords[:, 1], zoom)
+        binned = frame.groupby(group_columns + ["tile_x", "tile_y"]).agg(**aggregations).reset_index()
+        binned.insert(0, "zoom", zoom)
+        binned.insert(1, "quadkey", tile_quadkeys(binned["tile_x"], binned["tile_y"], zoom))
+        cells.append(binned)
+
+    cells = pd.concat(cells, ignore_index=True)
+    west, north = tile_to_lnglat(cells["tile_x"], cells["tile_y"], cells["zoom"])
+    east, south = tile_to_lnglat(cells["tile_x"] + 1, cells["tile_y"] + 1, cells["zoom"])
+    cells["id"] = cells.index
+
+    return gpd.GeoDataFrame(
+        cells, geometry=shapely.box(west, south, east, north), crs="EPSG:4326"
+    )
+
+
+def heatmap_cells(points, value_column, zoom=HEATMAP_ZOOM):
+    """
+    Averages the value column per cell of the given zoom level and returns
+    the cell centers, a compact replacement of the raw points in heatmaps.
+    Returns:
+        pd.DataFrame: Columns 'lat', 'lng' and the averaged value column.
+    """
+    cells = bin_points(points, [value_column], zooms=[zoom])
+    lng, lat = tile_to_lnglat(cells["tile_x"] + 0.5, cells["tile_y"] + 0.5, zoom)
+    return pd.DataFrame({"lat": lat, "lng": lng, value_column: cells[value_column].to_numpy()})
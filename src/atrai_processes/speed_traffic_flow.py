@@ -5,16 +5,10 @@ from .atrai_processor import AtraiProcessor
 
 
 import pandas as pd
-import folium
 import geopandas as gpd
-import matplotlib.cm as cm
-import matplotlib.colors as mcolors
 import numpy as np
-from sklearn.neighbors import BallTree
-from sqlalchemy import create_engine
 
-from .html_helper import create_speed_legend_html, create_traffic_flow_legend_html
-from .useful_functs import filter_bike_data_location, nearest_neighbor_search
+from .useful_functs import filter_bike_data_location, nearest_neighbor_search, segment_rides
 
 LOGGER = logging.getLogger(__name__)
 
@@ -75,27 +69,18 @@ METADATA = {
     }
 }
 
-def filter_start_end(group):
-    standing_threshold = 0.9
-    group = group.copy()
+def filter_start_end(data, standing_threshold=0.9):
+    """
+    Drops the measurements at the start and end of each ride during which
+    the bike is standing, i.e. everything before the first and after the
+    last measurement with 'Standing' <= standing_threshold.
+    """
+    rides = [data['boxId'], data['ride_id']]
+    moving = data['Standing'] <= standing_threshold
+    started = moving.groupby(rides).cummax()
+    not_ended = moving[::-1].groupby(rides).cummax()[::-1]
 
-    start_indices_to_drop = []
-    for idx, row in group.iterrows():
-        if row['Standing'] > standing_threshold:
-            start_indices_to_drop.append(idx)
-        else:
-            break
-
-    end_indices_to_drop = []
-    for idx, row in group[::-1].iterrows():
-        if row['Standing'] > standing_threshold:
-            end_indices_to_drop.append(idx)
-        else:
-            break
-
-    group = group.drop(index=start_indices_to_drop + end_indices_to_drop)
-
-    return group
+    return data[started & not_ended]
 
 class SpeedTrafficFlow(AtraiProcessor):
     def __init__(self, processor_def):
@@ -107,6 +92,9 @@ class SpeedTrafficFlow(AtraiProcessor):
         # SPEED MAP WF
         #
         self.check_request_params(data)
+        cached = self.memoized_result(data)
+        if cached is not None:
+            return cached
         atrai_bike_data = self.load_bike_data()
         edges_filtered = self.load_road_data()
         atrai_bike_data['lng'] = atrai_bike_data['geometry'].x
@@ -172,12 +160,9 @@ class SpeedTrafficFlow(AtraiProcessor):
         atrai_bike_data = atrai_bike_data[['createdAt', 'Speed', 'lat', 'lng', 'boxId', 'Standing', 'geometry']]
         atrai_bike_data['createdAt'] = pd.to_datetime(atrai_bike_data['createdAt'])
         atrai_bike_data = atrai_bike_data.dropna(subset=['Standing'])
-        atrai_bike_data = atrai_bike_data.sort_values(by='createdAt')
-        atrai_bike_data['time_diff'] = atrai_bike_data.groupby('boxId')['createdAt'].diff().dt.total_seconds() / 60
-        atrai_bike_data['new_ride'] = atrai_bike_data['time_diff'] > 10
-        atrai_bike_data['ride_id'] = atrai_bike_data.groupby('boxId')['new_ride'].cumsum() + 1
+        atrai_bike_data = segment_rides(atrai_bike_data, max_gap=10 * 60)
 
-        atrai_bike_data = atrai_bike_data.groupby('ride_id').apply(lambda group: filter_start_end(group)).reset_index(drop=True)
+        atrai_bike_data = filter_start_end(atrai_bike_data).reset_index(drop=True)
         
         atrai_bike_data = atrai_bike_data[atrai_bike_data['Speed'] >= 0]
         percentile_999_tf = atrai_bike_data['Speed'].quantile(0.999)
@@ -227,7 +212,7 @@ class SpeedTrafficFlow(AtraiProcessor):
             'status': f"""done"""
         }
 
-        return self.mimetype, outputs
+        return self.memoize_result(self.mimetype, outputs)
 
     def __repr__(self):
         return f'<SpeedTrafficFlow> {self.name}'
\ No newline at end of file
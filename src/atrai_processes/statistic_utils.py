@@ -1,13 +1,14 @@
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely import LineString
+import shapely
 import logging
-from sklearn.cluster import DBSCAN
 from shapely.geometry import Point
 
 LOGGER = logging.getLogger(__name__)
 
+THINNING_METHODS = ("dbscan", "sequential", "grid")
+
 
 # def filter_points(points, eps=10):
 #     """
@@ -30,85 +31,192 @@ LOGGER = logging.getLogger(__name__)
 #         filtered_points.append(centroid)
 #
 #     return [Point(y, x) for y, x in filtered_points]
-def filter_points(points, eps=10):
+def filter_points(coords, eps=10, method="dbscan"):
     """
-    Filter points using DBSCAN clustering to remove clustered points.
+    Thin out the points of a single tour to remove clustered points.
+    Args:
+        coords (np.ndarray): Array of shape (n, 2) with lng/lat coordinates.
+        eps (float): Distance threshold in meters.
+        method (str): 'dbscan' merges DBSCAN clusters into their centroids,
+            'sequential' keeps a point once it is at least eps away from the
+            last kept point, 'grid' merges points per grid cell of size eps.
+    Returns:
+        np.ndarray: Array of shape (m, 2) with the remaining points.
     """
     # Check if the list of points is empty
-    if not points:
-        return []
+    if len(coords) == 0:
+        return np.empty((0, 2))
+
+    if method == "sequential":
+        return sequential_thinning(coords, eps)
+    if method == "grid":
+        return grid_thinning(coords, np.zeros(len(coords), dtype=np.int64), eps)[0]
+    if method != "dbscan":
+        raise ValueError(f"unknown thinning method '{method}'")
+
+    from sklearn.cluster import DBSCAN
 
-    coords = np.array([(point.y, point.x) for point in points])
     # Convert meters to degrees
     clustering = DBSCAN(eps=eps / 111139, min_samples=1).fit(coords)
-    unique_labels = set(clustering.labels_)
+    labels = clustering.labels_
+    unique_labels = np.unique(labels)
 
     filtered_points = []
     for label in unique_labels:
-        cluster_points = coords[clustering.labels_ == label]
-        centroid = cluster_points.mean(axis=0)
-        filtered_points.append(centroid)
+        cluster_points = coords[labels == label]
+        filtered_points.append(cluster_points.mean(axis=0))
+
+    return np.array(filtered_points)
+
+def sequential_thinning(coords, eps=10):
+    """
+    Walks along the trajectory and keeps a point only if it is at least eps
+    meters away from the previously kept point. Linear in the number of points.
+    """
+    threshold = eps / 111139
+    xs, ys = coords[:, 0].tolist(), coords[:, 1].tolist()
+    keep = [0]
+    last_x, last_y = xs[0], ys[0]
+    for i in range(1, len(xs)):
+        if (xs[i] - last_x) ** 2 + (ys[i] - last_y) ** 2 >= threshold ** 2:
+            keep.append(i)
+            last_x, last_y = xs[i], ys[i]
+
+    return coords[keep]
+
+def grid_thinning(coords, tour_ids, eps=10):
+    """
+    Snaps the points of all tours at once to a grid with cell size eps and
+    merges the points of a tour within one cell into their centroid. Cells
+    keep the order of their first point, tour ids must be contiguous.
+    Returns:
+        tuple: (coords, tour_ids) of the remaining points.
+    """
+    cells = np.floor(coords / (eps / 111139)).astype(np.int64)
+    frame = pd.DataFrame({
+        "tour_id": tour_ids,
+        "cell_x": cells[:, 0],
+        "cell_y": cells[:, 1],
+        "x": coords[:, 0],
+        "y": coords[:, 1],
+    })
+    centroids = frame.groupby(["tour_id", "cell_x", "cell_y"], sort=False)[["x", "y"]].mean()
+
+    return centroids.to_numpy(), centroids.index.get_level_values("tour_id").to_numpy()
+
+def thin_tours(coords, tour_ids, eps=10, method="dbscan"):
+    """
+    Applies `filter_points` to every tour of the flat coordinate array.
+    Tours need to be contiguous, i.e. the input sorted by tour id.
+    Returns:
+        tuple: (coords, tour_ids) of the remaining points.
+    """
+    if len(tour_ids) == 0:
+        return np.empty((0, 2)), np.empty(0, dtype=np.int64)
+
+    if method == "grid":
+        return grid_thinning(coords, tour_ids, eps)
 
-    return [Point(y, x) for y, x in filtered_points]
+    thinned_coords = []
+    thinned_ids = []
+    splits = np.flatnonzero(np.diff(tour_ids)) + 1
+    for tour_coords, ids in zip(np.split(coords, splits), np.split(tour_ids, splits)):
+        filtered = filter_points(tour_coords, eps=eps, method=method)
+        thinned_coords.append(filtered)
+        thinned_ids.append(np.full(len(filtered), ids[0]))
 
-def process_tours(data, interval=15):
+    return np.concatenate(thinned_coords), np.concatenate(thinned_ids)
+
+def process_tours(data, interval=15, thinning="dbscan"):
     """
     Process tours from the given data.
     Args:
         data (pd.DataFrame): DataFrame containing the data to process.
         interval (int): Time interval in minutes to determine if a new tour starts.
+        thinning (str): Method used to remove clustered points, see `filter_points`.
     Returns:
         gpd.GeoDataFrame: GeoDataFrame containing the processed tours.
     """
-    boxids = data["boxId"].unique()
-    all_tours = []
-
-    for boxid in boxids:
-        subset = data[data["boxId"] == boxid]
-        subset["createdAt"] = pd.to_datetime(subset["createdAt"])
-        subset = subset.sort_values(by="createdAt")
-        subset["tdiff"] = subset["createdAt"].diff()
-        subset["tour"] = (subset["tdiff"] > pd.Timedelta(
-            minutes=interval)).cumsum()
-        subset.drop(columns=["tdiff"], inplace=True)
-
-        tours = subset["tour"].unique()
-        for tour in tours:
-            tour_data = subset[subset["tour"] == tour]
-            ps = pd.Series([x for x in tour_data["geometry"]])
-            valid_points = [p for p in ps if p is not None]
-            # Apply filtering to remove clustered points
-            valid_points = filter_points(valid_points)
-            if len(valid_points) > 1:
-                line = LineString(valid_points)
-                start_time = tour_data["createdAt"].iloc[0]
-                end_time = tour_data["createdAt"].iloc[-1]
-                duration = (end_time - start_time).total_seconds()
-                # Convert degrees to meters (approximation for WGS 84).
-                distance = line.length * 111139
-
-                # Apply filters: at least 120 seconds, 500 meters, and 10 points
-                if duration >= 120 and distance >= 500 and len(valid_points) >= 10:
-                    all_tours.append(
-                        {
-                            "boxid": boxid,
-                            "tour": f"tour_{tour}",
-                            "geometry": line,
-                            "start_time": start_time,
-                            "end_time": end_time,
-                            "duration": duration,
-                            "distance": distance,
-                            "kcal": calc_calories(
-                                duration_s=duration,
-                            ),
-                        }
-                    )
-
-    gdf = gpd.GeoDataFrame(all_tours, geometry="geometry").set_crs("EPSG:4326")
+    columns = ["boxid", "tour", "geometry", "start_time", "end_time", "duration", "distance", "kcal"]
+
+    data = data[["boxId", "createdAt", "geometry"]].copy()
+    data["createdAt"] = pd.to_datetime(data["createdAt"])
+    data = data.sort_values(by=["boxId", "createdAt"], kind="stable")
+
+    # a new tour starts whenever the gap to the previous measurement of the same box exceeds the interval
+    tdiff = data.groupby("boxId")["createdAt"].diff()
+    data["tour"] = (tdiff > pd.Timedelta(minutes=interval)).groupby(data["boxId"]).cumsum()
+    data["tour_id"] = data.groupby(["boxId", "tour"], sort=False).ngroup()
+
+    tours = data.groupby("tour_id").agg(
+        boxid=("boxId", "first"),
+        tour=("tour", "first"),
+        start_time=("createdAt", "min"),
+        end_time=("createdAt", "max"),
+    )
+    tours["duration"] = (tours["end_time"] - tours["start_time"]).dt.total_seconds()
+
+    valid = data["geometry"].notna().to_numpy()
+    coords = shapely.get_coordinates(data["geometry"].to_numpy()[valid])
+    tour_ids = data["tour_id"].to_numpy()[valid]
+
+    # Apply filtering to remove clustered points, tours are contiguous after sorting
+    thinned_coords, thinned_ids = thin_tours(coords, tour_ids, method=thinning)
+
+    if len(thinned_ids) == 0:
+        return gpd.GeoDataFrame(columns=columns, geometry="geometry", crs="EPSG:4326")
+
+    # Filter: at least 10 points before building the lines
+    point_counts = pd.Series(thinned_ids).value_counts()
+    keep_ids = point_counts.index[point_counts >= 10]
+    keep = np.isin(thinned_ids, keep_ids)
+    line_ids, line_indices = np.unique(thinned_ids[keep], return_inverse=True)
+
+    tours = tours.loc[line_ids]
+    tours["geometry"] = shapely.linestrings(thinned_coords[keep], indices=line_indices)
+    # Convert degrees to meters (approximation for WGS 84).
+    tours["distance"] = shapely.length(tours["geometry"].to_numpy()) * 111139
+
+    # Apply filters: at least 120 seconds and 500 meters
+    tours = tours[(tours["duration"] >= 120) & (tours["distance"] >= 500)]
+    tours["tour"] = "tour_" + tours["tour"].astype(str)
+    tours["kcal"] = calc_calories(duration_s=tours["duration"])
+
+    gdf = gpd.GeoDataFrame(
+        tours[columns].reset_index(drop=True), geometry="geometry"
+    ).set_crs("EPSG:4326")
 
     return gdf
 
 
+def convex_hull(geometries):
+    """
+    Convex hull of point geometries computed from the coordinate array,
+    without unioning all points into one MultiPoint first.
+    Points inside the polygon spanned by the extreme points (Akl-Toussaint
+    heuristic) can not be part of the hull and are dropped beforehand.
+    Args:
+        geometries (array-like): Point geometries, None values are ignored.
+    Returns:
+        shapely.Geometry: The convex hull or None for no points.
+    """
+    coords = shapely.get_coordinates(np.asarray(geometries))
+    if len(coords) == 0:
+        return None
+
+    x, y = coords[:, 0], coords[:, 1]
+    extremes = coords[[
+        np.argmin(x), np.argmin(x + y), np.argmin(y), np.argmax(x - y),
+        np.argmax(x), np.argmax(x + y), np.argmax(y), np.argmin(x - y),
+    ]]
+    octagon = shapely.Polygon(extremes)
+    if octagon.is_valid and octagon.area > 0:
+        coords = coords[~shapely.contains_xy(octagon, x, y)]
+        coords = np.vstack([coords, extremes])
+
+    return shapely.multipoints(np.unique(coords, axis=0)).convex_hull
+
+
 def calc_calories(duration_s):
     """
     Super simple calculation of calories burned based on MET value.
@@ -125,17 +233,26 @@ def calc_calories(duration_s):
 
 
 def calculate_periodic_stats(tours_gdf):
+    start_time = tours_gdf["start_time"]
+    if start_time.dt.tz is not None:
+        # wall time, the periods are calendar days and weeks as with .dt.date / .dt.to_period
+        start_time = start_time.dt.tz_localize(None)
+    start_day = start_time.dt.normalize()
+    # Monday of the week, same as .dt.to_period("W").start_time
+    week_start = start_day - pd.to_timedelta(start_day.dt.dayofweek, unit="D")
+
     # Determine if data covers at least 2 unique weeks
-    weeks = tours_gdf["start_time"].dt.to_period("W").unique()
-    if len(weeks) < 2:
+    if week_start.nunique() < 2:
         # Use daily stats
-        tours_gdf["period"] = tours_gdf["start_time"].dt.date
+        period = start_day
     else:
         # Use weekly stats
-        tours_gdf["period"] = tours_gdf["start_time"].dt.to_period(
-            "W").apply(lambda r: r.start_time)
+        period = week_start
 
-    periodic_stats = tours_gdf.groupby("period").agg(
+    periodic_stats = tours_gdf.assign(
+        period=period,
+        speed_kmh=tours_gdf["distance"] / tours_gdf["duration"] * 3.6,
+    ).groupby("period").agg(
         trip_count=("duration", "count"),
         total_duration_s=("duration", "sum"),
         average_duration_s=("duration", "mean"),
@@ -145,13 +262,12 @@ def calculate_periodic_stats(tours_gdf):
         average_distance_m=("distance", "mean"),
         max_distance_m=("distance", "max"),
         min_distance_m=("distance", "min"),
-        average_speed_kmh=("distance", lambda x: (
-            x / tours_gdf.loc[x.index, "duration"]).mean() * 3.6),
+        average_speed_kmh=("speed_kmh", "mean"),
         total_kcal=("kcal", "sum"),
     ).reset_index().rename(columns={"period": "period_start"})
 
-    # Convert period_start to string for serialization
-    periodic_stats["period_start"] = periodic_stats["period_start"].astype(str)
+    # Convert period_start to a date string for serialization, e.g. '2024-05-01'
+    periodic_stats["period_start"] = periodic_stats["period_start"].dt.strftime("%Y-%m-%d")
 
     # Add a "week" column with the same value as "period_start"
     # TODO: remove after renaming "week" to "periodic stat everywhere"
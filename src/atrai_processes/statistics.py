@@ -9,13 +9,18 @@ import pandas as pd
 import geopandas as gpd
 
 from sqlalchemy import text
+from shapely.geometry import GeometryCollection
 
-from .statistic_utils import process_tours, tour_stats
+from .statistic_utils import THINNING_METHODS, convex_hull, process_tours, tour_stats
 
 
 
 LOGGER = logging.getLogger(__name__)
 
+# per box state of the incremental campaign statistics
+WATERMARK_TABLE = "tour_box_watermarks"
+HULL_TABLE = "tour_hulls"
+
 METADATA = {
     "version": "0.2.0",
     "id": "statistics",
@@ -45,6 +50,16 @@ METADATA = {
             "description": "tag to filter data",
             "schema": {"type": "string"},
         },
+        "full_refresh": {
+            "title": "full refresh",
+            "description": "recompute all tours of the campaign instead of only the ones touched by new data",
+            "schema": {"type": "boolean"},
+        },
+        "thinning": {
+            "title": "thinning",
+            "description": "method to remove clustered tour points: 'dbscan' (default), 'sequential' or 'grid'",
+            "schema": {"type": "string", "enum": ["dbscan", "sequential", "grid"]},
+        },
     },
     "outputs": {
         "id": {
@@ -65,92 +80,279 @@ METADATA = {
 class Statistics(AtraiProcessor):
     def __init__(self, processor_def):
         super().__init__(processor_def, METADATA)
+        self.tour_interval = 12
 
 
-    def execute(self, data):
-        # check params
-        self.check_request_params(data)
-        # load data
-        self.check_request_params(data)
-        atrai_bike_data = self.load_bike_data()
-
-        try:
-            # Step 1: Load raw bike data
-            # query = text("SELECT * FROM osem_bike_data WHERE tags LIKE :tag")
-            # atrai_bike_data = gpd.read_postgis(
-            #     query,
-            #     params={"tag": f"%{self.tag}%"},
-            #     con=engine,
-            #     geom_col="geometry",
-            # )
-            
-            if len(atrai_bike_data) == 0:
-                raise ProcessorExecuteError("No data found for the given tag")
-
-            # Step 2: Process tours
-            tours = process_tours(atrai_bike_data, interval=12)
-            stats = tour_stats(tours)
-
-            # Step 3: Calculate convex hull 
-            convex_hull = atrai_bike_data.unary_union.convex_hull
-
-            # Step 4: Create GeoDataFrame containing one row with the bounding box and all the statistics
-            tag_value = self.campaign if self.campaign is not None else self.boxId
-            if isinstance(tag_value, list):
-                ids_to_delete = tag_value
-            else:
-                ids_to_delete = [tag_value]
+    def load_tour_state(self, conn, box_ids, thinning):
+        """
+        Returns per box of the campaign the time from which its tours need
+        to be recomputed, None to recompute all tours of the box.
+
+        osem_bike_data is replaced on every ingest and has no ingest time,
+        so a box is only continued if its number of measurements up to its
+        watermark is unchanged. Late synced or backfilled measurements, new
+        boxes and a different thinning method recompute the whole box.
+        Otherwise the box continues at the start of its last segment before
+        the watermark, the only tour that new measurements can extend, a box
+        with a single segment at its first measurement. Boxes without any
+        measurements so far have no watermark, recomputing them costs nothing.
+        """
+        since = {box_id: None for box_id in box_ids}
+        if not self.db_engine.dialect.has_table(conn, WATERMARK_TABLE):
+            return since
+
+        other_thinning = conn.execute(
+            text(f"SELECT count(*) FROM {WATERMARK_TABLE} WHERE tag = :tag AND thinning <> :thinning"),
+            {"tag": self.campaign, "thinning": thinning},
+        ).scalar()
+        if other_thinning:
+            LOGGER.info(f"tours of '{self.campaign}' were thinned differently, recomputing all tours")
+            return since
+
+        rows = conn.execute(
+            text(f"""
+                WITH points AS (
+                    SELECT o."boxId", o."createdAt", w.n_points,
+                           o."createdAt" - lag(o."createdAt") OVER (PARTITION BY o."boxId" ORDER BY o."createdAt") AS gap
+                    FROM osem_bike_data o
+                    JOIN {WATERMARK_TABLE} w ON w.tag = :tag AND w.boxid = o."boxId"
+                    WHERE o."boxId" = ANY(:box_ids) AND o."createdAt" <= w."processedUntil"
+                )
+                SELECT "boxId", max(n_points) AS stored, count(*) AS current,
+                       COALESCE(max("createdAt") FILTER (WHERE gap > :interval), min("createdAt")) AS open_since
+                FROM points
+                GROUP BY "boxId"
+            """),
+            {"tag": self.campaign, "box_ids": list(box_ids), "interval": pd.Timedelta(minutes=self.tour_interval).to_pytimedelta()},
+        ).all()
 
-            bbox_gdf = gpd.GeoDataFrame(
+        for row in rows:
+            if row.stored != row.current:
+                LOGGER.info(f"measurements of box {row.boxId} changed before its watermark, recomputing its tours")
+            elif row.open_since is not None:
+                since[row.boxId] = pd.Timestamp(row.open_since)
+        return since
+
+    def store_tours(self, conn, tours, since, processed_until, thinning):
+        """
+        Replaces the persisted tours of every box starting at its `since`
+        with the recomputed ones and moves the watermarks of the boxes with
+        new measurements forward.
+        Args:
+            since (dict): Recompute time per box id, see `load_tour_state`.
+            processed_until (dict): Newest processed measurement per box id.
+        """
+        box_ids = list(since)
+        if self.db_engine.dialect.has_table(conn, "tours"):
+            # tours of boxes no longer in the campaign
+            conn.execute(
+                text("DELETE FROM tours WHERE tag = :tag AND NOT (boxid = ANY(:box_ids))"),
+                {"tag": self.campaign, "box_ids": box_ids},
+            )
+            conn.execute(
+                text("""
+                    DELETE FROM tours t
+                    USING unnest(CAST(:box_ids AS TEXT[]), CAST(:since AS TIMESTAMPTZ[])) AS s(boxid, since)
+                    WHERE t.tag = :tag AND t.boxid = s.boxid AND (s.since IS NULL OR t.start_time >= s.since)
+                """),
                 {
-                    "tag": [tag_value],
-                    "statistics": [stats],
-                    # add stats to the GeoDataFrame, like with the spread operator in js
-                    # **{f"{k}": [v] for k, v in stats.items()},
-                    "updatedAt": [pd.Timestamp.now()],
+                    "tag": self.campaign,
+                    "box_ids": box_ids,
+                    "since": [None if ts is None else ts.to_pydatetime() for ts in since.values()],
                 },
-                geometry=[convex_hull],
-                crs="EPSG:4326",
             )
-        
-            # Step 5: Upsert this data into the database, overwrite if exists (by tag). the tag is the primary key
-            with self.db_engine.begin() as conn:
-                # Check if the table exists
-                if not self.db_engine.dialect.has_table(conn, "statistics"):
-                    # Create the table if it doesn't exist
-                    bbox_gdf.to_postgis(
-                        name="statistics",
-                        con=conn,
-                        if_exists="replace",
-                        index=False,
-                        dtype={"geometry": "geometry(Polygon, 4326)"},
-                    )
-                else:
-                    # Upsert the data: delete the existing row with the same tag and insert the new one
-                    sql = text("DELETE FROM statistics WHERE tag IN :ids")
-                    conn.execute(
-                        sql,
-                        {"ids": tuple(ids_to_delete)},
-                    )
-                    bbox_gdf.to_postgis(
-                        name="statistics",
-                        con=conn,
-                        if_exists="append",
-                        index=False,
-                        dtype={"geometry": "geometry(Polygon, 4326)"},
-                    )
-
-
-            outputs = {
-                "campaign": self.campaign,
-                "status": "success",
-                "message": f"Calculated statistics for campaign '{self.campaign}'",
-                "statistics": stats
+
+        if not tours.empty:
+            tours.assign(tag=self.campaign).to_postgis(
+                name="tours",
+                con=conn,
+                if_exists="append",
+                index=False,
+                dtype={"geometry": "geometry(LineString, 4326)"},
+            )
+            conn.execute(text("CREATE INDEX IF NOT EXISTS tours_tag_start_time_idx ON tours (tag, start_time)"))
+
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+                tag TEXT NOT NULL,
+                boxid TEXT NOT NULL,
+                "processedUntil" TIMESTAMPTZ NOT NULL,
+                n_points BIGINT NOT NULL,
+                thinning TEXT NOT NULL,
+                PRIMARY KEY (tag, boxid)
+            )
+        """))
+        conn.execute(
+            text(f"DELETE FROM {WATERMARK_TABLE} WHERE tag = :tag AND (NOT (boxid = ANY(:box_ids)) OR thinning <> :thinning)"),
+            {"tag": self.campaign, "box_ids": box_ids, "thinning": thinning},
+        )
+        if processed_until:
+            # the count up to the watermark detects measurements added before it
+            conn.execute(
+                text(f"""
+                    INSERT INTO {WATERMARK_TABLE} (tag, boxid, "processedUntil", n_points, thinning)
+                    SELECT :tag, w.boxid, w.until, count(*), :thinning
+                    FROM unnest(CAST(:box_ids AS TEXT[]), CAST(:until AS TIMESTAMPTZ[])) AS w(boxid, until)
+                    JOIN osem_bike_data o ON o."boxId" = w.boxid AND o."createdAt" <= w.until
+                    GROUP BY w.boxid, w.until
+                    ON CONFLICT (tag, boxid) DO UPDATE
+                    SET "processedUntil" = EXCLUDED."processedUntil", n_points = EXCLUDED.n_points,
+                        thinning = EXCLUDED.thinning
+                """),
+                {
+                    "tag": self.campaign,
+                    "thinning": thinning,
+                    "box_ids": list(processed_until),
+                    "until": [ts.to_pydatetime() for ts in processed_until.values()],
+                },
+            )
+
+    def load_tours(self, conn):
+        tours = pd.read_sql(
+            text("SELECT boxid, tour, start_time, end_time, duration, distance, kcal FROM tours WHERE tag = :tag"),
+            conn,
+            params={"tag": self.campaign},
+        )
+        tours["start_time"] = pd.to_datetime(tours["start_time"])
+        tours["end_time"] = pd.to_datetime(tours["end_time"])
+        return tours
+
+    def load_previous_hull(self, conn):
+        # kept apart from the statistics table, time windows of the campaign overwrite its row
+        if not self.db_engine.dialect.has_table(conn, HULL_TABLE):
+            return None
+        hull = gpd.read_postgis(
+            text(f"SELECT geometry FROM {HULL_TABLE} WHERE tag = :tag"),
+            conn,
+            geom_col="geometry",
+            params={"tag": self.campaign},
+        )
+        return hull.geometry.iloc[0] if len(hull) > 0 else None
+
+    def store_hull(self, conn, hull):
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {HULL_TABLE} (tag TEXT PRIMARY KEY, geometry geometry(Geometry, 4326))"))
+        if hull is None:
+            conn.execute(text(f"DELETE FROM {HULL_TABLE} WHERE tag = :tag"), {"tag": self.campaign})
+            return
+        conn.execute(
+            text(f"""
+                INSERT INTO {HULL_TABLE} (tag, geometry) VALUES (:tag, ST_GeomFromText(:wkt, 4326))
+                ON CONFLICT (tag) DO UPDATE SET geometry = EXCLUDED.geometry
+            """),
+            {"tag": self.campaign, "wkt": hull.wkt},
+        )
+
+    def execute(self, data):
+        # check params
+        self.check_request_params(data)
+        thinning = data.get("thinning", "dbscan")
+        if thinning not in THINNING_METHODS:
+            msg = f"unknown thinning method '{thinning}', valid values are {list(THINNING_METHODS)}"
+            LOGGER.error(msg)
+            raise ProcessorExecuteError(msg)
+
+        # campaign wide statistics are maintained incrementally from the persisted tours,
+        # time windows and explicit boxIds are computed from scratch
+        incremental = self.campaign is not None and self.t_start is None and self.t_end is None
+
+        # Step 1: Load raw bike data, per box only what is newer than its last run if possible
+        box_since = {}
+        if incremental:
+            box_since = {box_id: None for box_id in self.metatable.boxes_of(self.campaign)}
+            if not data.get("full_refresh", False):
+                with self.db_engine.connect() as conn:
+                    box_since = self.load_tour_state(conn, box_since, thinning)
+        # continued boxes only load and recompute their tours from their own start on
+        continued = any(ts is not None for ts in box_since.values())
+
+        atrai_bike_data = self.load_bike_data(since=box_since if continued else None)
+
+        if len(atrai_bike_data) == 0 and not continued:
+            raise ProcessorExecuteError("No data found for the given tag")
+
+        # Step 2: Calculate convex hull of the loaded points, merged with the previous hull below
+        hull = convex_hull(atrai_bike_data.geometry.values)
+
+        # Step 3: Process tours
+        tours = process_tours(
+            atrai_bike_data,
+            interval=self.tour_interval,
+            thinning=thinning
+        )
+
+        if incremental:
+            # the running tour number restarts with every run, the start time is unique per box
+            tours["tour"] = "tour_" + pd.to_datetime(tours["start_time"]).dt.strftime("%Y%m%dT%H%M%S")
+            processed_until = {
+                box_id: pd.Timestamp(until)
+                for box_id, until in pd.to_datetime(atrai_bike_data["createdAt"]).groupby(atrai_bike_data["boxId"]).max().items()
             }
+            with self.db_engine.begin() as conn:
+                self.store_tours(conn, tours, box_since, processed_until, thinning)
+                if continued:
+                    previous_hull = self.load_previous_hull(conn)
+                    if previous_hull is not None:
+                        hull = previous_hull if hull is None else \
+                            GeometryCollection([previous_hull, hull]).convex_hull
+                self.store_hull(conn, hull)
+                tours = self.load_tours(conn)
+
+        stats = tour_stats(tours)
+
+        # Step 4: Create GeoDataFrame containing one row with the bounding box and all the statistics
+        tag_value = self.campaign if self.campaign is not None else self.boxId
+        if isinstance(tag_value, list):
+            ids_to_delete = tag_value
+        else:
+            ids_to_delete = [tag_value]
+
+        bbox_gdf = gpd.GeoDataFrame(
+            {
+                "tag": [tag_value],
+                "statistics": [stats],
+                # add stats to the GeoDataFrame, like with the spread operator in js
+                # **{f"{k}": [v] for k, v in stats.items()},
+                "updatedAt": [pd.Timestamp.now()],
+            },
+            geometry=[hull],
+            crs="EPSG:4326",
+        )
+
+        # Step 5: Upsert this data into the database, overwrite if exists (by tag). the tag is the primary key
+        with self.db_engine.begin() as conn:
+            # Check if the table exists
+            if not self.db_engine.dialect.has_table(conn, "statistics"):
+                # Create the table if it doesn't exist
+                bbox_gdf.to_postgis(
+                    name="statistics",
+                    con=conn,
+                    if_exists="replace",
+                    index=False,
+                    dtype={"geometry": "geometry(Polygon, 4326)"},
+                )
+            else:
+                # Upsert the data: delete the existing row with the same tag and insert the new one
+                sql = text("DELETE FROM statistics WHERE tag IN :ids")
+                conn.execute(
+                    sql,
+                    {"ids": tuple(ids_to_delete)},
+                )
+                bbox_gdf.to_postgis(
+                    name="statistics",
+                    con=conn,
+                    if_exists="append",
+                    index=False,
+                    dtype={"geometry": "geometry(Polygon, 4326)"},
+                )
+
+        outputs = {
+            "campaign": self.campaign,
+            "status": "success",
+            "message": f"Calculated statistics for campaign '{self.campaign}'",
+            "statistics": stats
+        }
 
-            return self.mimetype, outputs
-        finally:
-            self.db_engine.dispose()  # Ensure all connections are closed
+        return self.mimetype, outputs
 
     def __repr__(self):
         return f"<Statistics> {self.name}"
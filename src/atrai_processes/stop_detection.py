@@ -2,10 +2,7 @@ import pandas as pd
 import geopandas as gpd
 from shapely.geometry import Point
 from datetime import timedelta
-import movingpandas as mpd
-from movingpandas import TrajectoryCollection, TrajectoryStopDetector
 import logging
-import psycopg2 
 from sqlalchemy import text
 
 from config.db_config import DatabaseConfig 
@@ -72,6 +69,9 @@ def analyze_trajectories(gdf: gpd.GeoDataFrame, id_col: str, max_diam: float, mi
     """
     Creates TrajectoryCollection and runs Stop Detection, returning stop points.
     """
+    import movingpandas as mpd
+    from movingpandas import TrajectoryStopDetector
+
     if gdf.empty:
         return gpd.GeoDataFrame()
 
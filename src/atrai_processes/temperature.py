@@ -1,13 +1,15 @@
 import os
 import logging
 from pygeoapi.process.base import BaseProcessor, ProcessorExecuteError
+from .atrai_processor import AtraiProcessor
+from .map_points_to_road_network import map_points_to_road_segments
 
 import pandas as pd
-import folium
-from folium.plugins import HeatMap
+import geopandas as gpd
 
-from .useful_functs import filter_bike_data_location
+from .useful_functs import filter_bike_data_location, segment_rides
 from .html_helper import create_temperature_legend_html
+from .spatial_binning import bin_points, heatmap_cells
 
 LOGGER = logging.getLogger(__name__)
 
@@ -29,9 +31,16 @@ METADATA = {
         'hreflang': 'en-US'
     }],
     'inputs': {
-        'id': {
-            'title': 'boxid',
-            'description': 'boxid to get the data from',
+        'campaign': {
+            'title': 'campaign',
+            'description': 'campaign name',
+            'schema': {
+                'type': 'string'
+            }
+        },
+        'col_create': {
+            'title': 'col_create',
+            'description': 'create collection yes/ no',
             'schema': {
                 'type': 'string'
             }
@@ -62,7 +71,8 @@ METADATA = {
     },
     'example': {
         "inputs": {
-            "ids": "ABCDEF123456",
+            "campaign": "muenster",
+            "col_create": "true",
             "token": "ABC123XYZ666"
         }
     }
@@ -81,6 +91,9 @@ def get_season(month):
 
 #Function to generate heatmap
 def create_heatmap(data, title, file_name="Heatmap.html"):
+    import folium
+    from folium.plugins import HeatMap
+
     heatmap_data_temp = data[['lat', 'lng', 'Temperature']].dropna(subset=['Temperature', 'lat', 'lng'])
     heat_data_temp = heatmap_data_temp[['lat', 'lng', 'Temperature']].values
     m_temp = folium.Map(location=[51.9607, 7.6261], zoom_start=12)
@@ -91,64 +104,80 @@ def create_heatmap(data, title, file_name="Heatmap.html"):
 
     return m_temp
 
-def reset_first_time_diff(group):
-    group.iloc[0, group.columns.get_loc('time_diff')] = 0
-    
-    return group
-
 
-class Temperature(BaseProcessor):
+class Temperature(AtraiProcessor):
     def __init__(self, processor_def):
-
         super().__init__(processor_def, METADATA)
-        self.secret_token = os.environ.get('INT_API_TOKEN', 'token')
-        self.data_base_dir = '/pygeoapi/data'
-        self.html_out = '/pygeoapi/data/html'
 
 
     def execute(self, data):
-        mimetype =  'application/json'
-
-        self.boxid = data.get('id')
-        self.token = data.get('token')
-
-        if self.boxid is None:
-            raise ProcessorExecuteError('Cannot process without a id')
-        if self.token is None:
-            raise ProcessorExecuteError('Identify yourself with valid token!')
-
-        if self.token != self.secret_token:
-            LOGGER.error("WRONG INTERNAL API TOKEN")
-            raise ProcessorExecuteError('ACCESS DENIED wrong token')
-
-        #if self.boxid not in os.listdir(self.data_base_dir):
-        #    LOGGER.info(f'download data for {self.boxid}')
-        #    OSM = OpenSenseMap.OpenSenseMap()
-        #    OSM.add_box(self.boxid)
-        #    OSM.save_OSM()
-
-        #script
-        initial_data = pd.read_csv('/pygeoapi/combined_data.csv')
-        device_counts = initial_data.groupby('device_id').size()
+        self.check_request_params(data)
+        cached = self.memoized_result(data)
+        if cached is not None:
+            return cached
+        atrai_bike_data = self.load_bike_data()
+        road_segments = self.load_road_data()
+        atrai_bike_data['lng'] = atrai_bike_data['geometry'].x
+        atrai_bike_data['lat'] = atrai_bike_data['geometry'].y
+
+        device_counts = atrai_bike_data.groupby('boxId').size()
         valid_device_ids = device_counts[device_counts >= 10].index
-        atrai_bike_data = initial_data[initial_data['device_id'].isin(valid_device_ids)]
+        atrai_bike_data = atrai_bike_data[atrai_bike_data['boxId'].isin(valid_device_ids)]
+        atrai_bike_data = atrai_bike_data[['createdAt', 'Temperature', 'boxId', 'lng', 'lat', 'geometry']].copy()
 
         atrai_bike_data['createdAt'] = pd.to_datetime(atrai_bike_data['createdAt'])
-        filtered_data_MS = filter_bike_data_location(atrai_bike_data)
-
-        filtered_data_MS['Season'] = filtered_data_MS['createdAt'].dt.month.apply(get_season)
-        filtered_data_MS = filtered_data_MS.sort_values(by=['device_id', 'createdAt'])
-        filtered_data_MS['time_diff'] = filtered_data_MS.groupby('device_id')['createdAt'].diff().dt.total_seconds()
-        filtered_data_MS['ride_id'] = filtered_data_MS.groupby('device_id')['time_diff'].transform(lambda x: (x > 600).cumsum())
-        filtered_data_MS = filtered_data_MS.groupby(['device_id', 'ride_id']).apply(reset_first_time_diff)
-        filtered_data_MS = filtered_data_MS.reset_index(drop=True)
-        filtered_data_MS['ride_time'] = filtered_data_MS.groupby(['device_id', 'ride_id'])['time_diff'].cumsum()
-        filtered_data_MS['total_ride_duration'] = filtered_data_MS.groupby(['device_id', 'ride_id'])['ride_time'].transform('max')
-        filtered_data_MS = filtered_data_MS[filtered_data_MS['total_ride_duration'] >= 60]
-        filtered_time_data = filtered_data_MS[
-            (filtered_data_MS['ride_time'] > 60) &
-            (filtered_data_MS['ride_time'] < (filtered_data_MS['total_ride_duration'] - 60))
-        ]
+        # the bounding boxes (city area, reedu office) only apply to Münster
+        if self.campaign == 'muenster':
+            atrai_bike_data = filter_bike_data_location(atrai_bike_data)
+
+        filtered_data = atrai_bike_data
+        filtered_data['Season'] = filtered_data['createdAt'].dt.month.map(get_season)
+        filtered_data = segment_rides(filtered_data, device_column='boxId', max_gap=600)
+        filtered_data = filtered_data.reset_index(drop=True)
+        filtered_data = filtered_data[filtered_data['total_ride_duration'] >= 60]
+        filtered_time_data = filtered_data[
+            (filtered_data['ride_time'] > 60) &
+            (filtered_data['ride_time'] < (filtered_data['total_ride_duration'] - 60))
+        ].dropna(subset=['Temperature']).copy()
+        filtered_time_data['id'] = filtered_time_data.index
+
+        # seasonal average temperature per road segment
+        seasonal_segments = []
+        for season in ['Spring', 'Summer', 'Autumn', 'Winter']:
+            seasonal_data = filtered_time_data[filtered_time_data['Season'] == season]
+            if not seasonal_data.empty:
+                segments = map_points_to_road_segments(
+                    point_gdf=seasonal_data,
+                    road_segments=road_segments,
+                    numeric_columns=['Temperature'],
+                    id_column='id'
+                )
+                segments['Season'] = season
+                seasonal_segments.append(segments)
+
+        if not seasonal_segments:
+            raise ProcessorExecuteError('No temperature data found')
+
+        temperature_segments = gpd.GeoDataFrame(
+            pd.concat(seasonal_segments, ignore_index=True),
+            geometry='geometry',
+            crs='EPSG:4326'
+        )
+        temperature_segments['id'] = temperature_segments.index
+
+        # assign result to self.data
+        self.data = temperature_segments
+        self.create_collection_entries('temperature')
+
+        temperature_segments.to_postgis(
+            self.title,
+            self.db_engine,
+            if_exists="replace",
+            index=False
+        )
+        # update_config
+        if self.col_create:
+            self.update_config()
 
         os.makedirs(self.html_out, exist_ok=True)
 
@@ -157,21 +186,34 @@ class Temperature(BaseProcessor):
         for season in ['Spring', 'Summer', 'Autumn', 'Winter']:
             seasonal_data = filtered_time_data[filtered_time_data['Season'] == season]
             if not seasonal_data.empty:
-                file_name = os.path.join(self.html_out, f"{season}_Temperature_Heatmap_MS.html")
+                file_name = os.path.join(self.html_out, f"{season}_{self.title}_heatmap.html")
                 create_heatmap(
-                    seasonal_data,
+                    heatmap_cells(seasonal_data, 'Temperature'),
                     title=f"{season} Temperature Heatmap",
                     file_name=file_name
                 )
                 html_files.append(file_name)
 
+        # seasonal average temperature per grid cell at several zoom levels
+        temperature_grid = bin_points(filtered_time_data, ['Temperature'], group_columns=['Season'])
+        self.data = temperature_grid
+        self.create_collection_entries('temperature_grid')
+
+        temperature_grid.to_postgis(
+            self.title,
+            self.db_engine,
+            if_exists="replace",
+            index=False
+        )
+        if self.col_create:
+            self.update_config()
 
         outputs = {
             'id': 'Temperature',
-            'status': f"""created html files at '{', '.join(html_files)}'"""
+            'status': f"""Processed {len(temperature_segments)} seasonal road segments and {len(temperature_grid)} grid cells, created html files at '{', '.join(html_files)}'"""
         }
 
-        return mimetype, outputs
+        return self.memoize_result(self.mimetype, outputs)
 
     def __repr__(self):
         return f'<Temperature> {self.name}'
\ No newline at end of file
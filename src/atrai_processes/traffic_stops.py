@@ -103,12 +103,11 @@ class TrafficStops(AtraiProcessor):
         campaign_input = data.get('campaign')
     
         if campaign_input:
-            # Strip spaces and ensure strings match
-            self.metatable['location'] = self.metatable['location'].astype(str).str.strip()
+            # Strip spaces and ensure strings match, the metatable index is stripped on load
             search_val = str(campaign_input).strip()
-            
+
             # Find the IDs
-            matched_ids = self.metatable[self.metatable['location'] == search_val]['id'].tolist()
+            matched_ids = self.metatable.boxes_of(search_val)
             
             if matched_ids:
                 # Inject the found IDs into the 'data' object 
@@ -1,5 +1,5 @@
 import numpy as np
-from sklearn.neighbors import BallTree
+import pandas as pd
 
 def filter_bike_data_location(atrai_bike_data):
     # Fixed coordinates for filtering
@@ -20,6 +20,7 @@ def filter_bike_data_location(atrai_bike_data):
     return filtered_data
 
 def nearest_neighbor_search(filtered_data, edges_filtered):
+    from sklearn.neighbors import BallTree
 
     # for spatial operations:
     edges_projected = edges_filtered.to_crs("EPSG:3857")
@@ -43,6 +44,37 @@ def nearest_neighbor_search(filtered_data, edges_filtered):
     
     return filtered_data
 
+def segment_rides(data, device_column='boxId', time_column='createdAt', max_gap=600):
+    """
+    Splits the measurements of each device into rides in one vectorised pass.
+    A new ride starts whenever two consecutive measurements of a device are
+    more than `max_gap` seconds apart.
+
+    Adds the columns
+        time_diff: seconds since the previous measurement of the ride (0 at the start)
+        ride_id: ride number per device, starting at 0
+        ride_time: seconds since the start of the ride
+        total_ride_duration: duration of the whole ride in seconds
+
+    Returns:
+        pd.DataFrame: copy of the data sorted by device and time
+    """
+    data = data.sort_values(by=[device_column, time_column], kind='stable')
+    device = data[device_column]
+
+    time_diff = data.groupby(device_column)[time_column].diff().dt.total_seconds()
+    new_ride = time_diff > max_gap
+    ride_id = new_ride.groupby(device).cumsum()
+    time_diff = time_diff.mask(new_ride | time_diff.isna(), 0)
+    ride_time = time_diff.groupby([device, ride_id]).cumsum()
+
+    return data.assign(
+        time_diff=time_diff,
+        ride_id=ride_id,
+        ride_time=ride_time,
+        total_ride_duration=ride_time.groupby([device, ride_id]).transform('max'),
+    )
+
 def replace_outliers_with_nan_by_device(PM_data_no_outliers, column):
     def calculate_and_replace_outliers(group):
         Q1 = group[column].quantile(0.25)
@@ -56,4 +88,46 @@ def replace_outliers_with_nan_by_device(PM_data_no_outliers, column):
 
     PM_data_no_outliers = PM_data_no_outliers.groupby('boxId', group_keys=False).apply(calculate_and_replace_outliers)
     
-    return PM_data_no_outliers
\ No newline at end of file
+    return PM_data_no_outliers
+
+def bin_labels(bins):
+    return [f"{lower:g}-{upper:g}" for lower, upper in zip(bins[:-1], bins[1:])]
+
+def binned_counts(values, groups, bins):
+    """
+    Counts values into histogram bins per group in a single vectorised pass.
+    Bins follow np.histogram semantics: half-open intervals, last one closed.
+
+    Args:
+        values (array-like): Values to count, NaN values are ignored.
+        groups (array-like): Group key per value, same length as values.
+        bins (list): Monotonically increasing bin edges.
+
+    Returns:
+        pd.DataFrame: One integer column per bin, indexed by group key.
+    """
+    bins = np.asarray(bins, dtype=float)
+    n_bins = len(bins) - 1
+    x = np.asarray(values, dtype=float)
+    codes, uniques = pd.factorize(pd.Series(groups), sort=True)
+
+    bin_idx = np.digitize(x, bins) - 1
+    bin_idx[x == bins[-1]] = n_bins - 1
+    valid = (codes >= 0) & (bin_idx >= 0) & (bin_idx < n_bins)
+
+    counts = np.bincount(
+        codes[valid] * n_bins + bin_idx[valid],
+        minlength=len(uniques) * n_bins
+    ).reshape(len(uniques), n_bins)
+
+    return pd.DataFrame(counts, index=uniques, columns=bin_labels(bins))
+
+def format_binned_counts(counts):
+    """
+    Presentation helper joining the bin columns of `binned_counts` into the
+    comma separated string used by the map popups, e.g. '3, 0, 5, 1, 0'.
+    """
+    if counts.empty:
+        # agg over the rows of an empty frame returns a frame, not a series
+        return pd.Series(dtype=str, index=counts.index)
+    return counts.astype(str).agg(", ".join, axis=1)
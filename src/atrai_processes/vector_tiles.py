@@ -0,0 +1,140 @@
+import os
+import json
+import shutil
+import logging
+import tempfile
+from sqlalchemy import text
+
+from .spatial_binning import lnglat_to_tile
+
+LOGGER = logging.getLogger(__name__)
+
+# zoom range of the rendered tiles, clients overzoom beyond the max zoom
+TILE_MIN_ZOOM = int(os.environ.get('TILE_MIN_ZOOM', 10))
+TILE_MAX_ZOOM = int(os.environ.get('TILE_MAX_ZOOM', 16))
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+
+
+def field_types(gdf):
+    """
+    Attribute types of the vector layer in the tilejson notation.
+    """
+    fields = {}
+    for col, dtype in gdf.dtypes.items():
+        if col == gdf.geometry.name:
+            continue
+        if dtype.kind == 'b':
+            fields[col] = 'Boolean'
+        elif dtype.kind in 'iuf':
+            fields[col] = 'Number'
+        else:
+            fields[col] = 'String'
+    return fields
+
+
+def render_tiles(engine, table, gdf, out_dir, min_zoom=TILE_MIN_ZOOM, max_zoom=TILE_MAX_ZOOM):
+    """
+    Renders the features of a PostGIS table into Mapbox Vector Tiles with
+    ST_AsMVT and writes them to a tile store on disk. The layout
+    '{out_dir}/{table}/{z}/{y}/{x}.pbf' with a tippecanoe style
+    'metadata.json' is the one read by pygeoapi's MVT-tippecanoe provider.
+    Only tiles containing features are written, an existing tile store of
+    the table is replaced once all tiles are rendered.
+    Args:
+        engine (Engine): SQLAlchemy engine of the PostGIS database.
+        table (str): Table holding the features, also used as layer name.
+        gdf (gpd.GeoDataFrame): The data written to the table, provides the
+            attribute columns and the extent.
+        out_dir (str): Base directory of the tile stores.
+        min_zoom (int): Lowest rendered zoom level.
+        max_zoom (int): Highest rendered zoom level.
+    Returns:
+        tuple: (path of the tile store, number of written tiles)
+    """
+    fields = field_types(gdf)
+    columns = ", ".join(f't."{col}"' for col in fields)
+    min_x, min_y, max_x, max_y = [float(val) for val in gdf.total_bounds]
+
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"""CREATE INDEX IF NOT EXISTS "{table}_geometry_3857_idx" """
+            f"""ON "{table}" USING GIST (ST_Transform(geometry, 3857))"""
+        ))
+
+    sql = text(f"""
+        WITH tiles AS (
+            SELECT x, y, ST_TileEnvelope(:z, x, y) AS envelope
+            FROM generate_series(CAST(:x_min AS integer), CAST(:x_max AS integer)) AS x,
+                 generate_series(CAST(:y_min AS integer), CAST(:y_max AS integer)) AS y
+        )
+        SELECT tiles.x, tiles.y, mvt.tile
+        FROM tiles
+        CROSS JOIN LATERAL (
+            SELECT ST_AsMVT(features, :layer, {TILE_EXTENT}, 'geom') AS tile
+            FROM (
+                SELECT ST_AsMVTGeom(
+                    ST_Transform(t.geometry, 3857), tiles.envelope, {TILE_EXTENT}, {TILE_BUFFER}, true
+                ) AS geom{", " + columns if columns else ""}
+                FROM "{table}" t
+                WHERE ST_Transform(t.geometry, 3857) && tiles.envelope
+            ) features
+            WHERE features.geom IS NOT NULL
+        ) mvt
+        WHERE length(mvt.tile) > 0
+    """)
+
+    os.makedirs(out_dir, exist_ok=True)
+    tile_dir = os.path.join(out_dir, table)
+    staging_dir = tempfile.mkdtemp(prefix=f".{table}.", dir=out_dir)
+    n_tiles = 0
+    try:
+        with engine.connect() as conn:
+            for z in range(min_zoom, max_zoom + 1):
+                # tile rows grow southwards
+                x_min, y_max = lnglat_to_tile(min_x, min_y, z)
+                x_max, y_min = lnglat_to_tile(max_x, max_y, z)
+                rows = conn.execute(sql, {
+                    "z": z, "layer": table,
+                    "x_min": int(x_min), "x_max": int(x_max),
+                    "y_min": int(y_min), "y_max": int(y_max),
+                })
+                for x, y, tile in rows:
+                    path = os.path.join(staging_dir, str(z), str(y))
+                    os.makedirs(path, exist_ok=True)
+                    with open(os.path.join(path, f"{x}.pbf"), "wb") as f:
+                        f.write(tile)
+                    n_tiles += 1
+
+        metadata = {
+            "name": table,
+            "format": "pbf",
+            "minzoom": min_zoom,
+            "maxzoom": max_zoom,
+            "bounds": f"{min_x},{min_y},{max_x},{max_y}",
+            "center": f"{(min_x + max_x) / 2},{(min_y + max_y) / 2},{min_zoom}",
+            "json": json.dumps({"vector_layers": [{
+                "id": table,
+                "description": "",
+                "minzoom": min_zoom,
+                "maxzoom": max_zoom,
+                "fields": fields,
+            }]}),
+        }
+        with open(os.path.join(staging_dir, "metadata.json"), "w") as f:
+            json.dump(metadata, f)
+
+        # replace the previous tile store of the table
+        old_dir = None
+        if os.path.exists(tile_dir):
+            old_dir = tempfile.mkdtemp(prefix=f".{table}.old.", dir=out_dir)
+            os.rename(tile_dir, os.path.join(old_dir, table))
+        os.rename(staging_dir, tile_dir)
+        if old_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    LOGGER.debug(f"rendered {n_tiles} tiles for '{table}' into {tile_dir}")
+    return tile_dir, n_tiles
@@ -0,0 +1,68 @@
+"""
+WSGI entrypoint serving pygeoapi with the collections of the
+collection_registry table, used instead of pygeoapi.flask_app:APP when
+COLLECTION_REGISTRY=database.
+
+The registered collections are merged into the resources of the running
+API before a request is handled, cached for COLLECTION_REGISTRY_TTL
+seconds. New results show up without rewriting the config file and
+without reloading the workers.
+"""
+import os
+import time
+import logging
+
+from pygeoapi.flask_app import APP, api_
+
+from config.db_config import DatabaseConfig
+from . import resource_registry
+
+LOGGER = logging.getLogger(__name__)
+
+REGISTRY_TTL = float(os.environ.get("COLLECTION_REGISTRY_TTL", 10))
+
+# resources of the config file, they take precedence over registered ones
+STATIC_RESOURCES = set(api_.config["resources"])
+
+_engine = DatabaseConfig().get_engine()
+_registered = set()
+_refreshed_at = None
+
+
+def refresh_resources():
+    """
+    Syncs the registered collections into the resources of the API. The
+    resources dict is updated in place, it is shared with the API handlers.
+    """
+    global _registered, _refreshed_at
+
+    resources = resource_registry.load_resources(_engine)
+    resources = {name: res for name, res in resources.items() if name not in STATIC_RESOURCES}
+
+    config_resources = api_.config["resources"]
+    for name in _registered - set(resources):
+        config_resources.pop(name, None)
+    config_resources.update(resources)
+
+    _registered = set(resources)
+    _refreshed_at = time.monotonic()
+
+
+@APP.before_request
+def load_registered_collections():
+    global _refreshed_at
+
+    if _refreshed_at is not None and time.monotonic() - _refreshed_at < REGISTRY_TTL:
+        return
+    try:
+        refresh_resources()
+    except Exception as err:
+        # keep serving the last known collections, retry after the ttl
+        LOGGER.error(f"could not load the collection registry: {err}")
+        _refreshed_at = time.monotonic()
+
+
+try:
+    resource_registry.ensure_registry_table(_engine)
+except Exception as err:
+    LOGGER.error(f"could not create the collection registry table: {err}")
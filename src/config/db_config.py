@@ -1,6 +1,46 @@
 import os
+import threading
 from sqlalchemy import create_engine
 
+# one engine, and thereby one connection pool, per database url and process
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def get_shared_engine(db_url):
+    """
+    Returns the process wide engine of the given database url, creating it on
+    first use. The pool is configured via environment variables:
+    DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW, DATABASE_POOL_TIMEOUT (seconds)
+    and DATABASE_POOL_RECYCLE (seconds). Connections are checked with a ping
+    before they are handed out, so restarts of the database do not surface
+    as errors in the processes.
+    """
+    with _ENGINES_LOCK:
+        engine = _ENGINES.get(db_url)
+        if engine is None:
+            engine = create_engine(
+                db_url,
+                pool_size=int(os.getenv("DATABASE_POOL_SIZE", 5)),
+                max_overflow=int(os.getenv("DATABASE_MAX_OVERFLOW", 10)),
+                pool_timeout=int(os.getenv("DATABASE_POOL_TIMEOUT", 30)),
+                pool_recycle=int(os.getenv("DATABASE_POOL_RECYCLE", 1800)),
+                pool_pre_ping=True,
+            )
+            _ENGINES[db_url] = engine
+        return engine
+
+
+def _reset_engines_after_fork():
+    # connections inherited from the parent process must not be used by the
+    # child, drop them from the pools without closing them for the parent
+    for engine in _ENGINES.values():
+        engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_reset_engines_after_fork)
+
+
 class DatabaseConfig:
     def __init__(self):
         self.db_config = {
@@ -11,15 +51,17 @@ class DatabaseConfig:
             "port": os.getenv("DATABASE_PORT"),
         }
 
-    def get_engine(self):
-        db_url = 'postgresql://%s:%s@%s:%s/%s' % (
+    def get_db_url(self):
+        return 'postgresql://%s:%s@%s:%s/%s' % (
             self.db_config['user'],
             self.db_config['password'],
             self.db_config['host'],
             self.db_config['port'],
             self.db_config['dbname']
         )
-        return create_engine(db_url)
+
+    def get_engine(self):
+        return get_shared_engine(self.get_db_url())
 
     def get_db_config(self):
         return self.db_config